@@ -1,11 +1,11 @@
 # streamlit_app.py
 import streamlit as st
-import joblib
 import pandas as pd
 import os
 import matplotlib.pyplot as plt
 from matplotlib.patches import Ellipse, Polygon
-from wrapper import MultiTPOTWrapper
+from prediction_cache import get_cache
+from registry import get_registry
 from PIL import Image
 
 # =======================
@@ -17,22 +17,9 @@ os.makedirs(IMAGES_DIR, exist_ok=True)
 # =======================
 # Chargement des modèles
 # =======================
-@st.cache_resource
-def load_all_models(folder_path):
-    models = []
-    for file in sorted(os.listdir(folder_path)):
-        if file.endswith(".pkl"):
-            model_path = os.path.join(folder_path, file)
-            model = joblib.load(model_path)
-            models.append(model)
-    return models
-
-@st.cache_resource
-def get_target_names(folder_path):
-    return [
-        f.replace("pipeline_tpot_", "").replace(".pkl", "")
-        for f in sorted(os.listdir(folder_path)) if f.endswith(".pkl")
-    ]
+# Les deux jeux de modèles se chargent en arrière-plan dès le démarrage et
+# sont rechargés à chaud quand leurs fichiers changent
+registry = get_registry()
 
 # =======================
 # Fonction de dessin
@@ -313,15 +300,8 @@ st.title("📏 Prédiction de Silhouette")
 # 1. Sélection du sexe
 sexe = st.radio("Sexe :", ["Homme", "Femme"])
 
-# 2. Chargement des modèles
-if sexe == "Homme":
-    dossier_pipelines = "pipelines_all_dataset"
-else:
-    dossier_pipelines = "pipelines_female_complets"
-
-models = load_all_models(dossier_pipelines)
-target_names = get_target_names(dossier_pipelines)
-wrapper = MultiTPOTWrapper(models)
+# 2. Jeu de modèles du sexe choisi (attendu seulement au moment de prédire)
+cle_modeles = "homme" if sexe == "Homme" else "femme"
 
 # 3. Aide visuelle pour les catégories
 show_category_examples()
@@ -404,8 +384,14 @@ if submitted:
         }
 
     # Prédiction
-    preds = wrapper.predict(pd.DataFrame([input_data]))
-    predictions_dict = dict(zip(target_names, preds[0]))
+    # La version obtenue sert toute la requête, même si une autre est installée entre-temps
+    if not registry.is_ready(cle_modeles):
+        with st.spinner("Chargement des modèles..."):
+            version = registry.current(cle_modeles)
+    else:
+        version = registry.current(cle_modeles)
+    predictions_dict = get_cache().predict_one(version, cle_modeles, input_data)
+    st.caption(f"Modèles {version.key} version {version.version}")
 
     # Affichage des résultats
     st.header("📊 Résultats de prédiction")
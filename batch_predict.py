@@ -0,0 +1,217 @@
+# =======================
+# Prédiction par lots en ligne de commande (CSV / Parquet)
+# =======================
+# Lit un fichier d'entrée par blocs de taille fixe, prédit chaque bloc en un
+# seul appel vectorisé à MultiTPOTWrapper.predict dans un pool de processus,
+# et écrit un fichier de sortie par bloc (part-000000.csv, ...) dans le
+# dossier de sortie. Les colonnes de sortie suivent l'ordre des cibles.
+#
+# Chaque bloc est écrit de façon atomique : après un crash, relancer la même
+# commande reprend au premier bloc non terminé. Le manifeste garde
+# l'empreinte (SHA-256) des modèles : une reprise avec des modèles
+# réentraînés, ou avec un fichier d'entrée réécrit (taille, date), est
+# refusée au lieu de mélanger anciens et nouveaux blocs. Les blocs déjà
+# écrits ne sont pas reconvertis à la reprise.
+#
+# Usage :
+#   python batch_predict.py clients.csv sorties/ --sexe femme --workers 4
+#   python batch_predict.py clients.parquet sorties/ --sexe homme --fusionner predictions.csv
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+from threadpoolctl import threadpool_limits
+
+from bundle import empreinte_fichiers
+from schemas import SCHEMAS, colonnes_entree
+from wrapper import MultiTPOTWrapper, load_models
+
+MANIFESTE = "_manifest.json"
+
+# Wrapper chargé une fois par processus worker
+_WORKER = {}
+
+
+def lire_blocs(chemin, taille_bloc, colonnes, sep=";", faits=frozenset()):
+    """Itère sur les (index, DataFrame) des blocs d'un fichier CSV ou Parquet.
+
+    Les blocs de `faits` (terminés lors d'une exécution précédente) donnent
+    (index, None) sans être convertis ; en CSV, les blocs terminés en tête
+    de fichier sont sautés sans analyse des champs.
+    """
+    if chemin.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        fichier = pq.ParquetFile(chemin, memory_map=True)
+        for index, batch in enumerate(fichier.iter_batches(batch_size=taille_bloc, columns=colonnes)):
+            yield index, None if index in faits else batch.to_pandas()
+        return
+    debut = 0
+    while debut in faits:
+        debut += 1
+    lecteur = pd.read_csv(chemin, sep=sep, usecols=colonnes, chunksize=taille_bloc, encoding="utf-8-sig",
+                          skiprows=range(1, debut * taille_bloc + 1) if debut else None)
+    for index, bloc in enumerate(lecteur, start=debut):
+        yield index, None if index in faits else bloc
+
+
+def blocs_faits(dossier, format_sortie):
+    """Index des blocs déjà écrits dans le dossier de sortie."""
+    suffixe = "." + format_sortie
+    return {int(f[len("part-"):-len(suffixe)]) for f in os.listdir(dossier)
+            if f.startswith("part-") and f.endswith(suffixe)}
+
+
+def empreinte_entree(chemin):
+    """Chemin, taille et date du fichier d'entrée : une reprise doit relire le même fichier."""
+    stat = os.stat(chemin)
+    return {"chemin": os.path.abspath(chemin), "taille": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def nom_bloc(dossier, index, format_sortie):
+    return os.path.join(dossier, f"part-{index:06d}.{format_sortie}")
+
+
+def ecrire_atomique(df, chemin, format_sortie, sep=";"):
+    tmp = chemin + ".tmp"
+    if format_sortie == "parquet":
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_csv(tmp, sep=sep, index=False)
+    os.replace(tmp, chemin)
+
+
+def _init_worker(dossier, threads):
+    threadpool_limits(limits=threads)
+    models, target_names = load_models(dossier)
+    _WORKER["wrapper"] = MultiTPOTWrapper(models, shared_preprocess=True, target_names=target_names)
+
+
+def _predire_bloc(index, bloc, colonnes_modele, colonnes_gardees, chemin, format_sortie, sep):
+    wrapper = _WORKER["wrapper"]
+    preds = wrapper.predict(bloc[colonnes_modele])
+    sortie = pd.DataFrame(preds, columns=wrapper.target_names, index=bloc.index)
+    if colonnes_gardees:
+        sortie = pd.concat([bloc[colonnes_gardees], sortie], axis=1)
+    ecrire_atomique(sortie, chemin, format_sortie, sep)
+    return index, len(bloc)
+
+
+def empreinte_modeles(dossier):
+    """Noms et SHA-256 des fichiers d'un jeu de modèles (dossier de .pkl ou bundle)."""
+    if os.path.isfile(dossier):
+        chemins = [dossier]
+    else:
+        chemins = [os.path.join(dossier, f) for f in sorted(os.listdir(dossier)) if f.endswith(".pkl")]
+    return {"fichiers": [os.path.basename(c) for c in chemins], "sha256": empreinte_fichiers(chemins)}
+
+
+def verifier_manifeste(dossier_sortie, manifeste):
+    """Écrit le manifeste, ou vérifie qu'une reprise utilise les mêmes réglages."""
+    chemin = os.path.join(dossier_sortie, MANIFESTE)
+    if os.path.exists(chemin):
+        with open(chemin, encoding="utf-8") as f:
+            existant = json.load(f)
+        if existant.get("entree") != manifeste["entree"]:
+            raise SystemExit(
+                f"{manifeste['entree']['chemin']} a changé depuis l'écriture des blocs de {dossier_sortie} ; "
+                "utilisez un autre dossier de sortie ou supprimez-le."
+            )
+        if existant.get("modeles") != manifeste["modeles"]:
+            raise SystemExit(
+                f"Les modèles de {manifeste['dossier']} ont changé depuis l'écriture des blocs de "
+                f"{dossier_sortie} ; utilisez un autre dossier de sortie ou supprimez-le."
+            )
+        if existant != manifeste:
+            raise SystemExit(
+                f"{chemin} a été créé avec d'autres réglages ; "
+                "utilisez un autre dossier de sortie ou supprimez-le."
+            )
+    else:
+        with open(chemin, "w", encoding="utf-8") as f:
+            json.dump(manifeste, f, indent=2, ensure_ascii=False)
+
+
+def fusionner(dossier_sortie, format_sortie, destination, sep=";"):
+    """Concatène les blocs dans l'ordre en un seul fichier."""
+    parts = sorted(f for f in os.listdir(dossier_sortie)
+                   if f.startswith("part-") and f.endswith("." + format_sortie))
+    if destination.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        for part in parts:
+            chemin = os.path.join(dossier_sortie, part)
+            df = pd.read_parquet(chemin) if format_sortie == "parquet" else pd.read_csv(chemin, sep=sep)
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            writer = writer or pq.ParquetWriter(destination, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+    else:
+        with open(destination, "w", encoding="utf-8") as out:
+            for k, part in enumerate(parts):
+                chemin = os.path.join(dossier_sortie, part)
+                df = pd.read_parquet(chemin) if format_sortie == "parquet" else pd.read_csv(chemin, sep=sep)
+                df.to_csv(out, sep=sep, index=False, header=(k == 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prédiction par lots avec MultiTPOTWrapper")
+    parser.add_argument("entree", help="Fichier .csv (séparateur --sep) ou .parquet")
+    parser.add_argument("sortie", help="Dossier des blocs de sortie")
+    parser.add_argument("--sexe", choices=sorted(SCHEMAS), required=True)
+    parser.add_argument("--dossier", help="Dossier de pipelines ou bundle (défaut : dossier du sexe)")
+    parser.add_argument("--taille-bloc", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--format", dest="format_sortie", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--sep", default=";")
+    parser.add_argument("--garder", nargs="*", default=[],
+                        help="Colonnes d'entrée recopiées en tête de sortie (ex. identifiant client)")
+    parser.add_argument("--fusionner", help="Fichier unique écrit à la fin à partir des blocs")
+    args = parser.parse_args()
+
+    dossier = args.dossier or SCHEMAS[args.sexe]["dossier"]
+    colonnes_modele = colonnes_entree(args.sexe)
+    colonnes = colonnes_modele + [c for c in args.garder if c not in colonnes_modele]
+
+    os.makedirs(args.sortie, exist_ok=True)
+    verifier_manifeste(args.sortie, {
+        "entree": empreinte_entree(args.entree),
+        "dossier": os.path.abspath(dossier),
+        "taille_bloc": args.taille_bloc,
+        "format": args.format_sortie,
+        "colonnes_gardees": args.garder,
+        "modeles": empreinte_modeles(dossier),
+    })
+
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    en_cours = set()
+    faits, lignes = 0, 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(dossier, threads)) as pool:
+        faits_avant = blocs_faits(args.sortie, args.format_sortie)
+        for index, bloc in lire_blocs(args.entree, args.taille_bloc, colonnes, args.sep, faits_avant):
+            if bloc is None:
+                continue  # bloc terminé lors d'une exécution précédente
+            chemin = nom_bloc(args.sortie, index, args.format_sortie)
+            # Mémoire bornée : au plus deux blocs en attente par worker.
+            if len(en_cours) >= 2 * args.workers:
+                termines, en_cours = wait(en_cours, return_when=FIRST_COMPLETED)
+                for future in termines:
+                    faits, lignes = faits + 1, lignes + future.result()[1]
+            en_cours.add(pool.submit(_predire_bloc, index, bloc, colonnes_modele, args.garder,
+                                     chemin, args.format_sortie, args.sep))
+        for future in wait(en_cours).done:
+            faits, lignes = faits + 1, lignes + future.result()[1]
+
+    print(f"✅ {faits} bloc(s) prédits ({lignes} lignes) dans {args.sortie}", file=sys.stderr)
+    if args.fusionner:
+        fusionner(args.sortie, args.format_sortie, args.fusionner, args.sep)
+        print(f"✔ Fichier fusionné : {args.fusionner}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# =======================
+# Benchmark : inférence parallèle par cible (MultiTPOTWrapper n_jobs)
+# =======================
+# Mesure, pour n_jobs = 1, 2, 4, ... N :
+#   - la latence d'une prédiction d'une ligne (p50 / p95),
+#   - le débit (prédictions/s) avec plusieurs sessions concurrentes,
+#     comme plusieurs utilisateurs Streamlit sur le même serveur.
+#
+# Usage :
+#   python bench_parallel.py --sexe homme --max-jobs 8 --sessions 4 > bench_output.txt
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from schemas import SCHEMAS
+from wrapper import MultiTPOTWrapper, load_models
+
+
+def mesurer_latence(wrapper, X, repetitions):
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        wrapper.predict(X)
+        durees.append(time.perf_counter() - debut)
+    return np.percentile(durees, 50) * 1000, np.percentile(durees, 95) * 1000
+
+
+def mesurer_debit(wrapper, X, sessions, duree):
+    """Nombre de prédictions par seconde avec `sessions` threads clients."""
+    compteurs = [0] * sessions
+    fin = time.perf_counter() + duree
+
+    def client(k):
+        while time.perf_counter() < fin:
+            wrapper.predict(X)
+            compteurs[k] += 1
+
+    threads = [threading.Thread(target=client, args=(k,)) for k in range(sessions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(compteurs) / duree
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de MultiTPOTWrapper selon n_jobs")
+    parser.add_argument("--sexe", choices=sorted(SCHEMAS), default="homme")
+    parser.add_argument("--dossier", help="Dossier de pipelines (défaut : celui du sexe)")
+    parser.add_argument("--backend", choices=["threads", "processes"], default="threads")
+    parser.add_argument("--max-jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--lignes", type=int, default=1, help="Lignes par appel à predict")
+    parser.add_argument("--repetitions", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--duree", type=float, default=5.0, help="Durée de la mesure de débit (s)")
+    args = parser.parse_args()
+
+    schema = SCHEMAS[args.sexe]
+    models, target_names = load_models(args.dossier or schema["dossier"])
+    X = pd.DataFrame([schema["exemple"]] * args.lignes)
+
+    n_jobs_list = []
+    n = 1
+    while n < args.max_jobs:
+        n_jobs_list.append(n)
+        n *= 2
+    n_jobs_list.append(args.max_jobs)
+
+    print(f"{len(models)} modèles ({args.sexe}), backend={args.backend}, "
+          f"{args.lignes} ligne(s)/appel, {args.sessions} sessions, {os.cpu_count()} cœurs")
+    print(f"{'n_jobs':>6} {'p50 (ms)':>10} {'p95 (ms)':>10} {'débit (pred/s)':>15} {'accélération':>13}")
+    reference = None
+    for n_jobs in n_jobs_list:
+        wrapper = MultiTPOTWrapper(models, shared_preprocess=True, target_names=target_names,
+                                   n_jobs=n_jobs, backend=args.backend)
+        wrapper.predict(X)  # échauffement (création du pool)
+        p50, p95 = mesurer_latence(wrapper, X, args.repetitions)
+        debit = mesurer_debit(wrapper, X, args.sessions, args.duree)
+        reference = reference or debit
+        print(f"{n_jobs:>6} {p50:>10.2f} {p95:>10.2f} {debit:>15.1f} {debit / reference:>12.2f}x")
+        wrapper.close()
+
+
+if __name__ == "__main__":
+    main()
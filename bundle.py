@@ -0,0 +1,203 @@
+# =======================
+# Format "bundle" : un fichier par jeu de modèles
+# =======================
+# Un bundle est une archive tar non compressée contenant :
+#   - manifest.json : ordre des cibles, schéma d'entrée, sexe, empreinte du
+#     jeu d'entraînement, versions des bibliothèques ;
+#   - modeles/<cible>.pkl : le pipeline picklé (protocole 5) ;
+#   - modeles/<cible>.<k>.buf : les gros tableaux numpy du pipeline, sortis
+#     du pickle ("out-of-band") et stockés bruts.
+#
+# Les données d'un membre tar sont contiguës et alignées sur 512 octets :
+# au chargement, le fichier est ouvert en mmap et les tableaux sont
+# reconstruits directement sur les pages du fichier (lecture seule), comme
+# avec joblib.load(..., mmap_mode="r"). Plusieurs processus qui chargent le
+# même bundle partagent donc ces pages.
+#
+# Usage :
+#   python bundle.py empaqueter pipelines_all_dataset bundles/homme.bundle --sexe homme --donnees data/caesar_fr.csv
+#   python bundle.py inspecter bundles/homme.bundle
+import argparse
+import hashlib
+import io
+import json
+import mmap
+import os
+import pickle
+import platform
+import tarfile
+import time
+from importlib import metadata
+
+from schemas import SCHEMAS, sexe_du_dossier
+
+FORMAT = 1
+MANIFESTE = "manifest.json"
+# Les tampons plus petits restent dans le pickle.
+SEUIL_TAMPON = 64 * 1024
+BIBLIOTHEQUES = ["numpy", "pandas", "scikit-learn", "joblib", "xgboost", "lightgbm", "TPOT", "threadpoolctl"]
+
+
+def versions_bibliotheques():
+    versions = {"python": platform.python_version()}
+    for nom in BIBLIOTHEQUES:
+        try:
+            versions[nom] = metadata.version(nom)
+        except metadata.PackageNotFoundError:
+            versions[nom] = None
+    return versions
+
+
+def empreinte_fichiers(chemins):
+    """SHA-256 du contenu des fichiers de données d'entraînement."""
+    h = hashlib.sha256()
+    for chemin in chemins:
+        with open(chemin, "rb") as f:
+            for bloc in iter(lambda: f.read(1 << 20), b""):
+                h.update(bloc)
+    return h.hexdigest()
+
+
+def _ajouter(tar, nom, donnees):
+    info = tarfile.TarInfo(nom)
+    info.size = len(donnees)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(donnees))
+
+
+def empaqueter(dossier, destination, sexe=None, donnees=(), seuil=SEUIL_TAMPON):
+    """Écrit le bundle d'un dossier de pipelines .pkl et renvoie son manifeste."""
+    from wrapper import load_models, split_preprocess
+
+    sexe = sexe or sexe_du_dossier(dossier)
+    models, target_names = load_models(dossier)
+    preprocess, _ = split_preprocess(models[0])
+    schema_entree = {"colonnes": list(getattr(preprocess, "feature_names_in_", []))}
+    if sexe in SCHEMAS:
+        schema_entree["colonnes_num"] = SCHEMAS[sexe]["colonnes_num"]
+        schema_entree["colonnes_cat"] = SCHEMAS[sexe]["colonnes_cat"]
+
+    manifeste = {
+        "format": FORMAT,
+        "sexe": sexe,
+        "source": os.path.normpath(dossier),
+        "cibles": target_names,
+        "schema_entree": schema_entree,
+        "donnees_entrainement": {
+            "fichiers": [os.path.normpath(d) for d in donnees],
+            "sha256": empreinte_fichiers(donnees) if donnees else None,
+        },
+        "versions": versions_bibliotheques(),
+        "modeles": {},
+    }
+
+    tmp = destination + ".tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+    with tarfile.open(tmp, "w", format=tarfile.PAX_FORMAT) as tar:
+        for cible, model in zip(target_names, models):
+            tampons = []
+
+            def hors_pickle(tampon):
+                # Valeur fausse = tampon sorti du pickle
+                if tampon.raw().nbytes >= seuil:
+                    tampons.append(tampon)
+                    return False
+                return True
+
+            donnees_pickle = pickle.dumps(model, protocol=5, buffer_callback=hors_pickle)
+            membre = f"modeles/{cible}.pkl"
+            _ajouter(tar, membre, donnees_pickle)
+            noms_tampons = []
+            for k, tampon in enumerate(tampons):
+                nom = f"modeles/{cible}.{k}.buf"
+                _ajouter(tar, nom, tampon.raw())
+                noms_tampons.append(nom)
+            manifeste["modeles"][cible] = {
+                "pickle": membre,
+                "tampons": noms_tampons,
+                "octets": len(donnees_pickle) + sum(t.raw().nbytes for t in tampons),
+            }
+        _ajouter(tar, MANIFESTE, json.dumps(manifeste, indent=2, ensure_ascii=False).encode("utf-8"))
+    os.replace(tmp, destination)
+    return manifeste
+
+
+class ModelBundle:
+    """Lecture paresseuse d'un bundle : chaque cible est dépicklée à la demande.
+
+    Le fichier reste ouvert en mmap tant que des modèles en dépendent ;
+    close() ne doit être appelé qu'une fois ces modèles libérés.
+    """
+
+    def __init__(self, chemin):
+        self.chemin = chemin
+        self._fichier = open(chemin, "rb")
+        self._mmap = mmap.mmap(self._fichier.fileno(), 0, access=mmap.ACCESS_READ)
+        with tarfile.open(chemin, "r") as tar:
+            self._membres = {m.name: (m.offset_data, m.size) for m in tar.getmembers()}
+        self.manifeste = json.loads(self._lire(MANIFESTE))
+        if self.manifeste["format"] != FORMAT:
+            raise ValueError(f"Format de bundle non supporté : {self.manifeste['format']}")
+        self.target_names = self.manifeste["cibles"]
+        self.temps_chargement = {}
+        self._modeles = {}
+
+    def _vue(self, membre):
+        debut, taille = self._membres[membre]
+        return memoryview(self._mmap)[debut:debut + taille]
+
+    def _lire(self, membre):
+        return bytes(self._vue(membre))
+
+    def charger(self, cible):
+        """Renvoie le modèle d'une cible, en le chargeant au premier appel."""
+        if cible not in self._modeles:
+            debut = time.perf_counter()
+            entree = self.manifeste["modeles"][cible]
+            tampons = [self._vue(nom) for nom in entree["tampons"]]
+            self._modeles[cible] = pickle.loads(self._lire(entree["pickle"]), buffers=tampons)
+            self.temps_chargement[cible] = time.perf_counter() - debut
+        return self._modeles[cible]
+
+    def modeles(self):
+        """Tous les modèles, dans l'ordre des cibles du manifeste."""
+        return [self.charger(cible) for cible in self.target_names]
+
+    def close(self):
+        self._modeles.clear()
+        self._mmap.close()
+        self._fichier.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bundles de modèles (un fichier par jeu)")
+    sous = parser.add_subparsers(dest="action", required=True)
+    p = sous.add_parser("empaqueter", help="Crée un bundle à partir d'un dossier de .pkl")
+    p.add_argument("dossier")
+    p.add_argument("destination")
+    p.add_argument("--sexe", choices=sorted(SCHEMAS))
+    p.add_argument("--donnees", nargs="*", default=[], help="Fichiers du jeu d'entraînement à hacher")
+    p = sous.add_parser("inspecter", help="Affiche le manifeste et les temps de chargement")
+    p.add_argument("bundle")
+    args = parser.parse_args()
+
+    if args.action == "empaqueter":
+        manifeste = empaqueter(args.dossier, args.destination, args.sexe, args.donnees)
+        print(f"✔ Bundle écrit : {args.destination} ({len(manifeste['cibles'])} cibles)")
+        return
+
+    bundle = ModelBundle(args.bundle)
+    m = bundle.manifeste
+    print(f"Sexe : {m['sexe']}  |  source : {m['source']}  |  données : {m['donnees_entrainement']['sha256']}")
+    print("Versions : " + ", ".join(f"{k}={v}" for k, v in m["versions"].items()))
+    debut = time.perf_counter()
+    bundle.modeles()
+    for cible in bundle.target_names:
+        entree = m["modeles"][cible]
+        print(f"  {cible:<55} {entree['octets'] / 1e6:>8.2f} Mo  {bundle.temps_chargement[cible] * 1000:>8.1f} ms"
+              f"  ({len(entree['tampons'])} tampons mmap)")
+    print(f"Chargement total : {(time.perf_counter() - debut) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
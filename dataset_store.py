@@ -0,0 +1,172 @@
+# =======================
+# Stockage colonnaire typé des jeux de données de data/
+# =======================
+# Chaque source CSV (séparateur ";", parfois avec BOM) est convertie une
+# fois en fichier Arrow IPC (Feather v2, non compressé) dans data/store/,
+# avec un schéma explicite :
+#   - colonnes texte en dictionnaire (catégories pandas) ;
+#   - entiers sans valeur manquante réduits au plus petit type signé ;
+#   - flottants en float64, comme lus par les notebooks.
+# Le fichier non compressé est ouvert en mmap : charger() ne lit que les
+# colonnes demandées, sans copie ni analyse de texte.
+#
+# La taille et la date du CSV source sont gardées dans les métadonnées du
+# schéma ; si la source change, la conversion est refaite au chargement.
+#
+# Les sources "genere" n'ont pas de CSV : leur fichier Arrow est écrit
+# directement par le script indiqué (corps synthétiques de synthetic.py)
+# et se lit avec charger() comme les autres.
+#
+# Usage :
+#   python dataset_store.py convertir              # toutes les sources
+#   python dataset_store.py convertir caesar_fr ansur_ii_male
+#   python dataset_store.py info
+#
+#   from dataset_store import charger
+#   df = charger("caesar_fr", colonnes=["taille", "weight", "tour_de_poitrine"])
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+RACINE = os.path.dirname(os.path.abspath(__file__))
+DOSSIER_STORE = os.path.join(RACINE, "data", "store")
+
+SOURCES = {
+    "caesar": {"fichier": "data/caesar.csv"},
+    "caesar_fr": {"fichier": "data/caesar_fr.csv"},
+    "caesar_all_fr": {"fichier": "data/caesar_all_fr.csv"},
+    "ansur_ii_male": {"fichier": "data/ANSUR_II_MALE.csv"},
+    "ansur_ii_female": {"fichier": "data/ANSUR_II_FEMALE.csv"},
+    "bdims": {"fichier": "data/bdims.csv"},
+    "body_measurements": {"fichier": "data/Body Measurements _ original_CSV.csv"},
+    "male_body_syn": {"fichier": "data/male_body_syn.csv"},
+    "women_body_syn": {"fichier": "data/women body syn.csv"},
+    "synthetique_homme": {"genere": "python synthetic.py generer --sexe homme"},
+    "synthetique_femme": {"genere": "python synthetic.py generer --sexe femme"},
+}
+
+
+def sources_csv():
+    """Sources converties depuis un CSV (les autres sont écrites par leur générateur)."""
+    return [nom for nom, source in SOURCES.items() if "fichier" in source]
+
+
+def chemin_store(nom, dossier=DOSSIER_STORE):
+    return os.path.join(dossier, f"{nom}.arrow")
+
+
+def _signature_source(chemin):
+    stat = os.stat(chemin)
+    return {"taille": str(stat.st_size), "mtime": str(int(stat.st_mtime))}
+
+
+def _type_colonne(serie):
+    """Type Arrow explicite d'une colonne lue par pandas."""
+    if pd.api.types.is_integer_dtype(serie):
+        for dtype, type_arrow in ((np.int8, pa.int8()), (np.int16, pa.int16()), (np.int32, pa.int32())):
+            info = np.iinfo(dtype)
+            if serie.empty or (serie.min() >= info.min and serie.max() <= info.max):
+                return type_arrow
+        return pa.int64()
+    if pd.api.types.is_float_dtype(serie):
+        return pa.float64()
+    if pd.api.types.is_bool_dtype(serie):
+        return pa.bool_()
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+def schema_source(df):
+    return pa.schema([pa.field(colonne, _type_colonne(df[colonne])) for colonne in df.columns])
+
+
+def convertir(nom, dossier=DOSSIER_STORE, sep=";"):
+    """Convertit une source CSV en fichier Arrow typé et renvoie son schéma."""
+    source = os.path.join(RACINE, SOURCES[nom]["fichier"])
+    df = pd.read_csv(source, sep=SOURCES[nom].get("sep", sep), encoding="utf-8-sig", low_memory=False)
+    # Certains en-têtes ont des espaces parasites ("ChestWidth ")
+    df.columns = [str(c).strip() for c in df.columns]
+    for colonne in df.columns[df.dtypes == object]:
+        df[colonne] = df[colonne].where(df[colonne].isna(), df[colonne].astype(str))
+    schema = schema_source(df).with_metadata({
+        "source": SOURCES[nom]["fichier"],
+        **_signature_source(source),
+    })
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    os.makedirs(dossier, exist_ok=True)
+    chemin = chemin_store(nom, dossier)
+    feather.write_feather(table, chemin + ".tmp", compression="uncompressed")
+    os.replace(chemin + ".tmp", chemin)
+    return table.schema
+
+
+def _lire_schema(chemin):
+    with pa.memory_map(chemin, "r") as source:
+        return pa.ipc.open_file(source).schema
+
+
+def a_jour(nom, dossier=DOSSIER_STORE):
+    """True si le fichier Arrow existe et correspond au CSV source actuel."""
+    chemin = chemin_store(nom, dossier)
+    if not os.path.exists(chemin):
+        return False
+    if "genere" in SOURCES[nom]:
+        return True
+    meta = _lire_schema(chemin).metadata or {}
+    signature = _signature_source(os.path.join(RACINE, SOURCES[nom]["fichier"]))
+    return all(meta.get(k.encode()) == v.encode() for k, v in signature.items())
+
+
+def charger_table(nom, colonnes=None, dossier=DOSSIER_STORE):
+    """Table Arrow (mmap, sans copie) réduite aux colonnes demandées."""
+    if nom not in SOURCES:
+        raise KeyError(f"Source inconnue : {nom!r} (disponibles : {', '.join(SOURCES)})")
+    if not a_jour(nom, dossier):
+        if "genere" in SOURCES[nom]:
+            raise FileNotFoundError(f"{chemin_store(nom, dossier)} absent : lancer `{SOURCES[nom]['genere']}`")
+        convertir(nom, dossier)
+    return feather.read_table(chemin_store(nom, dossier), columns=colonnes, memory_map=True)
+
+
+def charger(nom, colonnes=None, dossier=DOSSIER_STORE):
+    """DataFrame des colonnes demandées d'une source (toutes par défaut).
+
+    Les colonnes texte sont renvoyées en catégories pandas.
+    """
+    return charger_table(nom, colonnes, dossier).to_pandas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stockage colonnaire des jeux de données")
+    sous = parser.add_subparsers(dest="action", required=True)
+    p = sous.add_parser("convertir", help="Convertit les CSV sources en fichiers Arrow")
+    p.add_argument("noms", nargs="*", choices=sources_csv(), help="Sources à convertir (défaut : toutes)")
+    sous.add_parser("info", help="Affiche l'état du store")
+    args = parser.parse_args()
+
+    if args.action == "convertir":
+        for nom in args.noms or sources_csv():
+            debut = time.perf_counter()
+            schema = convertir(nom)
+            print(f"✔ {nom:<20} {len(schema)} colonnes en {time.perf_counter() - debut:.2f} s")
+        return
+
+    for nom in SOURCES:
+        chemin = chemin_store(nom)
+        if not os.path.exists(chemin):
+            print(f"  {nom:<20} non converti")
+            continue
+        etat = "à jour" if a_jour(nom) else "périmé"
+        debut = time.perf_counter()
+        table = feather.read_table(chemin, memory_map=True)
+        duree = (time.perf_counter() - debut) * 1000
+        print(f"  {nom:<20} {table.num_rows:>6} lignes  {table.num_columns:>4} colonnes  "
+              f"{os.path.getsize(chemin) / 1e6:>6.2f} Mo  {duree:>6.1f} ms  {etat}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+# =======================
+# Distillation : un seul modèle multi-sorties à la place des 13 pipelines
+# =======================
+# Le "professeur" est le jeu de pipelines TPOT d'un dossier. On génère ses
+# prédictions sur les données d'entraînement CAESAR et sur des corps
+# synthétiques (data/male_body_syn.csv, data/women body syn.csv), puis on
+# ajuste un "élève" unique qui prédit toutes les mesures en un appel.
+#
+# Le rapport compare, par cible, l'erreur du professeur et de l'élève sur
+# des lignes CAESAR réelles tenues à l'écart, ainsi que la latence, la
+# mémoire et la taille du fichier des deux solutions.
+#
+# Usage :
+#   python distill.py pipelines_all_dataset --sexe homme --eleve mlp --sortie distille_homme.pkl
+#   modele = charger_eleve("distille_homme.pkl")   # même interface que MultiTPOTWrapper
+#
+# Le fichier ne contient que des objets sklearn et des listes : il se
+# recharge avec charger_eleve() dans n'importe quel processus, même
+# lorsque distill.py a été lancé en script (__main__).
+import argparse
+import copy
+import json
+import os
+import pickle
+import time
+import tracemalloc
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.ensemble import ExtraTreesRegressor
+from sklearn.linear_model import Ridge
+from sklearn.neural_network import MLPRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+from dataset_store import charger
+from morphologie import classer
+from schemas import SCHEMAS, colonnes_entree
+from soutien_gorge import RANGS_UK, arrondir_taille, deriver, rang_depuis_lettre
+from wrapper import MultiTPOTWrapper, PredictionResult, load_models, split_preprocess
+
+SOURCES = {
+    "homme": {"reel": "caesar_fr", "sex": 1, "synthetique": "male_body_syn"},
+    "femme": {"reel": "caesar_all_fr", "sex": 0, "synthetique": "women_body_syn"},
+}
+
+
+def donnees_reelles(sexe):
+    """Lignes CAESAR du sexe demandé, avec les entrées du formulaire dérivées."""
+    source = SOURCES[sexe]
+    df = charger(source["reel"])
+    df = df[df["sex"] == source["sex"]].copy()
+    categories = classer(df, sexe)
+    df[list(categories.columns)] = categories
+    if sexe == "femme":
+        df = deriver(df)
+    return df.dropna(subset=colonnes_entree(sexe)).reset_index(drop=True)
+
+
+def donnees_synthetiques(sexe, reelles, n=None, seed=0):
+    """Entrées du formulaire construites à partir des corps synthétiques.
+
+    L'âge et les catégories non calculables (torse, cuisses) sont tirés
+    dans leur distribution sur les données réelles.
+    """
+    rng = np.random.default_rng(seed)
+    syn = charger(SOURCES[sexe]["synthetique"])
+    if n is not None and n < len(syn):
+        syn = syn.sample(n, random_state=seed)
+    bornes = SCHEMAS[sexe]["bornes"]
+    df = pd.DataFrame({
+        "taille": syn["Height"].clip(*bornes["taille"][:2]).to_numpy(),
+        "weight": syn["Weight"].clip(*bornes["weight"][:2]).to_numpy(),
+        "age": rng.choice(reelles["age"].to_numpy(), size=len(syn)),
+    })
+    mesures = {"taille": syn["Height"], "tour_de_taille": syn["Waist"], "tour_de_hanches": syn["Hips"]}
+    categories = classer(mesures, sexe)
+    df[list(categories.columns)] = categories.to_numpy()
+    if sexe == "femme":
+        df["taille_soutien_gorge"] = arrondir_taille(syn["Bust/Chest"]).clip(*bornes["taille_soutien_gorge"][:2])
+        df["bonnet_rang"] = rang_depuis_lettre(syn["Cup Size"].astype(str), RANGS_UK)
+    for colonne in SCHEMAS[sexe]["colonnes_cat"]:
+        if colonne not in df:
+            df[colonne] = rng.choice(reelles[colonne].to_numpy(), size=len(df))
+    return df.dropna(subset=colonnes_entree(sexe)).reset_index(drop=True)
+
+
+def creer_eleve(nom, preprocess, seed=0):
+    """Pipeline élève : même préprocesseur appris que le professeur + régresseur multi-sorties."""
+    if nom == "mlp":
+        regresseur = TransformedTargetRegressor(
+            regressor=MLPRegressor(hidden_layer_sizes=(64, 64), max_iter=500, early_stopping=True, random_state=seed),
+            transformer=StandardScaler(),
+        )
+    elif nom == "extra_trees":
+        regresseur = ExtraTreesRegressor(n_estimators=50, max_depth=14, min_samples_leaf=3, n_jobs=-1, random_state=seed)
+    elif nom == "ridge":
+        regresseur = Pipeline([("poly", PolynomialFeatures(degree=3)), ("ridge", Ridge(alpha=1.0))])
+    else:
+        raise ValueError(f"élève inconnu : {nom}")
+    return _PreprocessFige(copy.deepcopy(preprocess), regresseur)
+
+
+class _PreprocessFige:
+    """Applique un préprocesseur déjà appris (non réajusté) puis le régresseur."""
+
+    def __init__(self, preprocess, regresseur):
+        self.preprocess = preprocess
+        self.regresseur = regresseur
+
+    def fit(self, X, y):
+        self.regresseur.fit(self.preprocess.transform(X), y)
+        return self
+
+    def predict(self, X):
+        return self.regresseur.predict(self.preprocess.transform(X))
+
+
+class ModeleDistille:
+    """Modèle élève avec la même interface que MultiTPOTWrapper."""
+
+    def __init__(self, modele, target_names, source=None):
+        self.modele = modele
+        self.target_names = target_names
+        self.source = source
+        self._index = {name: i for i, name in enumerate(target_names)}
+
+    def fit(self, X, y=None):
+        return self
+
+    def predict(self, X):
+        return np.asarray(self.modele.predict(X)).reshape(len(X), -1)
+
+    def predict_one(self, row):
+        return PredictionResult(self._index, self.predict(pd.DataFrame([row]))[0])
+
+
+def enregistrer_eleve(modele, chemin):
+    """Écrit l'état de l'élève (objets sklearn), sans les classes de ce module."""
+    joblib.dump({
+        "preprocess": modele.modele.preprocess,
+        "regresseur": modele.modele.regresseur,
+        "target_names": list(modele.target_names),
+        "source": modele.source,
+    }, chemin)
+
+
+def charger_eleve(chemin):
+    """ModeleDistille reconstruit à partir d'un fichier écrit par enregistrer_eleve."""
+    etat = joblib.load(chemin)
+    return ModeleDistille(_PreprocessFige(etat["preprocess"], etat["regresseur"]), etat["target_names"],
+                          etat["source"])
+
+
+def _latences(predicteur, X, repetitions=50):
+    ligne = X.iloc[:1]
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        predicteur.predict(ligne)
+        durees.append(time.perf_counter() - debut)
+    lot = pd.concat([X] * (1000 // len(X) + 1)).iloc[:1000]
+    debut = time.perf_counter()
+    predicteur.predict(lot)
+    return {
+        "p50_1_ligne_ms": float(np.percentile(durees, 50) * 1000),
+        "lignes_par_s_lot_1000": 1000 / (time.perf_counter() - debut),
+    }
+
+
+def _memoire_chargement(charger):
+    tracemalloc.start()
+    debut = time.perf_counter()
+    objet = charger()
+    duree = time.perf_counter() - debut
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return objet, {"chargement_s": duree, "memoire_pic_mo": pic / 1e6}
+
+
+def distiller(dossier, sexe, eleve="mlp", sortie=None, n_synthetique=None, seed=0):
+    professeur_models, target_names = load_models(dossier)
+    professeur = MultiTPOTWrapper(professeur_models, shared_preprocess=True, target_names=target_names)
+    preprocess, _ = split_preprocess(professeur_models[0])
+
+    reelles = donnees_reelles(sexe).sample(frac=1, random_state=seed).reset_index(drop=True)
+    n_test = len(reelles) // 5
+    test, entrainement = reelles.iloc[:n_test], reelles.iloc[n_test:]
+    synthetiques = donnees_synthetiques(sexe, entrainement, n_synthetique, seed)
+
+    colonnes = colonnes_entree(sexe)
+    X = pd.concat([entrainement[colonnes], synthetiques[colonnes]], ignore_index=True)
+    print(f"⚙️ Étiquetage par le professeur : {len(X)} lignes ({len(synthetiques)} synthétiques)")
+    Y = professeur.predict(X)
+
+    print(f"⚙️ Entraînement de l'élève '{eleve}'")
+    modele = ModeleDistille(creer_eleve(eleve, preprocess, seed).fit(X, Y), target_names, dossier)
+    sortie = sortie or f"distille_{sexe}_{eleve}.pkl"
+    enregistrer_eleve(modele, sortie)
+
+    # Précision sur les lignes réelles tenues à l'écart
+    X_test = test[colonnes]
+    pred_prof, pred_eleve = professeur.predict(X_test), modele.predict(X_test)
+    cibles = {}
+    for j, cible in enumerate(target_names):
+        entree = {"fidelite_mae": float(np.mean(np.abs(pred_eleve[:, j] - pred_prof[:, j])))}
+        if cible in test:
+            vrai = test[cible].to_numpy()
+            masque = ~np.isnan(vrai)
+            entree["mae_professeur"] = float(np.mean(np.abs(pred_prof[masque, j] - vrai[masque])))
+            entree["mae_eleve"] = float(np.mean(np.abs(pred_eleve[masque, j] - vrai[masque])))
+            entree["perte"] = entree["mae_eleve"] - entree["mae_professeur"]
+        cibles[cible] = entree
+
+    _, charge_prof = _memoire_chargement(lambda: load_models(dossier))
+    _, charge_eleve = _memoire_chargement(lambda: charger_eleve(sortie))
+    taille_prof = sum(os.path.getsize(os.path.join(dossier, f)) for f in os.listdir(dossier) if f.endswith(".pkl")) \
+        if os.path.isdir(dossier) else os.path.getsize(dossier)
+    rapport = {
+        "sexe": sexe,
+        "professeur": dossier,
+        "eleve": eleve,
+        "fichier_eleve": sortie,
+        "lignes": {"entrainement": len(X), "test_reel": len(test)},
+        "cibles": cibles,
+        "professeur_perf": {**_latences(professeur, X_test), **charge_prof, "fichier_mo": taille_prof / 1e6,
+                            "pickle_mo": len(pickle.dumps(professeur_models)) / 1e6},
+        "eleve_perf": {**_latences(modele, X_test), **charge_eleve, "fichier_mo": os.path.getsize(sortie) / 1e6,
+                       "pickle_mo": len(pickle.dumps(modele)) / 1e6},
+    }
+    with open(os.path.splitext(sortie)[0] + "_rapport.json", "w", encoding="utf-8") as f:
+        json.dump(rapport, f, indent=2, ensure_ascii=False)
+    return rapport
+
+
+def afficher_rapport(rapport):
+    print(f"\n📊 {rapport['professeur']} → {rapport['fichier_eleve']} ({rapport['eleve']})")
+    print(f"{'cible':<55} {'MAE prof':>9} {'MAE élève':>10} {'perte':>8} {'fidélité':>9}")
+    for cible, e in rapport["cibles"].items():
+        print(f"{cible:<55} {e.get('mae_professeur', float('nan')):>9.3f} {e.get('mae_eleve', float('nan')):>10.3f}"
+              f" {e.get('perte', float('nan')):>8.3f} {e['fidelite_mae']:>9.3f}")
+    print(f"\n{'':<24} {'professeur':>12} {'élève':>12}")
+    for cle in ["p50_1_ligne_ms", "lignes_par_s_lot_1000", "chargement_s", "memoire_pic_mo", "fichier_mo", "pickle_mo"]:
+        print(f"{cle:<24} {rapport['professeur_perf'][cle]:>12.2f} {rapport['eleve_perf'][cle]:>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distillation des pipelines TPOT en un modèle multi-sorties")
+    parser.add_argument("dossier", help="Dossier de pipelines (ou bundle) du professeur")
+    parser.add_argument("--sexe", choices=sorted(SCHEMAS), required=True)
+    parser.add_argument("--eleve", choices=["mlp", "extra_trees", "ridge"], default="mlp")
+    parser.add_argument("--sortie", help="Fichier .pkl de l'élève")
+    parser.add_argument("--synthetiques", type=int, help="Nombre de corps synthétiques (défaut : tous)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    afficher_rapport(distiller(args.dossier, args.sexe, args.eleve, args.sortie, args.synthetiques, args.seed))
+
+
+if __name__ == "__main__":
+    main()
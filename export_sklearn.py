@@ -0,0 +1,321 @@
+# =======================
+# Export des pipelines TPOT en scikit-learn pur
+# =======================
+# Les pipelines trouvés par TPOT contiennent quelques objets de TPOT
+# (Passthrough, SkipTransformer, EstimatorTransformer, ColumnOneHotEncoder).
+# Dépickler ces pipelines importe donc tpot et toutes ses dépendances, ce
+# qui ralentit le démarrage de Streamlit et des workers.
+#
+# convertir() reconstruit le même graphe d'objets en remplaçant ces classes
+# par des équivalents sklearn (FunctionTransformer, "passthrough", "drop")
+# ou par les deux petites classes ci-dessous, qui n'importent que sklearn.
+# Les estimateurs appris (arbres, boosting, régressions...) sont repris tels
+# quels : paramètres et état appris sont identiques.
+#
+# Usage :
+#   python export_sklearn.py pipelines_all_dataset pipelines_all_dataset_sklearn
+#   python export_sklearn.py pipelines_female_complets pipelines_female_sklearn --sexe femme
+#
+# Les fichiers exportés référencent export_sklearn : le module doit être
+# importable (racine du dépôt dans le sys.path) là où ils sont chargés.
+# Chaque fichier écrit est relu dans un interpréteur neuf avant d'être
+# compté comme exporté.
+import argparse
+import copy
+import json
+import os
+import pickle
+import subprocess
+import sys
+
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.pipeline import FeatureUnion, Pipeline
+from sklearn.preprocessing import FunctionTransformer
+
+
+class NonConvertible(Exception):
+    """Objet TPOT sans équivalent connu."""
+
+
+def sans_colonnes(X):
+    """Équivalent de SkipTransformer : aucune colonne, même nombre de lignes."""
+    return np.empty((X.shape[0], 0))
+
+
+class PredictionsEnVariables(TransformerMixin, BaseEstimator):
+    """Équivalent de tpot EstimatorTransformer à l'inférence.
+
+    Les prédictions de `estimator` (déjà appris) deviennent des variables,
+    éventuellement suivies des variables d'entrée si `passthrough`.
+    """
+
+    def __init__(self, estimator, method="predict", passthrough=False):
+        self.estimator = estimator
+        self.method = method
+        self.passthrough = passthrough
+
+    def fit(self, X, y=None):
+        self.estimator.fit(X, y)
+        return self
+
+    def transform(self, X):
+        sortie = np.array(getattr(self.estimator, self.method)(X))
+        if sortie.ndim == 1:
+            sortie = sortie.reshape(-1, 1)
+        return np.hstack((sortie, X)) if self.passthrough else sortie
+
+
+class EncodageColonnes(TransformerMixin, BaseEstimator):
+    """Équivalent de tpot ColumnOneHotEncoder pour un encodeur déjà appris.
+
+    Les colonnes non encodées restent en tête, les indicatrices suivent.
+    """
+
+    def __init__(self, encodeur, colonnes):
+        self.encodeur = encodeur
+        self.colonnes = colonnes
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        if len(self.colonnes) == X.shape[1]:
+            return self.encodeur.transform(X)
+        if hasattr(X, "iloc"):
+            import pandas as pd
+            codees = pd.DataFrame(self.encodeur.transform(X[self.colonnes]),
+                                  columns=self.encodeur.get_feature_names_out())
+            reste = X.drop(self.colonnes, axis=1).reset_index(drop=True)
+            return pd.concat([reste, codees], axis=1)
+        return np.hstack((np.delete(X, self.colonnes, axis=1), self.encodeur.transform(X[:, self.colonnes])))
+
+
+def _est_tpot(objet, nom=None):
+    classe = type(objet)
+    return classe.__module__.split(".")[0] == "tpot" and (nom is None or classe.__name__ == nom)
+
+
+def _methode_estimator_transformer(objet):
+    # Même ordre de résolution que TPOT pour method="auto"
+    if objet.method != "auto":
+        return objet.method
+    for methode in ("predict_proba", "decision_function", "predict"):
+        if hasattr(objet.estimator, methode):
+            return methode
+    raise NonConvertible(f"{type(objet.estimator).__name__} n'a pas de méthode de prédiction")
+
+
+def _branche(objet, dans_union):
+    """Étape d'un Pipeline ou branche d'une FeatureUnion."""
+    if _est_tpot(objet, "Passthrough"):
+        return "passthrough"
+    if _est_tpot(objet, "SkipTransformer") and dans_union:
+        return "drop"
+    return convertir(objet)
+
+
+def convertir(objet):
+    """Copie de `objet` sans aucune classe de TPOT.
+
+    Les sous-objets non modifiés sont partagés avec l'original.
+
+    Raises:
+        NonConvertible: si une classe TPOT inconnue est rencontrée.
+    """
+    if _est_tpot(objet):
+        nom = type(objet).__name__
+        if nom == "Passthrough":
+            return FunctionTransformer()
+        if nom == "SkipTransformer":
+            return FunctionTransformer(sans_colonnes)
+        if nom == "EstimatorTransformer":
+            return PredictionsEnVariables(convertir(objet.estimator), _methode_estimator_transformer(objet),
+                                          objet.passthrough)
+        if nom == "ColumnOneHotEncoder":
+            if len(objet.columns_) == 0:
+                return FunctionTransformer()
+            return EncodageColonnes(objet.enc, list(objet.columns_))
+        raise NonConvertible(f"classe TPOT non gérée : {type(objet).__module__}.{nom}")
+
+    if isinstance(objet, Pipeline):
+        nouveau = copy.copy(objet)
+        nouveau.steps = [(nom, _branche(etape, False)) for nom, etape in objet.steps]
+        return nouveau
+    if isinstance(objet, FeatureUnion):
+        nouveau = copy.copy(objet)
+        nouveau.transformer_list = [(nom, _branche(t, True)) for nom, t in objet.transformer_list]
+        return nouveau
+    if isinstance(objet, BaseEstimator):
+        # Méta-estimateurs génériques (ColumnTransformer, SelectFromModel...)
+        remplacements = {}
+        for attribut, valeur in vars(objet).items():
+            nouvelle = _convertir_valeur(valeur)
+            if nouvelle is not valeur:
+                remplacements[attribut] = nouvelle
+        if not remplacements:
+            return objet
+        nouveau = copy.copy(objet)
+        vars(nouveau).update(remplacements)
+        return nouveau
+    return objet
+
+
+def _convertir_valeur(valeur):
+    if isinstance(valeur, BaseEstimator):
+        return convertir(valeur)
+    if isinstance(valeur, (list, tuple)) and not isinstance(valeur, str):
+        elements = [_convertir_valeur(v) for v in valeur]
+        if all(a is b for a, b in zip(elements, valeur)):
+            return valeur
+        return type(valeur)(elements) if isinstance(valeur, list) else tuple(elements)
+    if isinstance(valeur, dict):
+        elements = {k: _convertir_valeur(v) for k, v in valeur.items()}
+        if all(elements[k] is v for k, v in valeur.items()):
+            return valeur
+        return elements
+    return valeur
+
+
+# =======================
+# Export d'un dossier et mesures
+# =======================
+# Exécuté dans un interpréteur neuf : imports + dépicklage à froid.
+_SCRIPT_MESURE = """
+import json, os, resource, sys, time
+debut = time.perf_counter()
+import joblib
+dossier = sys.argv[1]
+modeles = [joblib.load(os.path.join(dossier, f)) for f in sorted(os.listdir(dossier)) if f.endswith(".pkl")]
+duree = time.perf_counter() - debut
+print(json.dumps({
+    "chargement_froid_s": duree,
+    "rss_max_mo": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules_importes": len(sys.modules),
+    "tpot_importe": "tpot" in sys.modules,
+}))
+"""
+
+
+# Relit des fichiers écrits, comme le ferait un processus de service
+_SCRIPT_RELECTURE = """
+import json, sys
+import joblib
+erreurs = {}
+for chemin in sys.argv[1:]:
+    try:
+        joblib.load(chemin)
+    except Exception as e:
+        erreurs[chemin] = f"{type(e).__name__}: {e}"
+print(json.dumps(erreurs))
+"""
+
+
+def relire(chemins):
+    """{chemin: erreur} des fichiers qui ne se chargent pas dans un interpréteur neuf."""
+    if not chemins:
+        return {}
+    resultat = subprocess.run([sys.executable, "-c", _SCRIPT_RELECTURE, *chemins], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if resultat.returncode != 0:
+        message = (resultat.stderr.strip().splitlines() or ["interpréteur arrêté"])[-1]
+        return {chemin: message for chemin in chemins}
+    return json.loads(resultat.stdout.strip().splitlines()[-1])
+
+
+def mesurer_chargement(dossier):
+    """Temps d'import + chargement, pic de RSS et modules importés, dans un processus neuf."""
+    resultat = subprocess.run([sys.executable, "-c", _SCRIPT_MESURE, dossier], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    mesures = json.loads(resultat.stdout.strip().splitlines()[-1])
+    mesures["fichiers_mo"] = sum(os.path.getsize(os.path.join(dossier, f))
+                                 for f in os.listdir(dossier) if f.endswith(".pkl")) / 1e6
+    return mesures
+
+
+def exporter(dossier, destination, sexe=None, echantillons=500, tolerance=1e-9):
+    """Convertit chaque .pkl du dossier et l'écrit sous le même nom dans `destination`.
+
+    Si le sexe est connu, les prédictions converties sont comparées à
+    l'original sur des entrées tirées dans les bornes du formulaire.
+
+    Returns:
+        dict: {fichier: {"octets_avant", "octets_apres", "ecart_max" | "erreur"}}
+    """
+    import joblib
+    from schemas import sexe_du_dossier
+
+    sexe = sexe or sexe_du_dossier(dossier)
+    X = None
+    if sexe is not None:
+        from response_surface import echantillon_formulaire
+        X = echantillon_formulaire(sexe, echantillons)
+
+    os.makedirs(destination, exist_ok=True)
+    rapport = {}
+    for fichier in sorted(f for f in os.listdir(dossier) if f.endswith(".pkl")):
+        original = joblib.load(os.path.join(dossier, fichier))
+        try:
+            converti = convertir(original)
+        except NonConvertible as e:
+            rapport[fichier] = {"erreur": str(e)}
+            continue
+        octets = pickle.dumps(converti, protocol=5)
+        entree = {"octets_avant": len(pickle.dumps(original, protocol=5)), "octets_apres": len(octets)}
+        if b"tpot." in octets:
+            rapport[fichier] = {**entree, "erreur": "référence à tpot restante"}
+            continue
+        if X is not None:
+            entree["ecart_max"] = float(np.max(np.abs(converti.predict(X) - original.predict(X))))
+            if entree["ecart_max"] > tolerance:
+                rapport[fichier] = {**entree, "erreur": "prédictions différentes"}
+                continue
+        tmp = os.path.join(destination, fichier + ".tmp")
+        joblib.dump(converti, tmp)
+        os.replace(tmp, os.path.join(destination, fichier))
+        rapport[fichier] = entree
+
+    # Un fichier n'est compté comme exporté que s'il se recharge ailleurs
+    ecrits = {os.path.join(destination, f): f for f, e in rapport.items() if "erreur" not in e}
+    for chemin, erreur in relire(list(ecrits)).items():
+        os.remove(chemin)
+        rapport[ecrits[chemin]]["erreur"] = f"rechargement impossible : {erreur}"
+    return rapport
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export des pipelines TPOT en scikit-learn pur")
+    parser.add_argument("dossier", help="Dossier de pipelines TPOT (.pkl)")
+    parser.add_argument("destination", help="Dossier des pipelines convertis")
+    parser.add_argument("--sexe", choices=["homme", "femme"], help="Schéma d'entrée pour la vérification")
+    parser.add_argument("--echantillons", type=int, default=500)
+    parser.add_argument("--sans-mesures", action="store_true", help="Ne pas mesurer le chargement à froid")
+    args = parser.parse_args()
+
+    rapport = exporter(args.dossier, args.destination, args.sexe, args.echantillons)
+    for fichier, e in rapport.items():
+        if "erreur" in e:
+            print(f"  ✘ {fichier:<60} {e['erreur']}")
+        else:
+            ecart = f"  écart max {e['ecart_max']:.1e}" if "ecart_max" in e else ""
+            print(f"  ✔ {fichier:<60} {e['octets_avant'] / 1e6:>7.2f} → {e['octets_apres'] / 1e6:>7.2f} Mo{ecart}")
+    convertis = sum("erreur" not in e for e in rapport.values())
+    print(f"✅ {convertis}/{len(rapport)} pipeline(s) écrits dans {args.destination}")
+
+    if not args.sans_mesures:
+        avant, apres = mesurer_chargement(args.dossier), mesurer_chargement(args.destination)
+        print(f"\n{'':<22} {'TPOT':>10} {'sklearn':>10}")
+        for cle in ["chargement_froid_s", "rss_max_mo", "modules_importes", "fichiers_mo", "tpot_importe"]:
+            print(f"{cle:<22} {avant[cle]:>10.2f} {apres[cle]:>10.2f}" if cle != "tpot_importe"
+                  else f"{cle:<22} {str(avant[cle]):>10} {str(apres[cle]):>10}")
+        with open(os.path.join(args.destination, "_export.json"), "w", encoding="utf-8") as f:
+            json.dump({"source": args.dossier, "pipelines": rapport, "avant": avant, "apres": apres},
+                      f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    # Importé sous son nom : les classes de remplacement sont picklées comme
+    # export_sklearn.* et non __main__.*, introuvable dans un autre processus
+    from export_sklearn import main
+
+    main()
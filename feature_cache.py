@@ -0,0 +1,169 @@
+# =======================
+# Cache des matrices prétraitées, adressé par contenu
+# =======================
+# Chaque relance recalculait la même chaîne (chargement, catégories,
+# tailles de soutien-gorge, ColumnTransformer, imputation des cibles) avant
+# de donner la matrice à TPOT. Ici le résultat est rangé sous une clé qui
+# hache :
+#   - le contenu des fichiers sources (sha256, mémorisé par taille + date) ;
+#   - la configuration du prétraitement (colonnes, cibles, paramètres du
+#     préprocesseur non appris, seuils morphologiques, code de préparation).
+# Une entrée est un dossier <clé>/ contenant une matrice .npy par nom, les
+# objets appris (préprocesseur) en joblib et un meta.json. Les matrices sont
+# rouvertes en np.load(mmap_mode="r") : plusieurs processus les partagent via
+# le cache de pages, sans copie ni recalcul.
+#
+# Usage :
+#   from feature_cache import cle, obtenir
+#   entree = obtenir(cle(["data/caesar_fr.csv"], config), calculer)
+#   X = entree.matrices["X"]
+#
+#   python feature_cache.py lister
+#   python feature_cache.py purger --garder 5
+import argparse
+import functools
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import joblib
+import numpy as np
+from joblib import hash as joblib_hash
+
+from dataset_store import RACINE
+
+DOSSIER = os.path.join(RACINE, "cache_features")
+META = "meta.json"
+# À incrémenter si le format des entrées change
+VERSION = 1
+
+
+@functools.lru_cache(maxsize=None)
+def _sha256(chemin, taille, mtime):
+    with open(chemin, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def empreinte_fichier(chemin):
+    """sha256 du contenu d'un fichier, recalculé seulement si sa taille ou sa date change."""
+    stat = os.stat(chemin)
+    return _sha256(os.path.abspath(chemin), stat.st_size, stat.st_mtime_ns)
+
+
+def cle(sources, config):
+    """Clé d'une entrée : contenu des fichiers sources + configuration du prétraitement."""
+    fichiers = {os.path.relpath(os.path.abspath(s), RACINE): empreinte_fichier(s) for s in sources}
+    return joblib_hash({"version": VERSION, "sources": fichiers, "config": config})
+
+
+class EntreeCache:
+    """Matrices (mmap, lecture seule), objets appris et métadonnées d'une entrée."""
+
+    def __init__(self, dossier):
+        self.dossier = dossier
+        with open(os.path.join(dossier, META), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.matrices = {nom: np.load(os.path.join(dossier, f"{nom}.npy"), mmap_mode="r")
+                         for nom in self.meta["matrices"]}
+
+    @functools.cached_property
+    def objets(self):
+        return {nom: joblib.load(os.path.join(self.dossier, f"{nom}.joblib")) for nom in self.meta["objets"]}
+
+
+def lire(cle_entree, dossier=DOSSIER):
+    """EntreeCache de la clé, ou None si absente."""
+    chemin = os.path.join(dossier, cle_entree)
+    if not os.path.isfile(os.path.join(chemin, META)):
+        return None
+    # Date d'accès utilisée par purger()
+    os.utime(os.path.join(chemin, META))
+    return EntreeCache(chemin)
+
+
+def ecrire(cle_entree, matrices, objets=None, meta=None, dossier=DOSSIER):
+    """Écrit une entrée dans un dossier temporaire puis le renomme (atomique)."""
+    objets = objets or {}
+    destination = os.path.join(dossier, cle_entree)
+    tmp = f"{destination}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    for nom, matrice in matrices.items():
+        np.save(os.path.join(tmp, f"{nom}.npy"), np.ascontiguousarray(matrice))
+    for nom, objet in objets.items():
+        joblib.dump(objet, os.path.join(tmp, f"{nom}.joblib"))
+    with open(os.path.join(tmp, META), "w", encoding="utf-8") as f:
+        json.dump({**(meta or {}), "cle": cle_entree, "matrices": list(matrices), "objets": list(objets),
+                   "formes": {nom: list(np.shape(m)) for nom, m in matrices.items()},
+                   "cree": time.strftime("%Y-%m-%d %H:%M:%S")}, f, indent=2, ensure_ascii=False)
+    try:
+        os.rename(tmp, destination)
+    except OSError:
+        # Un autre processus a écrit la même entrée entre-temps
+        shutil.rmtree(tmp, ignore_errors=True)
+    return EntreeCache(destination)
+
+
+def obtenir(cle_entree, calculer, dossier=DOSSIER, meta=None):
+    """Entrée de la clé ; sinon `calculer()` -> (matrices, objets) est appelé puis mis en cache.
+
+    Returns:
+        EntreeCache: avec l'attribut `trouvee` (True si lue depuis le cache).
+    """
+    entree = lire(cle_entree, dossier)
+    trouvee = entree is not None
+    if not trouvee:
+        debut = time.perf_counter()
+        matrices, objets = calculer()
+        meta = {**(meta or {}), "duree_calcul_s": round(time.perf_counter() - debut, 2)}
+        entree = ecrire(cle_entree, matrices, objets, meta, dossier)
+    entree.trouvee = trouvee
+    return entree
+
+
+def entrees(dossier=DOSSIER):
+    """Métadonnées des entrées, de la plus récemment utilisée à la plus ancienne."""
+    if not os.path.isdir(dossier):
+        return []
+    chemins = [os.path.join(dossier, d) for d in os.listdir(dossier)
+               if os.path.isfile(os.path.join(dossier, d, META))]
+    chemins.sort(key=lambda d: os.path.getmtime(os.path.join(d, META)), reverse=True)
+    resultat = []
+    for chemin in chemins:
+        with open(os.path.join(chemin, META), encoding="utf-8") as f:
+            meta = json.load(f)
+        taille = sum(os.path.getsize(os.path.join(chemin, f)) for f in os.listdir(chemin))
+        resultat.append({**meta, "dossier": chemin, "taille_mo": round(taille / 1e6, 2)})
+    return resultat
+
+
+def purger(garder=5, dossier=DOSSIER):
+    """Supprime les entrées les moins récemment utilisées au-delà de `garder`."""
+    supprimees = entrees(dossier)[garder:]
+    for entree in supprimees:
+        shutil.rmtree(entree["dossier"], ignore_errors=True)
+    return supprimees
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache des matrices prétraitées")
+    parser.add_argument("--dossier", default=DOSSIER)
+    sous = parser.add_subparsers(dest="action", required=True)
+    sous.add_parser("lister", help="Entrées du cache")
+    p = sous.add_parser("purger", help="Garde les entrées les plus récemment utilisées")
+    p.add_argument("--garder", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.action == "purger":
+        for entree in purger(args.garder, args.dossier):
+            print(f"✔ Supprimée : {entree['cle'][:12]} ({entree['taille_mo']} Mo)")
+        return
+    for entree in entrees(args.dossier):
+        formes = ", ".join(f"{nom} {tuple(forme)}" for nom, forme in entree["formes"].items())
+        print(f"  {entree['cle'][:12]}  {entree.get('description', ''):<30} {formes:<35} "
+              f"{entree['taille_mo']:>8.2f} Mo  {entree['cree']}")
+
+
+if __name__ == "__main__":
+    main()
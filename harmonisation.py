@@ -0,0 +1,249 @@
+# =======================
+# Harmonisation des sources sous les noms de mesures canoniques
+# =======================
+# Les copies _corrigé / _renommé / _fr de data/ ne font qu'appliquer des
+# renommages et des conversions d'unités aux sources brutes. Ce module les
+# applique à la volée à partir des fichiers de correspondance existants :
+#   - caesar mapping.json / caesar mapping female.json (CAESAR, pouces et livres) ;
+#   - mapping bdims.json (bdims, déjà en cm et kg) ;
+#   - ANSUR_Body_Measure_Mapping.csv (ANSUR II, mm et dixièmes de kg).
+# Le nom canonique d'un libellé de correspondance est sa forme sans
+# accents, en minuscules, avec "_" comme séparateur : c'est la forme des
+# colonnes de schemas.py et des cibles des jeux de modèles
+# (pipeline_tpot_<cible>.pkl), listés par noms_canoniques(). Les copies
+# caesar_fr / caesar_all_fr ne sont plus lues.
+#
+# CAESAR contient les deux sexes : caesar_homme et caesar_femme filtrent la
+# colonne gender et appliquent chacune sa correspondance.
+#
+# vue(source) renvoie une vue paresseuse : seules les colonnes brutes
+# nécessaires sont lues (dataset_store, mmap), converties, puis gardées en
+# mémoire. combiner() écrit en une passe, lot par lot, une table
+# d'entraînement multi-sources au format Arrow.
+#
+# Usage :
+#   python harmonisation.py colonnes ansur_ii_homme
+#   python harmonisation.py combiner data/store/combinee.arrow --sources caesar_homme bdims ansur_ii_homme \
+#       --colonnes taille weight age sex tour_de_poitrine tour_du_cou
+import argparse
+import csv
+import functools
+import json
+import os
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from dataset_store import RACINE, charger, charger_table
+from schemas import SCHEMAS
+
+# Facteurs vers cm / kg
+UNITES = {
+    "pouces": {"longueur": 2.54, "weight": 0.453592},
+    "mm": {"longueur": 0.1, "weight": 0.1},
+    "cm": {"longueur": 1.0, "weight": 1.0},
+}
+SANS_UNITE = {"age", "sex"}
+CODES_SEXE = {"male": 1, "female": 0}
+
+SOURCES = {
+    "caesar_homme": {"store": "caesar", "mapping": "caesar mapping.json", "unites": "pouces",
+                     "filtre": ("gender", "male")},
+    # Mesures de la copie caesar_all_fr absentes de la correspondance femme
+    "caesar_femme": {"store": "caesar", "mapping": "caesar mapping female.json", "unites": "pouces",
+                     "filtre": ("gender", "female"),
+                     "complements": {"tour_de_hanches": "hip_circum", "tour_de_sous_poitrine": "chest_circum_below_bust",
+                                     "taille_de_poitrine": "bra_size_chest",
+                                     "longueur_d_avant_bras": "radial_stylion_len"}},
+    "bdims": {"store": "bdims", "mapping": "mapping bdims.json", "unites": "cm"},
+    # Le fichier ANSUR ne couvre que les mesures : entrées ajoutées ici
+    "ansur_ii_homme": {"store": "ansur_ii_male", "mapping": "ANSUR_Body_Measure_Mapping.csv", "unites": "mm",
+                       "complements": {"weight": "weightkg", "age": "Age", "sex": "Gender"}},
+    "ansur_ii_femme": {"store": "ansur_ii_female", "mapping": "ANSUR_Body_Measure_Mapping.csv", "unites": "mm",
+                       "complements": {"weight": "weightkg", "age": "Age", "sex": "Gender"}},
+}
+# Libellés des correspondances qui désignent une colonne canonique d'un autre nom
+ALIAS = {"longueur_de_bras": "longueur_du_bras"}
+
+
+def cle(libelle):
+    """Forme de comparaison d'un libellé : sans accents, minuscules, '_' comme séparateur."""
+    sans_accents = unicodedata.normalize("NFKD", libelle).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "_", sans_accents.lower()).strip("_")
+
+
+@functools.lru_cache(maxsize=None)
+def noms_canoniques():
+    """Noms connus des modèles : colonnes de schemas.py et cibles des jeux de modèles."""
+    noms = {"sex"}
+    for schema in SCHEMAS.values():
+        noms.update(schema["colonnes_num"], schema["colonnes_cat"])
+        dossier = os.path.join(RACINE, schema["dossier"])
+        if os.path.isdir(dossier):
+            noms.update(f[:-len(".pkl")].removeprefix("pipeline_").removeprefix("tpot_")
+                        for f in os.listdir(dossier) if f.endswith(".pkl"))
+    inattendus = sorted(n for n in noms if cle(n) != n)
+    if inattendus:
+        # La forme canonique doit rester celle de cle() pour que les libellés s'y rapprochent
+        raise ValueError(f"Noms de modèles hors forme canonique : {inattendus}")
+    return frozenset(noms)
+
+
+def canonique(libelle):
+    """Nom canonique d'un libellé (sans accents ni ponctuation, alias résolus)."""
+    k = cle(libelle)
+    return ALIAS.get(k, k)
+
+
+def lire_mapping(fichier):
+    """{libellé: colonne brute} d'un fichier de correspondance (JSON plat, input/output, ou CSV)."""
+    chemin = os.path.join(RACINE, fichier)
+    if fichier.endswith(".csv"):
+        with open(chemin, encoding="utf-8-sig", newline="") as f:
+            return {ligne[0]: ligne[1] for ligne in csv.reader(f) if len(ligne) > 1 and ligne[0] != "Mesure"}
+    with open(chemin, encoding="utf-8") as f:
+        mapping = json.load(f)
+    if "input" in mapping:
+        return {**mapping["input"], **mapping["output"]}
+    return mapping
+
+
+@functools.lru_cache(maxsize=None)
+def correspondances(source):
+    """{nom canonique: colonne brute} d'une source ; les mesures sans équivalent sont omises."""
+    config = SOURCES[source]
+    resultat = {}
+    for libelle, brute in lire_mapping(config["mapping"]).items():
+        if brute:
+            resultat.setdefault(canonique(libelle), brute)
+    resultat.update(config.get("complements", {}))
+    return resultat
+
+
+def _convertir(nom, valeurs, unites):
+    if nom == "sex":
+        if valeurs.dtype.kind in "biuf":
+            return valeurs.astype(float)
+        return valeurs.astype(str).str.lower().map(CODES_SEXE).astype(float)
+    valeurs = pd.to_numeric(valeurs, errors="coerce")
+    if nom in SANS_UNITE:
+        return valeurs
+    return valeurs * UNITES[unites]["weight" if nom == "weight" else "longueur"]
+
+
+class VueHarmonisee:
+    """Colonnes d'une source sous leurs noms canoniques, chargées à la demande."""
+
+    def __init__(self, source):
+        self.source = source
+        self.config = SOURCES[source]
+        self.correspondances = correspondances(source)
+        self._cache = {}
+
+    @property
+    def colonnes(self):
+        return list(self.correspondances)
+
+    def _brutes(self, colonnes):
+        """Colonnes brutes à lire pour `colonnes`, colonne de filtre comprise."""
+        brutes = {self.correspondances[c] for c in colonnes}
+        if "filtre" in self.config:
+            brutes.add(self.config["filtre"][0])
+        return sorted(brutes)
+
+    def _filtrer(self, brut):
+        if "filtre" not in self.config:
+            return brut
+        colonne, valeur = self.config["filtre"]
+        return brut[brut[colonne].astype(str).str.lower().to_numpy() == valeur].reset_index(drop=True)
+
+    def _harmoniser(self, brut, colonnes):
+        return pd.DataFrame({
+            nom: _convertir(nom, brut[self.correspondances[nom]], self.config["unites"]).to_numpy()
+            for nom in colonnes
+        })
+
+    def to_pandas(self, colonnes=None):
+        """DataFrame des colonnes canoniques demandées (toutes par défaut).
+
+        Une colonne inconnue de la source est renvoyée vide (NaN).
+        """
+        colonnes = list(colonnes or self.colonnes)
+        connues = [c for c in colonnes if c in self.correspondances]
+        a_lire = [c for c in connues if c not in self._cache]
+        if a_lire:
+            brut = self._filtrer(charger(self.config["store"], self._brutes(a_lire)))
+            self._cache.update(self._harmoniser(brut, a_lire).items())
+        if connues:
+            n = len(self._cache[connues[0]])
+        elif "filtre" in self.config:
+            n = len(self._filtrer(charger(self.config["store"], self._brutes([]))))
+        else:
+            n = charger_table(self.config["store"]).num_rows
+        return pd.DataFrame({c: self._cache[c] if c in self._cache else np.full(n, np.nan) for c in colonnes})
+
+    def lots(self, colonnes, taille_lot=50_000):
+        """Itère sur des DataFrame de `taille_lot` lignes, sans passer par le cache."""
+        connues = [c for c in colonnes if c in self.correspondances]
+        table = charger_table(self.config["store"], self._brutes(connues) or None)
+        for lot in table.to_batches(max_chunksize=taille_lot):
+            brut = self._filtrer(lot.to_pandas())
+            if len(brut):
+                yield self._harmoniser(brut, connues).reindex(columns=colonnes)
+
+
+@functools.lru_cache(maxsize=None)
+def vue(source):
+    """Vue harmonisée partagée d'une source."""
+    if source not in SOURCES:
+        raise KeyError(f"Source inconnue : {source!r} (disponibles : {', '.join(SOURCES)})")
+    return VueHarmonisee(source)
+
+
+def combiner(sources, colonnes, destination, taille_lot=50_000):
+    """Écrit une table Arrow multi-sources (colonne "source" + colonnes canoniques) en une passe.
+
+    Returns:
+        int: nombre de lignes écrites.
+    """
+    schema = pa.schema([("source", pa.string())] + [(c, pa.float64()) for c in colonnes])
+    lignes = 0
+    tmp = destination + ".tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+    with pa.OSFile(tmp, "wb") as sortie, pa.ipc.new_file(sortie, schema) as writer:
+        for source in sources:
+            for df in vue(source).lots(colonnes, taille_lot):
+                df.insert(0, "source", source)
+                writer.write_batch(pa.RecordBatch.from_pandas(df, schema=schema, preserve_index=False))
+                lignes += len(df)
+    os.replace(tmp, destination)
+    return lignes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Harmonisation des sources de mesures")
+    sous = parser.add_subparsers(dest="action", required=True)
+    p = sous.add_parser("colonnes", help="Colonnes canoniques d'une source et leur origine (✔ : connue des modèles)")
+    p.add_argument("source", choices=sorted(SOURCES))
+    p = sous.add_parser("combiner", help="Écrit une table multi-sources")
+    p.add_argument("destination", help="Fichier .arrow")
+    p.add_argument("--sources", nargs="+", choices=sorted(SOURCES), required=True)
+    p.add_argument("--colonnes", nargs="+", required=True)
+    args = parser.parse_args()
+
+    if args.action == "colonnes":
+        unites = SOURCES[args.source]["unites"]
+        connus = noms_canoniques()
+        for nom, brute in correspondances(args.source).items():
+            marque = "✔" if nom in connus else " "
+            print(f"{marque} {nom:<55} ← {brute} ({'sans unité' if nom in SANS_UNITE else unites})")
+        return
+    lignes = combiner(args.sources, args.colonnes, args.destination)
+    print(f"✔ {lignes} lignes écrites dans {args.destination}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+# =======================
+# Classement des jeux de modèles livrés (précision, latence, mémoire)
+# =======================
+# Chaque dossier de modèles est évalué sur le même échantillon CAESAR tenu
+# à l'écart (mélange par une graine fixe, 20 % des lignes, comme distill.py).
+# Par cible :
+#   - MAE sur les lignes où la mesure réelle existe ;
+#   - latence p50 / p99 d'une prédiction d'une ligne ;
+#   - débit sur un lot de 10 000 lignes ;
+#   - temps de chargement (sans tracemalloc), pic mémoire d'un second
+#     dépicklage (tracemalloc) et taille du fichier.
+# Par jeu : chargement à froid et RSS dans un processus neuf
+# (export_sklearn.mesurer_chargement).
+#
+# Les dossiers modeles_* ne contiennent que l'étape "model" : ils sont
+# évalués derrière le "preprocess" du dossier pipelines_* construit à
+# partir d'eux dans les notebooks (predict, predict_4,
+# Predict_caesar_female), qui doit être le même pour tous ses pipelines. modeles_female_tpot n'a pas de dossier
+# pipelines_* propre : il reprend celui de pipelines_female_complets.
+#
+# Attention : les modèles livrés ont été appris sur tout CAESAR ; les MAE
+# servent à comparer les jeux entre eux et d'un commit à l'autre, pas à
+# estimer l'erreur sur de nouveaux corps.
+#
+# Le résultat est écrit en JSON (commit, versions, échantillon, mesures) ;
+# --comparer affiche les écarts avec un classement précédent.
+#
+# Usage :
+#   python leaderboard.py --sortie leaderboard.json
+#   python leaderboard.py --jeux pipelines_all_dataset modeles_tpot_complet --repetitions 200
+#   python leaderboard.py --sortie leaderboard.json --comparer leaderboard_main.json
+import argparse
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+import joblib
+import numpy as np
+from sklearn.pipeline import Pipeline
+from threadpoolctl import threadpool_limits
+
+from bundle import empreinte_fichiers, versions_bibliotheques
+from distill import donnees_reelles
+from export_sklearn import mesurer_chargement
+from schemas import colonnes_entree
+from wrapper import split_preprocess
+
+RACINE = os.path.dirname(os.path.abspath(__file__))
+
+JEUX = {
+    "pipelines_all_dataset": {"sexe": "homme"},
+    "pipelines_complets": {"sexe": "homme"},
+    "pipelines_female_complets": {"sexe": "femme"},
+    "modeles_tpot": {"sexe": "homme", "preprocess": "pipelines_complets"},
+    "modeles_tpot_complet": {"sexe": "homme", "preprocess": "pipelines_all_dataset"},
+    "modeles_female_tpot": {"sexe": "femme", "preprocess": "pipelines_female_complets"},
+    "modeles_female_tpot_complet": {"sexe": "femme", "preprocess": "pipelines_female_complets"},
+}
+PART_TEST = 0.2
+LOT = 10_000
+
+
+def nom_cible(fichier):
+    return fichier[:-len(".pkl")].removeprefix("pipeline_").removeprefix("tpot_")
+
+
+def fichiers(dossier):
+    return sorted(f for f in os.listdir(dossier) if f.endswith(".pkl"))
+
+
+def echantillon_test(sexe, seed=0):
+    """Lignes tenues à l'écart, identiques d'une exécution à l'autre pour une même graine."""
+    reelles = donnees_reelles(sexe).sample(frac=1, random_state=seed).reset_index(drop=True)
+    return reelles.iloc[:int(len(reelles) * PART_TEST)].reset_index(drop=True)
+
+
+def commit_courant():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=RACINE).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def preprocess_de(dossier):
+    """Étape "preprocess" (apprise) commune aux pipelines d'un dossier.
+
+    Raises:
+        ValueError: si les pipelines n'ont pas tous le même préprocesseur
+            (même empreinte joblib), comme l'exige shared_preprocess.
+    """
+    preprocesseurs = {}
+    for fichier in fichiers(dossier):
+        preprocess, _ = split_preprocess(joblib.load(os.path.join(dossier, fichier)))
+        preprocesseurs.setdefault(joblib.hash(preprocess), (fichier, preprocess))
+    if len(preprocesseurs) != 1:
+        raise ValueError(f"{dossier} : préprocesseurs différents "
+                         f"({', '.join(f for f, _ in preprocesseurs.values())})")
+    return next(iter(preprocesseurs.values()))[1]
+
+
+def _charger(chemin, preprocess=None):
+    # Durée sans tracemalloc (qui ralentit le dépicklage) ; pic mémoire sur un second chargement
+    debut = time.perf_counter()
+    modele = joblib.load(chemin)
+    duree = time.perf_counter() - debut
+    tracemalloc.start()
+    joblib.load(chemin)
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if preprocess is not None:
+        modele = Pipeline([("preprocess", preprocess), ("model", modele)])
+    return modele, {"chargement_ms": duree * 1000, "memoire_pic_mo": pic / 1e6,
+                    "fichier_mo": os.path.getsize(chemin) / 1e6}
+
+
+def _mesurer(modele, X, repetitions):
+    durees = np.empty(repetitions)
+    ligne = X.iloc[:1]
+    modele.predict(ligne)
+    for i in range(repetitions):
+        debut = time.perf_counter()
+        modele.predict(ligne)
+        durees[i] = time.perf_counter() - debut
+    lot = X.iloc[np.arange(LOT) % len(X)]
+    debut = time.perf_counter()
+    modele.predict(lot)
+    return {
+        "p50_1_ligne_ms": float(np.percentile(durees, 50) * 1000),
+        "p99_1_ligne_ms": float(np.percentile(durees, 99) * 1000),
+        "lignes_par_s_lot_10k": LOT / (time.perf_counter() - debut),
+    }
+
+
+def evaluer_jeu(jeu, test, repetitions=100):
+    """Mesures par cible et globales d'un dossier de modèles."""
+    config = JEUX[jeu]
+    dossier = os.path.join(RACINE, jeu)
+    preprocess = preprocess_de(os.path.join(RACINE, config["preprocess"])) if "preprocess" in config else None
+    X = test[colonnes_entree(config["sexe"])]
+
+    cibles = {}
+    for fichier in fichiers(dossier):
+        cible = nom_cible(fichier)
+        modele, entree = _charger(os.path.join(dossier, fichier), preprocess)
+        try:
+            prediction = np.asarray(modele.predict(X), dtype=float).ravel()
+        except Exception as e:
+            cibles[cible] = {**entree, "erreur": f"{type(e).__name__}: {e}"}
+            continue
+        if cible in test:
+            vrai = test[cible].to_numpy(dtype=float)
+            masque = ~np.isnan(vrai)
+            entree["mae"] = float(np.mean(np.abs(prediction[masque] - vrai[masque])))
+            entree["lignes_evaluees"] = int(masque.sum())
+        else:
+            entree["mae"] = None
+        cibles[cible] = {**entree, **_mesurer(modele, X, repetitions)}
+
+    valides = [c for c in cibles.values() if "erreur" not in c]
+    maes = [c["mae"] for c in valides if c["mae"] is not None]
+    return {
+        "sexe": config["sexe"],
+        "preprocess": config.get("preprocess"),
+        "cibles": cibles,
+        "global": {
+            **mesurer_chargement(dossier),
+            "cibles": len(cibles),
+            "erreurs": len(cibles) - len(valides),
+            "mae_moyenne": float(np.mean(maes)) if maes else None,
+            # Prédire toutes les cibles d'un formulaire = une ligne par modèle
+            "p50_formulaire_ms": float(sum(c["p50_1_ligne_ms"] for c in valides)),
+        },
+    }
+
+
+def classement(jeux, seed=0, repetitions=100, threads=1):
+    tests = {}
+    resultats = {}
+    with threadpool_limits(limits=threads):
+        for jeu in jeux:
+            sexe = JEUX[jeu]["sexe"]
+            if sexe not in tests:
+                tests[sexe] = echantillon_test(sexe, seed)
+            print(f"⚙️ {jeu} ({sexe}, {len(tests[sexe])} lignes de test)")
+            resultats[jeu] = evaluer_jeu(jeu, tests[sexe], repetitions)
+    return {
+        "commit": commit_courant(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "versions": versions_bibliotheques(),
+        "echantillon": {
+            "graine": seed, "part_test": PART_TEST, "threads": threads, "repetitions": repetitions,
+            "lignes": {sexe: len(df) for sexe, df in tests.items()},
+            # Deux classements ne sont comparables que si l'échantillon est le même
+            "empreinte": {sexe: joblib.hash(df) for sexe, df in tests.items()},
+        },
+        "jeux": resultats,
+    }
+
+
+def afficher(resultat):
+    print(f"\n📊 Classement ({resultat['commit']}, {resultat['date']})")
+    print(f"{'jeu':<30} {'sexe':<6} {'MAE moy.':>9} {'formulaire ms':>14} {'froid s':>8} {'RSS Mo':>8} {'disque Mo':>10}")
+    lignes = sorted(resultat["jeux"].items(), key=lambda kv: (kv[1]["sexe"], kv[1]["global"]["mae_moyenne"] or np.inf))
+    for jeu, r in lignes:
+        g = r["global"]
+        mae = f"{g['mae_moyenne']:.3f}" if g["mae_moyenne"] is not None else "-"
+        print(f"{jeu:<30} {r['sexe']:<6} {mae:>9} {g['p50_formulaire_ms']:>14.2f} {g['chargement_froid_s']:>8.2f} "
+              f"{g['rss_max_mo']:>8.1f} {g['fichiers_mo']:>10.2f}")
+
+
+def comparer(actuel, precedent):
+    """Écarts par jeu et par cible (MAE, p50) avec un classement précédent."""
+    print(f"\n↻ Comparaison avec {precedent.get('commit')} ({precedent.get('date')})")
+    if actuel["echantillon"]["empreinte"] != precedent.get("echantillon", {}).get("empreinte"):
+        print("⚠️ Échantillons de test différents : les MAE ne sont pas comparables")
+    for jeu, r in actuel["jeux"].items():
+        avant = precedent.get("jeux", {}).get(jeu)
+        if avant is None:
+            print(f"  {jeu:<30} nouveau")
+            continue
+        for cible, e in r["cibles"].items():
+            a = avant["cibles"].get(cible)
+            if a is None or "erreur" in e or "erreur" in a:
+                continue
+            d_mae = (e["mae"] - a["mae"]) if e["mae"] is not None and a["mae"] is not None else 0.0
+            d_p50 = e["p50_1_ligne_ms"] - a["p50_1_ligne_ms"]
+            if abs(d_mae) > 1e-6 or abs(d_p50) > 0.1 * a["p50_1_ligne_ms"]:
+                print(f"  {jeu:<30} {cible:<50} MAE {d_mae:+.4f}  p50 {d_p50:+.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classement des dossiers de modèles livrés")
+    parser.add_argument("--jeux", nargs="+", choices=list(JEUX), default=list(JEUX))
+    parser.add_argument("--seed", type=int, default=0, help="Graine du mélange avant découpe")
+    parser.add_argument("--repetitions", type=int, default=100, help="Prédictions d'une ligne par cible")
+    parser.add_argument("--threads", type=int, default=1, help="Threads BLAS/OpenMP pendant les mesures")
+    parser.add_argument("--sortie", default="leaderboard.json")
+    parser.add_argument("--comparer", help="Classement JSON précédent")
+    args = parser.parse_args()
+
+    resultat = classement(args.jeux, args.seed, args.repetitions, args.threads)
+    resultat["fichiers"] = {jeu: empreinte_fichiers([os.path.join(RACINE, jeu, f)
+                                                     for f in fichiers(os.path.join(RACINE, jeu))])
+                            for jeu in args.jeux}
+    with open(args.sortie + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(resultat, f, indent=2, ensure_ascii=False)
+    os.replace(args.sortie + ".tmp", args.sortie)
+    afficher(resultat)
+    print(f"✔ Classement écrit dans {args.sortie}")
+    if args.comparer:
+        with open(args.comparer, encoding="utf-8") as f:
+            comparer(resultat, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
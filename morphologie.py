@@ -0,0 +1,153 @@
+# =======================
+# Catégories morphologiques (ventre, torse, cuisses, bassin)
+# =======================
+# Version vectorisée de classifier_morphologie des notebooks. Chaque
+# catégorie découpe le ratio mesure / taille en classes par des seuils :
+#   étiquette k si seuils[k-1] <= ratio < seuils[k]
+# La recherche des classes se fait par np.searchsorted sur des tableaux
+# entiers, sans DataFrame.apply.
+#
+# Une mesure ou une taille nulle ou négative (valeur absente de certains
+# CSV) donne un ratio manquant, donc une catégorie None, partout.
+#
+# Les seuils sont lus dans morphologie.json. Les valeurs livrées sont
+# celles des notebooks, avec lesquelles les modèles actuels ont été
+# entraînés : ce ne sont pas des quantiles ("calibre": false dans
+# _calibration, signalé par `afficher`). `calibrer` les recalcule comme
+# quantiles des ratios d'une source harmonisée, en un seul passage ; les
+# modèles qui prennent les catégories en entrée sont alors à réentraîner.
+#
+# Usage :
+#   python morphologie.py calibrer --sexe homme --source caesar_homme
+#   python morphologie.py afficher
+import argparse
+import functools
+import json
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+CODES_SEXE = {"homme": 1, "femme": 0}
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "morphologie.json")
+
+
+@functools.lru_cache(maxsize=None)
+def _lire_config(chemin):
+    with open(chemin, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def charger_config(chemin=CONFIG):
+    return _lire_config(os.path.abspath(chemin))
+
+
+def categories(sexe, config=None):
+    """{colonne: réglage} des catégories d'un sexe (sans les métadonnées)."""
+    config = config or charger_config()
+    return {nom: regle for nom, regle in config[sexe].items() if not nom.startswith("_")}
+
+
+def ratios(mesures, sexe, config=None):
+    """{colonne de catégorie: ratio mesure / taille} pour les mesures présentes (NaN si <= 0)."""
+    taille = _positives(mesures["taille"])
+    return {
+        nom: _positives(mesures[regle["mesure"]]) / taille
+        for nom, regle in categories(sexe, config).items()
+        if regle["mesure"] in mesures
+    }
+
+
+def _positives(valeurs):
+    valeurs = np.asarray(valeurs, dtype=float)
+    return np.where(valeurs > 0, valeurs, np.nan)
+
+
+def classer_ratio(ratio, seuils, etiquettes):
+    """Étiquettes d'un tableau de ratios ; None pour un ratio manquant."""
+    ratio = np.asarray(ratio, dtype=float)
+    classes = np.take(np.asarray(etiquettes, dtype=object), np.searchsorted(seuils, ratio, side="right"))
+    classes[np.isnan(ratio)] = None
+    return classes
+
+
+def classer(mesures, sexe, config=None):
+    """Catégories d'un DataFrame (ou dict de tableaux) contenant taille et les mesures.
+
+    Les catégories dont la mesure est absente ne sont pas calculées.
+
+    Returns:
+        pd.DataFrame: une colonne par catégorie, même index que `mesures` si c'est un DataFrame.
+    """
+    regles = categories(sexe, config)
+    resultat = pd.DataFrame({
+        nom: classer_ratio(ratio, regles[nom]["seuils"], regles[nom]["etiquettes"])
+        for nom, ratio in ratios(mesures, sexe, config).items()
+    })
+    if isinstance(mesures, pd.DataFrame):
+        resultat.index = mesures.index
+    return resultat
+
+
+def calibrer(mesures, sexe, config=None, source=None):
+    """Nouvelle configuration où les seuils du sexe sont les quantiles des ratios de `mesures`.
+
+    Tous les ratios et tous les quantiles sont calculés en un seul appel
+    à np.nanquantile.
+    """
+    config = json.loads(json.dumps(config or charger_config()))
+    regles = categories(sexe, config)
+    valeurs = ratios(mesures, sexe, config)
+    noms = list(valeurs)
+    quantiles = sorted({q for nom in noms for q in regles[nom]["quantiles"]})
+    tableau = np.column_stack([valeurs[nom] for nom in noms])
+    seuils = np.nanquantile(tableau, quantiles, axis=0)
+    for j, nom in enumerate(noms):
+        regles[nom]["seuils"] = [round(float(seuils[quantiles.index(q), j]), 6) for q in regles[nom]["quantiles"]]
+    config[sexe]["_calibration"] = {
+        "calibre": True,
+        "source": source,
+        "lignes": int(np.isfinite(tableau).all(axis=1).sum()),
+        "date": date.today().isoformat(),
+    }
+    return config
+
+
+def enregistrer_config(config, chemin=CONFIG):
+    with open(chemin + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2, ensure_ascii=False)
+    os.replace(chemin + ".tmp", chemin)
+    _lire_config.cache_clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seuils des catégories morphologiques")
+    sous = parser.add_subparsers(dest="action", required=True)
+    p = sous.add_parser("calibrer", help="Recalcule les seuils comme quantiles d'une source")
+    p.add_argument("--sexe", choices=["homme", "femme"], required=True)
+    p.add_argument("--source", required=True, help="Source harmonisée du sexe (ex. caesar_homme, ansur_ii_femme)")
+    p.add_argument("--config", default=CONFIG)
+    p = sous.add_parser("afficher", help="Affiche les seuils actuels")
+    p.add_argument("--config", default=CONFIG)
+    args = parser.parse_args()
+
+    if args.action == "calibrer":
+        from harmonisation import vue
+
+        config = charger_config(args.config)
+        colonnes = ["taille"] + [r["mesure"] for r in categories(args.sexe, config).values()]
+        df = vue(args.source).to_pandas(colonnes)
+        config = calibrer(df, args.sexe, config, args.source)
+        enregistrer_config(config, args.config)
+
+    for sexe in ("homme", "femme"):
+        calibration = charger_config(args.config)[sexe].get("_calibration", {})
+        if not calibration.get("calibre"):
+            print(f"⚠️ {sexe} : seuils non calibrés ({calibration.get('source', 'origine inconnue')})")
+        for nom, regle in categories(sexe, charger_config(args.config)).items():
+            print(f"  {sexe:<6} {nom:<18} {regle['mesure']:<18} {regle['seuils']}  {regle['etiquettes']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+# =======================
+# Cache persistant des prédictions, partagé entre processus
+# =======================
+# Beaucoup de formulaires se ressemblent (tailles et poids ronds, mêmes
+# catégories). Les prédictions sont gardées dans une base SQLite en mode
+# WAL, partagée par les sessions Streamlit, les workers de serve.py /
+# prefork.py et tout processus de la machine.
+#
+# Clé : sexe + version du jeu de modèles (registry.ModelVersion.version) +
+# ligne canonique :
+#   - colonnes dans l'ordre de colonnes_entree(sexe) ;
+#   - valeurs numériques arrondies au pas du formulaire
+#     (SCHEMAS[sexe]["bornes"]) ;
+#   - catégories en minuscules, sans espaces autour.
+# La prédiction est toujours calculée sur la ligne canonique : une ligne
+# servie depuis le cache est identique à un recalcul.
+#
+# Éviction : durée de vie (ttl_s) et nombre maximal d'entrées, les moins
+# récemment utilisées partant d'abord. La date d'utilisation n'est réécrite
+# que si elle a plus de `resolution_lru_s`, pour que les lectures restent
+# des lectures. Quand la version d'un jeu change, les entrées des autres
+# versions de ce sexe sont supprimées. Les compteurs de succès et d'échecs
+# sont cumulés en mémoire et ajoutés à la base par paquets.
+#
+# Usage :
+#   from prediction_cache import get_cache
+#   resultat = get_cache().predict_one(registry.current("homme"), "homme", ligne)
+#
+#   python prediction_cache.py stats
+#   python prediction_cache.py purger
+#   python prediction_cache.py vider
+import argparse
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from schemas import SCHEMAS, colonnes_entree
+from wrapper import PredictionResult
+
+CHEMIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_predictions.sqlite")
+TTL_S = 7 * 24 * 3600
+MAX_ENTREES = 200_000
+RESOLUTION_LRU_S = 60.0
+# Opérations entre deux écritures des compteurs / deux purges
+PAQUET_COMPTEURS = 200
+PAQUET_PURGE = 1000
+
+
+def canonique(sexe, ligne):
+    """Ligne canonique (dict ordonné) et sa clé texte."""
+    bornes = SCHEMAS[sexe]["bornes"]
+    canon = {}
+    for colonne in colonnes_entree(sexe):
+        valeur = ligne[colonne]
+        if colonne in SCHEMAS[sexe]["colonnes_cat"]:
+            canon[colonne] = str(valeur).strip().lower()
+        else:
+            pas = bornes[colonne][2] if colonne in bornes else 1e-6
+            valeur = round(float(valeur) / pas) * pas
+            canon[colonne] = int(valeur) if float(pas).is_integer() else round(valeur, 6)
+    return canon, json.dumps(canon, separators=(",", ":"))
+
+
+class CachePredictions:
+    """Prédictions par (sexe, version, ligne canonique) dans SQLite (WAL)."""
+
+    def __init__(self, chemin=CHEMIN, ttl_s=TTL_S, max_entrees=MAX_ENTREES, resolution_lru_s=RESOLUTION_LRU_S):
+        self.chemin = chemin
+        self.ttl_s = ttl_s
+        self.max_entrees = max_entrees
+        self.resolution_lru_s = resolution_lru_s
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._compteurs = {"succes": 0, "echecs": 0}
+        self._operations = 0
+        self._ecritures = 0
+        self._versions = {}
+        # Connexion temporaire : aucune connexion ouverte ne doit passer un fork
+        c = sqlite3.connect(chemin, timeout=30, isolation_level=None)
+        try:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                " sexe TEXT, version TEXT, cle TEXT, valeurs BLOB, cree REAL, utilise REAL,"
+                " PRIMARY KEY (sexe, version, cle))"
+            )
+            c.execute("CREATE INDEX IF NOT EXISTS predictions_utilise ON predictions (utilise)")
+            c.execute("CREATE TABLE IF NOT EXISTS compteurs (nom TEXT PRIMARY KEY, valeur INTEGER)")
+        finally:
+            c.close()
+
+    def _connexion(self):
+        # Une connexion par thread et par processus (les connexions ne passent pas un fork)
+        connexion = getattr(self._local, "connexion", None)
+        if connexion is None or self._local.pid != os.getpid():
+            connexion = sqlite3.connect(self.chemin, timeout=30, isolation_level=None)
+            connexion.execute("PRAGMA synchronous=NORMAL")
+            self._local.connexion, self._local.pid = connexion, os.getpid()
+        return connexion
+
+    # ---- Lecture / écriture ----
+    def lire(self, sexe, version, cle):
+        """Valeurs (np.ndarray) en cache, ou None."""
+        self._verifier_version(sexe, version)
+        maintenant = time.time()
+        ligne = self._connexion().execute(
+            "SELECT valeurs, cree, utilise FROM predictions WHERE sexe = ? AND version = ? AND cle = ?",
+            (sexe, version, cle),
+        ).fetchone()
+        if ligne is None or maintenant - ligne[1] > self.ttl_s:
+            self._compter("echecs")
+            return None
+        if maintenant - ligne[2] > self.resolution_lru_s:
+            self._connexion().execute(
+                "UPDATE predictions SET utilise = ? WHERE sexe = ? AND version = ? AND cle = ?",
+                (maintenant, sexe, version, cle),
+            )
+        self._compter("succes")
+        return np.frombuffer(ligne[0], dtype=np.float64)
+
+    def ecrire(self, sexe, version, entrees):
+        """Ajoute des prédictions : `entrees` = [(clé, valeurs), ...]."""
+        self._verifier_version(sexe, version)
+        maintenant = time.time()
+        c = self._connexion()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            c.executemany(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?)",
+                [(sexe, version, cle, np.asarray(valeurs, dtype=np.float64).tobytes(), maintenant, maintenant)
+                 for cle, valeurs in entrees],
+            )
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self._ecritures += len(entrees)
+            purger = self._ecritures >= PAQUET_PURGE
+            if purger:
+                self._ecritures = 0
+        if purger:
+            self.purger()
+
+    def predict_one(self, version, sexe, ligne):
+        """PredictionResult d'une ligne, depuis le cache ou calculé par version.wrapper.
+
+        Args:
+            version (registry.ModelVersion): jeu de modèles en service.
+            sexe (str): "homme" ou "femme".
+            ligne (dict): entrées du formulaire.
+        """
+        canon, cle = canonique(sexe, ligne)
+        index = {nom: i for i, nom in enumerate(version.wrapper.target_names)}
+        valeurs = self.lire(sexe, version.version, cle)
+        if valeurs is None:
+            valeurs = np.asarray(version.wrapper.predict_one(canon).values, dtype=np.float64)
+            self.ecrire(sexe, version.version, [(cle, valeurs)])
+        return PredictionResult(index, valeurs)
+
+    # ---- Invalidation, éviction, compteurs ----
+    def _verifier_version(self, sexe, version):
+        if self._versions.get(sexe) == version:
+            return
+        with self._lock:
+            if self._versions.get(sexe) == version:
+                return
+            self._versions[sexe] = version
+        self._connexion().execute("DELETE FROM predictions WHERE sexe = ? AND version != ?", (sexe, version))
+
+    def purger(self):
+        """Supprime les entrées expirées puis les moins récemment utilisées au-delà de max_entrees."""
+        c = self._connexion()
+        expirees = c.execute("DELETE FROM predictions WHERE cree < ?", (time.time() - self.ttl_s,)).rowcount
+        exces = c.execute(
+            "DELETE FROM predictions WHERE rowid IN (SELECT rowid FROM predictions ORDER BY utilise DESC"
+            " LIMIT -1 OFFSET ?)", (self.max_entrees,),
+        ).rowcount
+        return expirees + exces
+
+    def _compter(self, nom):
+        with self._lock:
+            self._compteurs[nom] += 1
+            self._operations += 1
+            if self._operations < PAQUET_COMPTEURS:
+                return
+            compteurs, self._compteurs = self._compteurs, {"succes": 0, "echecs": 0}
+            self._operations = 0
+        self._ajouter_compteurs(compteurs)
+
+    def _ajouter_compteurs(self, compteurs):
+        self._connexion().executemany(
+            "INSERT INTO compteurs VALUES (?, ?) ON CONFLICT (nom) DO UPDATE SET valeur = valeur + excluded.valeur",
+            list(compteurs.items()),
+        )
+
+    def flush(self):
+        """Écrit les compteurs en attente de ce processus."""
+        with self._lock:
+            compteurs, self._compteurs = self._compteurs, {"succes": 0, "echecs": 0}
+            self._operations = 0
+        self._ajouter_compteurs(compteurs)
+
+    def stats(self):
+        """Compteurs cumulés (tous processus) et contenu du cache."""
+        self.flush()
+        c = self._connexion()
+        compteurs = dict(c.execute("SELECT nom, valeur FROM compteurs").fetchall())
+        total = compteurs.get("succes", 0) + compteurs.get("echecs", 0)
+        return {
+            **compteurs,
+            "taux_succes": compteurs.get("succes", 0) / total if total else None,
+            "entrees": dict(c.execute("SELECT sexe || ' ' || version, COUNT(*) FROM predictions"
+                                      " GROUP BY sexe, version").fetchall()),
+            "fichier_mo": sum(os.path.getsize(self.chemin + s) for s in ("", "-wal")
+                              if os.path.exists(self.chemin + s)) / 1e6,
+        }
+
+    def vider(self):
+        c = self._connexion()
+        c.execute("DELETE FROM predictions")
+        c.execute("DELETE FROM compteurs")
+        c.execute("VACUUM")
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    """Cache unique du processus (fichier CHEMIN)."""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = CachePredictions()
+            atexit.register(_CACHE.flush)
+        return _CACHE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache persistant des prédictions")
+    parser.add_argument("action", choices=["stats", "purger", "vider"])
+    parser.add_argument("--chemin", default=CHEMIN)
+    args = parser.parse_args()
+    cache = CachePredictions(args.chemin)
+    if args.action == "purger":
+        print(f"✔ {cache.purger()} entrée(s) supprimée(s)")
+    elif args.action == "vider":
+        cache.vider()
+        print(f"✔ Cache vidé : {args.chemin}")
+    print(json.dumps(cache.stats(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+# =======================
+# Service de prédiction multi-workers par pré-fork (pages partagées)
+# =======================
+# Lancer N fois serve.py charge N copies des deux jeux de modèles. Ici le
+# processus maître :
+#   1. désactive le ramasse-miettes (gc.disable) avant de charger les
+#      modèles, pour ne pas laisser de trous dans les pages ;
+#   2. charge les deux jeux (registry.ModelRegistry, sans surveillance) et
+#      les chauffe : predict_one et un predict par lot créent les tampons,
+#      le préprocesseur compilé et les modèles finaux avant le fork. Le tout
+#      sous threadpool_limits(--threads) : avec libgomp (xgboost, lightgbm),
+#      une équipe OpenMP créée avant un fork peut bloquer les workers à
+#      leur prochaine région parallèle ;
+#   3. arrête les threads du registre, ouvre la socket d'écoute, appelle
+#      gc.freeze() juste avant de forker N workers ;
+#   4. dans chaque worker : gc.enable(), limites de threads BLAS, puis la
+#      boucle asyncio de serve.Service sur la socket héritée.
+# Les objets gelés ne sont plus parcourus par le GC des workers et les
+# tableaux numpy des modèles ne sont jamais écrits : leurs pages restent
+# partagées en copie sur écriture.
+#
+# Le maître relance un worker qui meurt, transmet SIGTERM / SIGINT, et
+# écrit périodiquement la mémoire de chaque processus (smaps_rollup :
+# mémoire propre USS, partagée, PSS).
+#
+# Sans rechargement à chaud : pour déployer de nouveaux modèles, relancer
+# le maître.
+#
+# Usage :
+#   python prefork.py --workers 8 --port 8000 --rapport prefork_memoire.json
+import argparse
+import asyncio
+import gc
+import json
+import os
+import signal
+import socket
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from threadpoolctl import threadpool_limits
+
+from registry import ModelRegistry
+from schemas import SCHEMAS, colonnes_entree
+from serve import Service
+
+CHAMPS_SMAPS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def memoire(pid):
+    """Mémoire d'un processus en Mo : rss, pss, propre (USS) et partagée (Linux, smaps_rollup)."""
+    valeurs = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for ligne in f:
+                nom, _, reste = ligne.partition(":")
+                if nom in CHAMPS_SMAPS:
+                    valeurs[nom] = int(reste.split()[0]) / 1024
+    except OSError:
+        return None
+    return {
+        "rss_mo": round(valeurs.get("Rss", 0), 1),
+        "pss_mo": round(valeurs.get("Pss", 0), 1),
+        "propre_mo": round(valeurs.get("Private_Clean", 0) + valeurs.get("Private_Dirty", 0), 1),
+        "partagee_mo": round(valeurs.get("Shared_Clean", 0) + valeurs.get("Shared_Dirty", 0), 1),
+    }
+
+
+def charger_et_chauffer(threads=1, lot=64):
+    """Registre chargé, chauffé, et sans thread actif (prêt pour fork)."""
+    with threadpool_limits(limits=threads):
+        # Chargement dans ce thread : threadpool_limits ne vaut que pour le thread appelant
+        registry = ModelRegistry().preload(parallel=False)
+        for sexe, schema in SCHEMAS.items():
+            wrapper = registry.get(sexe)
+            wrapper.predict_one(schema["exemple"])
+            wrapper.predict(pd.DataFrame([schema["exemple"]] * lot, columns=colonnes_entree(sexe)))
+            print(f"✔ {sexe} : {registry.status()[sexe]}")
+    # Les threads ne survivent pas au fork : le pool du registre est arrêté ici
+    registry.close(wait=True)
+    return registry
+
+
+def _worker(registry, sock, options):
+    gc.enable()
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    threadpool_limits(limits=options["threads"])
+    # Les prédictions tournent dans le pool du Service : la limite OpenMP y est posée par thread
+    service = Service(options["attente_max_s"], options["lot_max"], options["file_max"], registry=registry,
+                      cache=options["cache"], threads=options["threads"])
+    asyncio.run(service.servir(sock=sock))
+
+
+def forker(registry, sock, options):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _worker(registry, sock, options)
+        except BaseException:
+            import traceback
+
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def rapport_memoire(maitre, workers):
+    processus = {"maitre": {"pid": maitre, **(memoire(maitre) or {})}}
+    for i, pid in enumerate(workers):
+        processus[f"worker_{i}"] = {"pid": pid, **(memoire(pid) or {})}
+    mesures = [p for nom, p in processus.items() if nom != "maitre" and "pss_mo" in p]
+    return {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "processus": processus,
+        "total_pss_mo": round(sum(p["pss_mo"] for p in processus.values() if "pss_mo" in p), 1),
+        "propre_moyenne_worker_mo": round(float(np.mean([p["propre_mo"] for p in mesures])), 1) if mesures else None,
+        "partagee_moyenne_worker_mo": round(float(np.mean([p["partagee_mo"] for p in mesures])), 1) if mesures else None,
+    }
+
+
+def afficher_memoire(rapport):
+    print(f"\n📊 Mémoire ({rapport['date']}) — PSS total {rapport['total_pss_mo']} Mo")
+    print(f"{'processus':<12} {'pid':>8} {'RSS':>9} {'PSS':>9} {'propre':>9} {'partagée':>9}")
+    for nom, p in rapport["processus"].items():
+        if "rss_mo" in p:
+            print(f"{nom:<12} {p['pid']:>8} {p['rss_mo']:>9.1f} {p['pss_mo']:>9.1f} {p['propre_mo']:>9.1f} "
+                  f"{p['partagee_mo']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Service de prédiction pré-forké à modèles partagés")
+    parser.add_argument("--hote", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=1, help="Threads BLAS/OpenMP par worker")
+    parser.add_argument("--attente-max-ms", type=float, default=5.0)
+    parser.add_argument("--lot-max", type=int, default=256)
+    parser.add_argument("--file-max", type=int, default=10_000)
+    parser.add_argument("--sans-cache", action="store_true", help="Désactive le cache persistant des prédictions")
+    parser.add_argument("--rapport", help="Fichier JSON du relevé mémoire, réécrit périodiquement")
+    parser.add_argument("--intervalle-rapport", type=float, default=30.0)
+    args = parser.parse_args()
+    if not hasattr(os, "fork") or not os.path.exists("/proc/self/smaps_rollup"):
+        sys.exit("prefork.py nécessite Linux (fork, /proc/<pid>/smaps_rollup)")
+
+    gc.disable()
+    options = {"threads": args.threads, "attente_max_s": args.attente_max_ms / 1000,
+               "lot_max": args.lot_max, "file_max": args.file_max, "cache": not args.sans_cache}
+    debut = time.perf_counter()
+    registry = charger_et_chauffer(args.threads)
+    sock = socket.create_server((args.hote, args.port), backlog=1024)
+    print(f"⚙️ Modèles prêts en {time.perf_counter() - debut:.1f} s, {args.workers} worker(s) sur "
+          f"http://{args.hote}:{args.port}")
+
+    gc.freeze()
+    workers = [forker(registry, sock, options) for _ in range(args.workers)]
+
+    arret = False
+
+    def arreter(signum, _frame):
+        nonlocal arret
+        arret = True
+        for pid in workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, arreter)
+    signal.signal(signal.SIGINT, arreter)
+
+    prochain_rapport = time.monotonic() + min(5.0, args.intervalle_rapport)
+    while workers:
+        try:
+            pid, statut = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            if pid not in workers:
+                # Enfant étranger ou worker déjà retiré
+                continue
+            i = workers.index(pid)
+            if arret:
+                workers.pop(i)
+                continue
+            print(f"⚠️ Worker {pid} arrêté (statut {statut}), relance")
+            workers[i] = forker(registry, sock, options)
+            continue
+        if time.monotonic() >= prochain_rapport and not arret:
+            rapport = rapport_memoire(os.getpid(), workers)
+            afficher_memoire(rapport)
+            if args.rapport:
+                with open(args.rapport + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(rapport, f, indent=2, ensure_ascii=False)
+                os.replace(args.rapport + ".tmp", args.rapport)
+            prochain_rapport = time.monotonic() + args.intervalle_rapport
+        time.sleep(0.2)
+    print("✔ Workers arrêtés")
+
+
+if __name__ == "__main__":
+    main()
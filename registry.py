@@ -0,0 +1,311 @@
+# =======================
+# Registre des jeux de modèles, préchargés et rechargés à chaud
+# =======================
+# Les applications Streamlit chargeaient le dossier de pipelines du sexe
+# choisi au premier affichage : le premier utilisateur qui changeait de
+# sexe attendait 13 à 19 joblib.load successifs. Ici les deux jeux
+# (SCHEMAS[sexe]["dossier"]) sont chargés dès l'import, chacun dans son
+# thread ; la page s'affiche pendant le chargement et une prédiction
+# n'attend que le jeu dont elle a besoin.
+#
+# Rechargement à chaud : un thread surveille les dossiers (ou fichiers
+# bundle) par leur signature (noms, tailles, dates des .pkl). Quand une
+# signature change et reste stable d'un tour à l'autre, la nouvelle version
+# est chargée en arrière-plan, vérifiée par une prédiction témoin (ligne
+# d'exemple du schéma), puis installée par une simple affectation sous
+# verrou. Une requête en cours garde la ModelVersion qu'elle a obtenue ;
+# les `keep` dernières versions restent en mémoire pour un retour arrière.
+# Un retour arrière (activate) épingle le jeu sur la signature des fichiers
+# à cet instant : il n'est plus rechargé tant qu'elle ne change pas.
+#
+# Le registre est unique par processus (get_registry) : il survit aux
+# réexécutions du script Streamlit et est partagé par toutes les sessions.
+#
+# Usage :
+#   from registry import get_registry
+#   registry = get_registry()              # préchargement + surveillance, sans bloquer
+#   version = registry.current("femme")    # attend seulement le jeu femme
+#   result = version.wrapper.predict_one(row)
+#   version.version                        # version qui a servi la prédiction
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+from schemas import SCHEMAS
+from wrapper import MultiTPOTWrapper, load_models
+
+# Secondes entre deux examens des dossiers surveillés
+INTERVAL = 5.0
+# Versions gardées en mémoire par jeu (la courante comprise)
+KEEP = 2
+
+
+def signature(path):
+    """(nom, taille, date) des fichiers d'un jeu de modèles (dossier de .pkl ou bundle)."""
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return ((os.path.basename(path), stat.st_size, stat.st_mtime_ns),)
+    entries = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".pkl"):
+            stat = os.stat(os.path.join(path, name))
+            entries.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(entries)
+
+
+def version_id(sig):
+    return hashlib.sha256(repr(sig).encode()).hexdigest()[:12]
+
+
+class ModelVersion:
+    """Une version chargée d'un jeu de modèles."""
+
+    def __init__(self, key, path, sig, wrapper, load_s):
+        self.key = key
+        self.path = path
+        self.signature = sig
+        self.version = version_id(sig)
+        self.wrapper = wrapper
+        self.load_s = load_s
+        self.loaded_at = time.time()
+
+    def __repr__(self):
+        return f"ModelVersion({self.key!r}, {self.version}, {len(self.signature)} fichier(s))"
+
+
+def _canary(key, wrapper):
+    """Prédiction témoin sur la ligne d'exemple du schéma ; lève une erreur si elle échoue."""
+    if key not in SCHEMAS:
+        return
+    values = np.asarray(list(wrapper.predict_one(SCHEMAS[key]["exemple"]).values()), dtype=float)
+    if values.size == 0 or not np.all(np.isfinite(values)):
+        raise ValueError(f"Prédiction témoin invalide pour {key!r} : {values}")
+
+
+class ModelRegistry:
+    """Jeux de modèles par clé (sexe), chargés en parallèle et rechargés à chaud."""
+
+    def __init__(self, folders=None, keep=KEEP, interval=INTERVAL):
+        self.folders = dict(folders or {sexe: schema["dossier"] for sexe, schema in SCHEMAS.items()})
+        self.keep = keep
+        self.interval = interval
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.folders)),
+                                            thread_name_prefix="registry")
+        self._first = {}
+        self._current = {}
+        self._history = {key: deque(maxlen=keep) for key in self.folders}
+        self._errors = {}
+        # {clé: signature sur disque au retour arrière} : rechargement suspendu
+        self._pins = {}
+        self._loading = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    # ---- Chargement ----
+    def preload(self, parallel=True):
+        """Lance le premier chargement de tous les jeux qui ne sont pas déjà en cours.
+
+        Args:
+            parallel (bool): False pour charger les jeux l'un après l'autre
+                dans le thread appelant (avant un fork : aucune prédiction
+                témoin ne tourne dans un autre thread).
+        """
+        for key in self.folders:
+            if parallel:
+                self._first_load(key)
+                continue
+            with self._lock:
+                if key in self._first:
+                    continue
+                future = self._first[key] = Future()
+            try:
+                future.set_result(self._load(key, None))
+            except Exception as e:
+                future.set_exception(e)
+        return self
+
+    def _first_load(self, key):
+        with self._lock:
+            if key not in self._first:
+                self._first[key] = self._executor.submit(self._load, key, None)
+            return self._first[key]
+
+    def _load(self, key, expected):
+        """Charge, vérifie et installe une version ; `expected` = signature vue par le surveillant.
+
+        Returns:
+            ModelVersion: la version installée (ou la courante si rien n'a changé).
+        """
+        path = self.folders[key]
+        sig = expected
+        with self._lock:
+            self._loading.add(key)
+        try:
+            sig = signature(path)
+            if expected is not None and sig != expected:
+                # Déploiement encore en cours : on réessaiera au tour suivant
+                return self._current.get(key)
+            start = time.perf_counter()
+            models, target_names = load_models(path)
+            wrapper = MultiTPOTWrapper(models, shared_preprocess=True, target_names=target_names)
+            _canary(key, wrapper)
+            if signature(path) != sig and key in self._current:
+                # Fichiers modifiés pendant le chargement : on garde la version en service
+                return self._current[key]
+            version = ModelVersion(key, path, sig, wrapper, time.perf_counter() - start)
+            return version if self._install(version) else self._current[key]
+        except Exception as e:
+            # Retenu avec la version fautive : le surveillant ne la recharge pas en boucle
+            with self._lock:
+                self._errors[key] = {"version": None if sig is None else version_id(sig),
+                                     "message": f"{type(e).__name__}: {e}"}
+            if key in self._current:
+                # Une version saine reste en service
+                return self._current[key]
+            raise
+        finally:
+            with self._lock:
+                self._loading.discard(key)
+
+    def _install(self, version):
+        """Met `version` en service, sauf si elle correspond aux fichiers d'un retour arrière."""
+        with self._lock:
+            if self._pins.get(version.key) == version.signature:
+                # Chargement lancé avant le retour arrière : il ne doit pas l'annuler
+                return False
+            self._pins.pop(version.key, None)
+            self._history[version.key].append(version)
+            self._current[version.key] = version
+            self._errors.pop(version.key, None)
+            return True
+
+    # ---- Accès ----
+    def current(self, key, timeout=None):
+        """ModelVersion en service pour `key`, en attendant le premier chargement.
+
+        Raises:
+            KeyError: clé inconnue.
+            concurrent.futures.TimeoutError: premier chargement non terminé après `timeout` s.
+        """
+        if key not in self.folders:
+            raise KeyError(f"Jeu de modèles inconnu : {key!r} (disponibles : {', '.join(self.folders)})")
+        version = self._current.get(key)
+        if version is not None:
+            return version
+        return self._first_load(key).result(timeout)
+
+    def get(self, key, timeout=None):
+        """MultiTPOTWrapper en service pour `key`."""
+        return self.current(key, timeout).wrapper
+
+    def is_ready(self, key):
+        return key in self._current
+
+    def versions(self, key):
+        """Identifiants des versions en mémoire, de la plus ancienne à la plus récente."""
+        return [v.version for v in self._history[key]]
+
+    def activate(self, key, version):
+        """Remet en service une version encore en mémoire (retour arrière).
+
+        Le jeu reste épinglé sur cette version jusqu'à ce que les fichiers
+        sur disque changent à nouveau.
+        """
+        try:
+            sur_disque = signature(self.folders[key])
+        except OSError:
+            sur_disque = None
+        with self._lock:
+            for candidate in self._history[key]:
+                if candidate.version == version:
+                    self._current[key] = candidate
+                    if sur_disque is not None and sur_disque != candidate.signature:
+                        self._pins[key] = sur_disque
+                    else:
+                        self._pins.pop(key, None)
+                    return candidate
+        raise KeyError(f"Version {version!r} absente de la mémoire pour {key!r} : {self.versions(key)}")
+
+    def status(self):
+        """{clé: état lisible} (chargement, version en service, dernière erreur)."""
+        etats = {}
+        for key in self.folders:
+            version = self._current.get(key)
+            if version is None:
+                etat = "chargement" if key in self._first else "en attente"
+            else:
+                etat = f"{version.version} ({version.load_s:.1f} s)"
+                if key in self._loading:
+                    etat += ", nouvelle version en chargement"
+            if key in self._pins:
+                etat += ", épinglée (retour arrière)"
+            if key in self._errors:
+                etat += f", erreur ({self._errors[key]['version']}) : {self._errors[key]['message']}"
+            etats[key] = etat
+        return etats
+
+    # ---- Surveillance ----
+    def watch(self):
+        """Démarre le thread de surveillance des dossiers (idempotent)."""
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name="registry-watch", daemon=True)
+                self._watcher.start()
+        return self
+
+    def _watch(self):
+        seen = {}
+        while not self._stop.wait(self.interval):
+            for key, path in self.folders.items():
+                try:
+                    sig = signature(path)
+                except OSError:
+                    continue
+                version = self._current.get(key)
+                # Une signature doit être identique sur deux tours avant d'être chargée
+                stable = seen.get(key) == sig
+                seen[key] = sig
+                if not stable or key in self._loading or (version is not None and sig == version.signature):
+                    continue
+                if version is None and not (key in self._first and self._first[key].done()):
+                    continue
+                if self._errors.get(key, {}).get("version") == version_id(sig):
+                    continue
+                if self._pins.get(key) == sig:
+                    continue
+                self._executor.submit(self._load, key, sig)
+
+    def check(self):
+        """Recharge tout de suite les jeux dont la signature a changé (sans attendre le surveillant)."""
+        futures = []
+        for key, version in list(self._current.items()):
+            sig = signature(self.folders[key])
+            if sig != version.signature and sig != self._pins.get(key):
+                futures.append(self._executor.submit(self._load, key, None))
+        return [f.result() for f in futures]
+
+    def close(self, wait=False):
+        """Arrête la surveillance et le pool de chargement ; les versions chargées restent utilisables."""
+        self._stop.set()
+        self._executor.shutdown(wait=wait)
+        if wait and self._watcher is not None:
+            self._watcher.join()
+
+
+_REGISTRY = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_registry():
+    """Registre unique du processus, créé, préchargé et surveillé au premier appel."""
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            _REGISTRY = ModelRegistry().preload().watch()
+        return _REGISTRY
@@ -0,0 +1,204 @@
+# =======================
+# Table de réponse précalculée sur l'espace du formulaire
+# =======================
+# Les entrées du formulaire sont bornées (taille 150–210, poids 40–200,
+# âge 15–90, ...) et les catégories peu nombreuses. On évalue donc une fois
+# les pipelines sur une grille régulière, stockée en tenseur .npy
+# (combinaison de catégories × axes numériques × cibles) accompagné d'un
+# manifeste JSON. À l'exécution, ResponseSurface répond par interpolation
+# multilinéaire dans le tenseur ouvert en mmap, sans exécuter les modèles.
+#
+# Usage :
+#   python response_surface.py construire --sexe homme --sortie surfaces/homme
+#   python response_surface.py erreur --sexe homme --sortie surfaces/homme --echantillons 5000
+import argparse
+import itertools
+import json
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from schemas import SCHEMAS
+from wrapper import MultiTPOTWrapper, PredictionResult, load_models
+
+# Pas de grille par défaut : assez fins pour des modèles à base d'arbres,
+# assez grossiers pour garder le tenseur femme sous ~100 Mo.
+PAS_DEFAUT = {
+    "homme": {"taille": 2.5, "weight": 5.0, "age": 5.0},
+    "femme": {"taille": 5.0, "weight": 10.0, "age": 15.0, "taille_soutien_gorge": 10.0, "bonnet_rang": 1.0},
+}
+
+
+def definir_axes(sexe, pas=None):
+    """Axes numériques de la grille : [{"nom", "debut", "pas", "n"}, ...]."""
+    pas = {**PAS_DEFAUT[sexe], **(pas or {})}
+    axes = []
+    for nom in SCHEMAS[sexe]["colonnes_num"]:
+        debut, fin, _ = SCHEMAS[sexe]["bornes"][nom]
+        n = int(math.ceil((fin - debut) / pas[nom] - 1e-9)) + 1
+        axes.append({"nom": nom, "debut": float(debut), "pas": float(pas[nom]), "n": n})
+    return axes
+
+
+def _valeurs_axe(axe):
+    return axe["debut"] + axe["pas"] * np.arange(axe["n"])
+
+
+def construire(sexe, sortie, dossier=None, pas=None, taille_lot=50_000):
+    """Évalue les pipelines sur la grille et écrit <sortie>.npy + <sortie>.json."""
+    schema = SCHEMAS[sexe]
+    dossier = dossier or schema["dossier"]
+    models, target_names = load_models(dossier)
+    wrapper = MultiTPOTWrapper(models, shared_preprocess=True, target_names=target_names)
+
+    axes = definir_axes(sexe, pas)
+    categories = schema["colonnes_cat"]
+    combinaisons = list(itertools.product(*categories.values()))
+    forme = (len(combinaisons),) + tuple(a["n"] for a in axes) + (len(target_names),)
+    tenseur = np.lib.format.open_memmap(sortie + ".npy", mode="w+", dtype=np.float32, shape=forme)
+
+    grille = np.meshgrid(*[_valeurs_axe(a) for a in axes], indexing="ij")
+    points = {a["nom"]: g.ravel() for a, g in zip(axes, grille)}
+    n_points = grille[0].size
+
+    debut = time.perf_counter()
+    for c, combinaison in enumerate(combinaisons):
+        resultat = np.empty((n_points, len(target_names)), dtype=np.float32)
+        for lo in range(0, n_points, taille_lot):
+            hi = min(lo + taille_lot, n_points)
+            X = pd.DataFrame({nom: v[lo:hi] for nom, v in points.items()})
+            for colonne, valeur in zip(categories, combinaison):
+                X[colonne] = valeur
+            resultat[lo:hi] = wrapper.predict(X)
+        tenseur[c] = resultat.reshape(forme[1:])
+        print(f"✔ Combinaison {c + 1}/{len(combinaisons)} : {dict(zip(categories, combinaison))}")
+    tenseur.flush()
+
+    manifeste = {
+        "sexe": sexe,
+        "dossier": dossier,
+        "cibles": target_names,
+        "axes": axes,
+        "categories": categories,
+        "forme": list(forme),
+        "dtype": "float32",
+        "duree_construction_s": round(time.perf_counter() - debut, 1),
+    }
+    with open(sortie + ".json", "w", encoding="utf-8") as f:
+        json.dump(manifeste, f, indent=2, ensure_ascii=False)
+    return manifeste
+
+
+class ResponseSurface:
+    """Moteur de recherche dans une table construite par construire()."""
+
+    def __init__(self, chemin):
+        with open(chemin + ".json", encoding="utf-8") as f:
+            self.manifeste = json.load(f)
+        self.tenseur = np.load(chemin + ".npy", mmap_mode="r")
+        self.target_names = self.manifeste["cibles"]
+        self._axes = self.manifeste["axes"]
+        self._debut = np.array([a["debut"] for a in self._axes])
+        self._pas = np.array([a["pas"] for a in self._axes])
+        self._n = np.array([a["n"] for a in self._axes])
+        # Index de combinaison en base mixte sur les colonnes catégorielles
+        self._categories = [
+            (colonne, {v: k for k, v in enumerate(valeurs)})
+            for colonne, valeurs in self.manifeste["categories"].items()
+        ]
+        self._index = {name: i for i, name in enumerate(self.target_names)}
+
+    def _indices_combinaison(self, X, n):
+        index = np.zeros(n, dtype=np.intp)
+        for colonne, table in self._categories:
+            try:
+                codes = np.array([table[v] for v in X[colonne]], dtype=np.intp)
+            except KeyError as e:
+                raise ValueError(f"Catégorie inconnue pour {colonne} : {e.args[0]!r}") from None
+            index = index * len(table) + codes
+        return index
+
+    def predict(self, X):
+        """Interpolation multilinéaire pour un DataFrame (ou dict de colonnes)."""
+        coords = np.column_stack([np.asarray(X[a["nom"]], dtype=float) for a in self._axes])
+        combinaison = self._indices_combinaison(X, len(coords))
+        if np.isnan(coords).any():
+            raise ValueError("Valeurs manquantes non supportées par la table de réponse")
+
+        # Position fractionnaire dans la grille, bornée aux extrémités
+        u = np.clip((coords - self._debut) / self._pas, 0, self._n - 1)
+        i0 = np.minimum(np.floor(u).astype(np.intp), np.maximum(self._n - 2, 0))
+        frac = u - i0
+
+        d = len(self._axes)
+        sortie = np.zeros((len(coords), len(self.target_names)))
+        for coin in itertools.product((0, 1), repeat=d):
+            coin = np.array(coin)
+            poids = np.prod(np.where(coin, frac, 1 - frac), axis=1)
+            idx = np.minimum(i0 + coin, self._n - 1)
+            valeurs = self.tenseur[(combinaison,) + tuple(idx[:, k] for k in range(d))]
+            sortie += poids[:, None] * valeurs
+        return sortie
+
+    def predict_one(self, row):
+        values = self.predict({k: [v] for k, v in row.items()})[0]
+        return PredictionResult(self._index, values)
+
+
+def echantillon_formulaire(sexe, n, seed=0):
+    """Tire n entrées au hasard dans les bornes et au pas du formulaire."""
+    rng = np.random.default_rng(seed)
+    schema = SCHEMAS[sexe]
+    X = {}
+    for nom in schema["colonnes_num"]:
+        debut, fin, pas = schema["bornes"][nom]
+        X[nom] = debut + pas * rng.integers(0, int(round((fin - debut) / pas)) + 1, size=n)
+    for colonne, valeurs in schema["colonnes_cat"].items():
+        X[colonne] = rng.choice(valeurs, size=n)
+    return pd.DataFrame(X)
+
+
+def erreur_interpolation(surface, wrapper, n=2000, seed=0):
+    """Erreur absolue (max, moyenne) par cible contre les vrais modèles."""
+    X = echantillon_formulaire(surface.manifeste["sexe"], n, seed)
+    ecart = np.abs(surface.predict(X) - wrapper.predict(X))
+    return {
+        cible: {"max": float(ecart[:, j].max()), "moyenne": float(ecart[:, j].mean())}
+        for j, cible in enumerate(surface.target_names)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Table de réponse précalculée")
+    parser.add_argument("action", choices=["construire", "erreur"])
+    parser.add_argument("--sexe", choices=sorted(SCHEMAS), required=True)
+    parser.add_argument("--sortie", required=True, help="Préfixe des fichiers .npy/.json")
+    parser.add_argument("--dossier", help="Dossier de pipelines (défaut : celui du sexe)")
+    parser.add_argument("--pas", nargs="*", default=[], metavar="AXE=PAS",
+                        help="Pas de grille, ex. taille=2.5 weight=5")
+    parser.add_argument("--echantillons", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.action == "construire":
+        pas = {k: float(v) for k, v in (p.split("=") for p in args.pas)}
+        construire(args.sexe, args.sortie, args.dossier, pas)
+
+    surface = ResponseSurface(args.sortie)
+    models, target_names = load_models(args.dossier or surface.manifeste["dossier"])
+    wrapper = MultiTPOTWrapper(models, shared_preprocess=True, target_names=target_names)
+    erreurs = erreur_interpolation(surface, wrapper, args.echantillons)
+    print(f"{'cible':<55} {'max':>8} {'moyenne':>8}")
+    for cible, e in erreurs.items():
+        print(f"{cible:<55} {e['max']:>8.3f} {e['moyenne']:>8.3f}")
+    print(f"Erreur maximale toutes cibles : {max(e['max'] for e in erreurs.values()):.3f}")
+
+    # L'erreur mesurée est conservée dans le manifeste
+    surface.manifeste["erreur_interpolation"] = {"echantillons": args.echantillons, "cibles": erreurs}
+    with open(args.sortie + ".json", "w", encoding="utf-8") as f:
+        json.dump(surface.manifeste, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
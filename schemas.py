@@ -0,0 +1,71 @@
+# =======================
+# Schémas d'entrée des jeux de modèles
+# =======================
+# Un jeu de modèles par sexe, avec les colonnes attendues par le
+# ColumnTransformer "preprocess", les bornes du formulaire Streamlit et une
+# ligne d'exemple (reprise des notebooks Predict_*).
+import os
+
+SCHEMAS = {
+    "homme": {
+        "dossier": "pipelines_all_dataset",
+        "colonnes_num": ["taille", "age", "weight"],
+        "colonnes_cat": {
+            "categorie_ventre": ["plat", "moyen", "rond"],
+            "categorie_torse": ["fin", "moyen", "large"],
+            "categorie_cuisses": ["fines", "moyennes", "larges"],
+        },
+        "bornes": {
+            "taille": (150.0, 210.0, 0.5),
+            "weight": (40.0, 200.0, 0.5),
+            "age": (15, 90, 1),
+        },
+        "exemple": {
+            "taille": 187,
+            "age": 33,
+            "weight": 80,
+            "categorie_ventre": "moyen",
+            "categorie_torse": "large",
+            "categorie_cuisses": "moyennes",
+        },
+    },
+    "femme": {
+        "dossier": "pipelines_female_complets",
+        "colonnes_num": ["taille", "age", "weight", "taille_soutien_gorge", "bonnet_rang"],
+        "colonnes_cat": {
+            "categorie_ventre": ["plat", "moyen", "rond"],
+            "categorie_bassin": ["etroit", "moyen", "large"],
+        },
+        "bornes": {
+            "taille": (150.0, 210.0, 0.5),
+            "weight": (40.0, 200.0, 0.5),
+            "age": (15, 90, 1),
+            "taille_soutien_gorge": (60, 120, 1),
+            "bonnet_rang": (0, 11, 1),
+        },
+        "exemple": {
+            "taille": 168,
+            "age": 28,
+            "weight": 75,
+            "categorie_ventre": "plat",
+            "categorie_bassin": "large",
+            "taille_soutien_gorge": 90,
+            "bonnet_rang": 5,
+        },
+    },
+}
+
+
+def colonnes_entree(sexe):
+    """Liste ordonnée des colonnes d'entrée d'un jeu de modèles."""
+    schema = SCHEMAS[sexe]
+    return schema["colonnes_num"] + list(schema["colonnes_cat"])
+
+
+def sexe_du_dossier(dossier):
+    """Retrouve le sexe associé à un dossier de pipelines, ou None."""
+    nom = os.path.basename(os.path.normpath(dossier))
+    for sexe, schema in SCHEMAS.items():
+        if schema["dossier"] == nom:
+            return sexe
+    return None
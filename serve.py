@@ -0,0 +1,328 @@
+# =======================
+# Service HTTP de prédiction (asyncio, regroupement en micro-lots)
+# =======================
+# Expose les deux jeux de modèles du registre (registry.py) sans Streamlit :
+#   POST /predict/homme   {"taille": 180, "age": 30, ...}       -> une ligne
+#   POST /predict/femme   [{"taille": 165, ...}, {...}]         -> plusieurs lignes
+#   GET  /health          processus vivant + compteurs
+#   GET  /ready           200 quand les deux jeux sont chargés, 503 sinon
+#
+# Les requêtes d'une ligne arrivent dans une file par sexe. Un regroupeur
+# attend la première, puis accumule les suivantes pendant au plus
+# --attente-max-ms ou jusqu'à --lot-max lignes, et les prédit en un seul
+# MultiTPOTWrapper.predict vectorisé, dans un thread pour ne pas bloquer la
+# boucle asyncio. Un lot d'une seule ligne passe par predict_one. La file
+# est bornée (--file-max) : au-delà, réponse 503 immédiate plutôt qu'une
+# latence qui croît sans limite.
+#
+# Chaque ligne est validée (types, bornes et catégories du schéma) avant
+# d'entrer dans la file : une requête invalide reçoit un 400 sans toucher
+# au lot des autres. Si un lot échoue malgré tout, ses lignes sont
+# reprédites une à une et seules les fautives reçoivent une erreur.
+#
+# Les lignes sont d'abord cherchées dans le cache persistant
+# (prediction_cache.py, partagé entre processus) ; les lignes calculées y
+# sont ajoutées. --sans-cache le désactive. Les accès SQLite (lectures,
+# statistiques) passent par un petit pool de threads dédié : la boucle
+# asyncio n'attend jamais un verrou tenu par un autre worker.
+#
+# Le serveur HTTP/1.1 (keep-alive, Content-Length) est écrit sur
+# asyncio.start_server : pas de dépendance supplémentaire.
+#
+# Usage :
+#   python serve.py --port 8000 --attente-max-ms 5 --lot-max 256
+#   curl -s localhost:8000/predict/homme -d '{"taille": 187, "age": 33, "weight": 80,
+#        "categorie_ventre": "moyen", "categorie_torse": "large", "categorie_cuisses": "moyennes"}'
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import numpy as np
+import pandas as pd
+from threadpoolctl import threadpool_limits
+
+from prediction_cache import canonique, get_cache
+from registry import get_registry
+from schemas import SCHEMAS, colonnes_entree
+
+TAILLE_MAX_CORPS = 1 << 20
+
+
+class RequeteInvalide(Exception):
+    def __init__(self, statut, message):
+        super().__init__(message)
+        self.statut = statut
+
+
+class Regroupeur:
+    """File d'attente d'un sexe, vidée par lots vers MultiTPOTWrapper.predict."""
+
+    def __init__(self, registry, sexe, attente_max_s, lot_max, file_max, cache=None, executeur_cache=None,
+                 executeur=None):
+        self.registry = registry
+        self.cache = cache
+        self.executeur_cache = executeur_cache
+        self.executeur = executeur
+        self.sexe = sexe
+        self.colonnes = colonnes_entree(sexe)
+        self.attente_max_s = attente_max_s
+        self.lot_max = lot_max
+        self.file = asyncio.Queue(maxsize=file_max)
+        self.lots = 0
+        self.lignes = 0
+        self.taille_max_vue = 0
+
+    def valider(self, ligne):
+        """Ligne réduite aux colonnes du schéma, nombres dans les bornes et catégories connues.
+
+        Une ligne invalide est refusée (400) avant d'entrer dans un lot
+        partagé avec d'autres requêtes.
+        """
+        if not isinstance(ligne, dict):
+            raise RequeteInvalide(HTTPStatus.BAD_REQUEST, "chaque ligne doit être un objet JSON")
+        manquantes = [c for c in self.colonnes if c not in ligne]
+        if manquantes:
+            raise RequeteInvalide(HTTPStatus.BAD_REQUEST, f"colonnes manquantes : {manquantes}")
+        schema = SCHEMAS[self.sexe]
+        valide = {}
+        for colonne in self.colonnes:
+            valeur = ligne[colonne]
+            if colonne in schema["colonnes_cat"]:
+                permises = schema["colonnes_cat"][colonne]
+                valeur = valeur.strip().lower() if isinstance(valeur, str) else valeur
+                if valeur not in permises:
+                    raise RequeteInvalide(HTTPStatus.BAD_REQUEST,
+                                          f"{colonne} : {ligne[colonne]!r} hors de {permises}")
+            else:
+                if isinstance(valeur, bool) or not isinstance(valeur, (int, float)) or not np.isfinite(valeur):
+                    raise RequeteInvalide(HTTPStatus.BAD_REQUEST, f"{colonne} : nombre attendu, reçu {valeur!r}")
+                if colonne in schema["bornes"]:
+                    minimum, maximum, _ = schema["bornes"][colonne]
+                    if not minimum <= valeur <= maximum:
+                        raise RequeteInvalide(HTTPStatus.BAD_REQUEST,
+                                              f"{colonne} : {valeur} hors de [{minimum}, {maximum}]")
+            valide[colonne] = valeur
+        return valide
+
+    async def predire(self, ligne):
+        """(prédictions, version) pour une ligne, depuis le cache ou une fois son lot traité."""
+        ligne, cle = self.valider(ligne), None
+        if self.cache is not None:
+            try:
+                ligne, cle = canonique(self.sexe, ligne)
+            except (TypeError, ValueError) as e:
+                raise RequeteInvalide(HTTPStatus.BAD_REQUEST, f"valeur invalide : {e}") from None
+            if self.registry.is_ready(self.sexe):
+                version = self.registry.current(self.sexe)
+                valeurs = await asyncio.get_running_loop().run_in_executor(
+                    self.executeur_cache, self.cache.lire, self.sexe, version.version, cle)
+                if valeurs is not None:
+                    return dict(zip(version.wrapper.target_names, valeurs.tolist())), version.version
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.file.put_nowait((ligne, cle, future))
+        except asyncio.QueueFull:
+            raise RequeteInvalide(HTTPStatus.SERVICE_UNAVAILABLE, "file pleine, réessayer plus tard") from None
+        return await future
+
+    async def boucle(self):
+        boucle = asyncio.get_running_loop()
+        while True:
+            lot = [await self.file.get()]
+            fin = boucle.time() + self.attente_max_s
+            while len(lot) < self.lot_max:
+                reste = fin - boucle.time()
+                if reste <= 0:
+                    break
+                try:
+                    lot.append(await asyncio.wait_for(self.file.get(), reste))
+                except asyncio.TimeoutError:
+                    break
+            version = None
+            try:
+                # Le chargement initial (bloquant) et la prédiction se font hors de la boucle
+                version = await boucle.run_in_executor(self.executeur, self.registry.current, self.sexe)
+                resultats = await boucle.run_in_executor(self.executeur, self._predire_lot, version, lot)
+            except Exception as e:
+                if version is None or len(lot) == 1:
+                    resultats = [e] * len(lot)
+                else:
+                    # Une ligne fautive ne doit pas faire échouer les autres requêtes du lot
+                    resultats = await self._predire_separement(version, lot)
+            for (_, _, future), valeurs in zip(lot, resultats):
+                if future.done():
+                    continue
+                if isinstance(valeurs, Exception):
+                    future.set_exception(valeurs)
+                else:
+                    future.set_result((valeurs, version.version))
+            self.lots += 1
+            self.lignes += len(lot)
+            self.taille_max_vue = max(self.taille_max_vue, len(lot))
+
+    async def _predire_separement(self, version, lot):
+        """Résultat ou exception de chaque ligne, prédites une à une."""
+        boucle = asyncio.get_running_loop()
+        resultats = []
+        for element in lot:
+            try:
+                resultats += await boucle.run_in_executor(self.executeur, self._predire_lot, version, [element])
+            except Exception as e:
+                resultats.append(e)
+        return resultats
+
+    def _predire_lot(self, version, lot):
+        wrapper = version.wrapper
+        if len(lot) == 1:
+            valeurs = np.asarray(wrapper.predict_one(lot[0][0]).values, dtype=float)[None, :]
+        else:
+            valeurs = np.asarray(wrapper.predict(pd.DataFrame([l for l, _, _ in lot], columns=self.colonnes)),
+                                 dtype=float)
+        if self.cache is not None:
+            self.cache.ecrire(self.sexe, version.version,
+                              [(cle, v) for (_, cle, _), v in zip(lot, valeurs) if cle is not None])
+        noms = wrapper.target_names
+        return [dict(zip(noms, ligne.tolist())) for ligne in valeurs]
+
+    def etat(self):
+        return {"file": self.file.qsize(), "lots": self.lots, "lignes": self.lignes,
+                "taille_moyenne_lot": self.lignes / self.lots if self.lots else None,
+                "taille_max_lot": self.taille_max_vue}
+
+
+class Service:
+    def __init__(self, attente_max_s=0.005, lot_max=256, file_max=10_000, registry=None, cache=True, threads=None):
+        """
+        Args:
+            threads (int): Threads BLAS/OpenMP par thread de prédiction. Les
+                limites OpenMP ne valent que pour le thread qui les pose :
+                elles sont posées à la création de chaque thread du pool.
+        """
+        self.registry = registry or get_registry()
+        self.cache = get_cache() if cache else None
+        # SQLite peut attendre le verrou d'écriture d'un autre processus : jamais sur la boucle,
+        # ni derrière les prédictions du pool par défaut
+        self.executeur_cache = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cache") if cache else None
+        self.executeur = ThreadPoolExecutor(thread_name_prefix="prediction",
+                                            initializer=None if threads is None else threadpool_limits,
+                                            initargs=() if threads is None else (threads,))
+        self.regroupeurs = {sexe: Regroupeur(self.registry, sexe, attente_max_s, lot_max, file_max, self.cache,
+                                             self.executeur_cache, self.executeur)
+                            for sexe in SCHEMAS}
+        self.debut = time.time()
+
+    async def traiter(self, methode, chemin, corps):
+        """(statut, objet JSON) d'une requête."""
+        if methode == "GET" and chemin == "/health":
+            cache = None
+            if self.cache is not None:
+                cache = await asyncio.get_running_loop().run_in_executor(self.executeur_cache, self.cache.stats)
+            return HTTPStatus.OK, {"statut": "ok", "uptime_s": round(time.time() - self.debut, 1),
+                                   "modeles": self.registry.status(),
+                                   "files": {s: r.etat() for s, r in self.regroupeurs.items()},
+                                   "cache": cache}
+        if methode == "GET" and chemin == "/ready":
+            prets = {sexe: self.registry.is_ready(sexe) for sexe in self.regroupeurs}
+            statut = HTTPStatus.OK if all(prets.values()) else HTTPStatus.SERVICE_UNAVAILABLE
+            return statut, {"pret": all(prets.values()), "modeles": prets}
+        if chemin.startswith("/predict/"):
+            if methode != "POST":
+                raise RequeteInvalide(HTTPStatus.METHOD_NOT_ALLOWED, "utiliser POST")
+            sexe = chemin.removeprefix("/predict/")
+            if sexe not in self.regroupeurs:
+                raise RequeteInvalide(HTTPStatus.NOT_FOUND, f"sexe inconnu : {sexe!r}")
+            try:
+                donnees = json.loads(corps or b"null")
+            except ValueError:
+                raise RequeteInvalide(HTTPStatus.BAD_REQUEST, "corps JSON invalide") from None
+            regroupeur = self.regroupeurs[sexe]
+            if isinstance(donnees, list):
+                resultats = await asyncio.gather(*(regroupeur.predire(ligne) for ligne in donnees))
+                return HTTPStatus.OK, {"predictions": [p for p, _ in resultats],
+                                       "versions": sorted({v for _, v in resultats})}
+            predictions, version = await regroupeur.predire(donnees)
+            return HTTPStatus.OK, {"predictions": predictions, "version": version}
+        raise RequeteInvalide(HTTPStatus.NOT_FOUND, f"chemin inconnu : {chemin}")
+
+    async def connexion(self, reader, writer):
+        try:
+            while True:
+                try:
+                    entete = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lignes = entete.decode("latin-1").split("\r\n")
+                try:
+                    methode, chemin, _ = lignes[0].split(" ", 2)
+                except ValueError:
+                    break
+                entetes = {}
+                for ligne in lignes[1:]:
+                    if ":" in ligne:
+                        nom, valeur = ligne.split(":", 1)
+                        entetes[nom.strip().lower()] = valeur.strip()
+                longueur = int(entetes.get("content-length", 0) or 0)
+                if longueur > TAILLE_MAX_CORPS:
+                    await self._repondre(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"erreur": "corps trop grand"},
+                                         fermer=True)
+                    break
+                corps = await reader.readexactly(longueur) if longueur else b""
+                try:
+                    statut, reponse = await self.traiter(methode, chemin.split("?", 1)[0], corps)
+                except RequeteInvalide as e:
+                    statut, reponse = e.statut, {"erreur": str(e)}
+                except Exception as e:
+                    statut, reponse = HTTPStatus.INTERNAL_SERVER_ERROR, {"erreur": f"{type(e).__name__}: {e}"}
+                fermer = entetes.get("connection", "").lower() == "close"
+                await self._repondre(writer, statut, reponse, fermer)
+                if fermer:
+                    break
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _repondre(writer, statut, objet, fermer=False):
+        corps = json.dumps(objet, ensure_ascii=False).encode()
+        writer.write(
+            f"HTTP/1.1 {statut.value} {statut.phrase}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(corps)}\r\n"
+            f"Connection: {'close' if fermer else 'keep-alive'}\r\n\r\n".encode() + corps
+        )
+        await writer.drain()
+
+    async def servir(self, hote=None, port=None, sock=None):
+        """Sert sur (hote, port), ou sur une socket déjà ouverte (workers de prefork.py)."""
+        # Références gardées : une tâche sans référence peut être collectée
+        self._taches = [asyncio.create_task(r.boucle()) for r in self.regroupeurs.values()]
+        if sock is not None:
+            serveur = await asyncio.start_server(self.connexion, sock=sock)
+        else:
+            serveur = await asyncio.start_server(self.connexion, hote, port)
+        adresse = "{}:{}".format(*serveur.sockets[0].getsockname()[:2])
+        print(f"✔ Service sur http://{adresse} (modèles : {self.registry.status()})")
+        async with serveur:
+            await serveur.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Service HTTP de prédiction avec micro-lots")
+    parser.add_argument("--hote", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--attente-max-ms", type=float, default=5.0,
+                        help="Attente maximale d'une requête avant le départ de son lot")
+    parser.add_argument("--lot-max", type=int, default=256, help="Lignes maximales par lot")
+    parser.add_argument("--file-max", type=int, default=10_000, help="Requêtes en attente par sexe avant 503")
+    parser.add_argument("--sans-cache", action="store_true", help="Désactive le cache persistant des prédictions")
+    parser.add_argument("--threads", type=int, help="Threads BLAS/OpenMP par thread de prédiction")
+    args = parser.parse_args()
+    service = Service(args.attente_max_ms / 1000, args.lot_max, args.file_max, cache=not args.sans_cache,
+                      threads=args.threads)
+    asyncio.run(service.servir(args.hote, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# =======================
+# Tailles de soutien-gorge : bonnet et tour de dos, en tableaux
+# =======================
+# Version vectorisée de calculer_bonnet / bonnet_scale / arrondir_taille
+# (Predict_caesar_female, caesar_female) :
+#   - bonnet : écart tour de poitrine - tour de sous-poitrine (cm), découpé
+#     par pas de 2 cm à partir de 13 (AA < 13, A < 15, ..., J < 33, K) ;
+#   - bonnet_rang : AA = 0 ... K = 11 ;
+#   - taille_soutien_gorge : taille_de_poitrine arrondie aux 5 cm.
+# Les bornes sont des tableaux triés parcourus par np.searchsorted.
+#
+# Le sens inverse (rang de bonnet -> intervalle d'écart, taille -> intervalle
+# de taille_de_poitrine) sert à générer des mesures plausibles pour une
+# taille donnée.
+import numpy as np
+import pandas as pd
+
+LETTRES = np.array(["AA", "A", "B", "C", "D", "E", "F", "G", "H", "I", "J", "K"], dtype=object)
+# Écart minimal de chaque bonnet à partir de A : A >= 13, B >= 15, ..., K >= 33
+SEUILS_ECART = np.arange(13.0, 35.0, 2.0)
+# Bornes retenues pour les deux classes ouvertes (AA, K) dans le sens inverse
+ECART_MIN, ECART_MAX = 11.0, 35.0
+PAS_TAILLE = 5
+# Tailles UK du fichier synthétique (DD = E européen, E = F, F = G)
+RANGS_UK = {"AA": 0, "A": 1, "B": 2, "C": 3, "D": 4, "DD": 5, "E": 6, "F": 7}
+
+
+def rang_bonnet(ecart):
+    """Rang du bonnet (float, NaN si l'écart manque)."""
+    ecart = np.asarray(ecart, dtype=float)
+    return np.where(np.isnan(ecart), np.nan, np.searchsorted(SEUILS_ECART, ecart, side="right"))
+
+
+def lettre_bonnet(ecart):
+    """Lettre du bonnet (None si l'écart manque)."""
+    rang = rang_bonnet(ecart)
+    lettres = np.take(LETTRES, np.nan_to_num(rang, nan=0).astype(np.intp))
+    lettres[np.isnan(rang)] = None
+    return lettres
+
+
+def rang_depuis_lettre(lettres, echelle=None):
+    """Rang d'un tableau de lettres (NaN si inconnue). `echelle` : ex. RANGS_UK."""
+    if echelle is not None:
+        return pd.Series(lettres, dtype=object).map(echelle).to_numpy(dtype=float)
+    codes = pd.Categorical(lettres, categories=LETTRES).codes.astype(float)
+    codes[codes < 0] = np.nan
+    return codes
+
+
+def arrondir_taille(valeur, pas=PAS_TAILLE):
+    """Taille arrondie au multiple de `pas` le plus proche (arrondi bancaire, comme round)."""
+    return pas * np.round(np.asarray(valeur, dtype=float) / pas)
+
+
+def deriver(df):
+    """Ajoute bonnet, bonnet_lettre, bonnet_rang et taille_soutien_gorge à partir des mesures CAESAR."""
+    df = df.copy()
+    df["bonnet"] = df["tour_de_poitrine"] - df["tour_de_sous_poitrine"]
+    df["bonnet_lettre"] = lettre_bonnet(df["bonnet"])
+    df["bonnet_rang"] = rang_bonnet(df["bonnet"])
+    df["taille_soutien_gorge"] = arrondir_taille(df["taille_de_poitrine"])
+    return df
+
+
+# =======================
+# Sens inverse
+# =======================
+def intervalle_ecart(rang):
+    """(min, max) de l'écart poitrine - sous-poitrine compatible avec un rang de bonnet.
+
+    L'intervalle est semi-ouvert [min, max) ; NaN pour un rang hors échelle.
+    """
+    rang = np.asarray(rang, dtype=float)
+    valide = (rang >= 0) & (rang < len(LETTRES))
+    bornes = np.concatenate([[ECART_MIN], SEUILS_ECART, [ECART_MAX]])
+    i = np.where(valide, rang, 0).astype(np.intp)
+    return np.where(valide, bornes[i], np.nan), np.where(valide, bornes[i + 1], np.nan)
+
+
+def intervalle_taille(taille_soutien_gorge, pas=PAS_TAILLE):
+    """(min, max) de taille_de_poitrine qui s'arrondit à cette taille."""
+    taille = np.asarray(taille_soutien_gorge, dtype=float)
+    return taille - pas / 2, taille + pas / 2
+
+
+def echantillonner(taille_soutien_gorge, rang, rng=None):
+    """Tire taille_de_poitrine et l'écart de bonnet uniformément dans leurs intervalles.
+
+    Returns:
+        tuple: (taille_de_poitrine, ecart) en tableaux.
+    """
+    rng = rng or np.random.default_rng()
+    bas_t, haut_t = intervalle_taille(taille_soutien_gorge)
+    bas_e, haut_e = intervalle_ecart(rang)
+    return rng.uniform(bas_t, haut_t), rng.uniform(bas_e, haut_e)
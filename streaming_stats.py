@@ -0,0 +1,392 @@
+# =======================
+# Statistiques en une passe pour l'imputation et la mise à l'échelle
+# =======================
+# SimpleImputer(strategy="median"), RobustScaler et remplacer_nan_par_moyenne
+# demandent le jeu de données entier en mémoire. Ici les données sont lues
+# par lots (store Arrow, fichier Arrow de harmonisation.combiner, CSV en
+# chunks) et chaque colonne garde des statistiques cumulables :
+#   - effectif, valeurs manquantes, moyenne et variance exactes (fusion de
+#     Chan), minimum et maximum ;
+#   - une esquisse de quantiles (compacteurs à la KLL) pour les médianes et
+#     les écarts interquartiles : mémoire O(k log n), erreur de rang O(1/k) ;
+#   - les effectifs par modalité des colonnes catégorielles.
+#
+# preprocess() renvoie le ColumnTransformer de train_tpot.creer_preprocess
+# appris à partir de ces statistiques : mêmes classes sklearn, mêmes
+# attributs (statistics_, center_, scale_, categories_...), utilisable tel
+# quel dans un Pipeline ou comme préprocesseur de train_tpot.
+#
+# Usage :
+#   python streaming_stats.py --store caesar_all_fr --sexe femme --deriver --sortie preprocess_femme.pkl --verifier
+#   python streaming_stats.py --arrow data/store/combinee.arrow --sexe homme --sortie preprocess_homme.pkl
+#   python streaming_stats.py --csv data/synthetique_10M.csv --sexe homme --taille-lot 500000
+import argparse
+import json
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import MinMaxScaler, OneHotEncoder, RobustScaler, StandardScaler
+
+from schemas import SCHEMAS, colonnes_entree
+
+
+class EsquisseQuantiles:
+    """Esquisse de quantiles fusionnable (compacteurs par niveaux, à la KLL).
+
+    Le niveau h contient des valeurs de poids 2**h. Quand un niveau dépasse
+    k valeurs, il est trié et une valeur sur deux (décalage aléatoire) monte
+    au niveau suivant.
+    """
+
+    def __init__(self, k=2048, seed=0):
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.niveaux = [np.empty(0)]
+
+    def ajouter(self, valeurs):
+        valeurs = np.asarray(valeurs, dtype=float)
+        self.niveaux[0] = np.concatenate([self.niveaux[0], valeurs[~np.isnan(valeurs)]])
+        self._compacter()
+
+    def fusionner(self, autre):
+        for h, valeurs in enumerate(autre.niveaux):
+            if h == len(self.niveaux):
+                self.niveaux.append(np.empty(0))
+            self.niveaux[h] = np.concatenate([self.niveaux[h], valeurs])
+        self._compacter()
+
+    def _compacter(self):
+        h = 0
+        while h < len(self.niveaux):
+            niveau = self.niveaux[h]
+            if len(niveau) > self.k:
+                niveau = np.sort(niveau)
+                # Un nombre impair de valeurs : la dernière reste à ce niveau
+                reste = niveau[-1:] if len(niveau) % 2 else niveau[:0]
+                paires = niveau[:len(niveau) - len(reste)]
+                if h + 1 == len(self.niveaux):
+                    self.niveaux.append(np.empty(0))
+                self.niveaux[h + 1] = np.concatenate([self.niveaux[h + 1], paires[self.rng.integers(2)::2]])
+                self.niveaux[h] = reste
+            h += 1
+
+    @property
+    def poids_total(self):
+        return sum(len(niveau) * 2 ** h for h, niveau in enumerate(self.niveaux))
+
+    def quantiles(self, q, supplement=None):
+        """Quantiles approchés ; `supplement` = (valeur, poids) ajoute un point pondéré.
+
+        Le supplément sert à reproduire les quantiles d'une colonne dont les
+        valeurs manquantes ont été imputées par une constante.
+        """
+        valeurs = np.concatenate(self.niveaux)
+        poids = np.concatenate([np.full(len(niveau), 2.0 ** h) for h, niveau in enumerate(self.niveaux)])
+        if supplement is not None and supplement[1] > 0:
+            valeurs = np.append(valeurs, supplement[0])
+            poids = np.append(poids, supplement[1])
+        if len(valeurs) == 0:
+            return np.full(np.shape(q), np.nan)
+        ordre = np.argsort(valeurs, kind="stable")
+        cumul = np.cumsum(poids[ordre])
+        rangs = np.asarray(q, dtype=float) * cumul[-1]
+        return valeurs[ordre][np.minimum(np.searchsorted(cumul, rangs, side="left"), len(cumul) - 1)]
+
+
+class StatistiquesFlux:
+    """Statistiques cumulées, lot par lot, des colonnes numériques et catégorielles."""
+
+    def __init__(self, colonnes_num, colonnes_cat=(), k=2048, seed=0):
+        self.colonnes_num = list(colonnes_num)
+        self.colonnes_cat = list(colonnes_cat)
+        p = len(self.colonnes_num)
+        self.n = np.zeros(p)
+        self.manquants = np.zeros(p)
+        self.moyenne = np.zeros(p)
+        self.m2 = np.zeros(p)
+        self.minimum = np.full(p, np.inf)
+        self.maximum = np.full(p, -np.inf)
+        self.esquisses = [EsquisseQuantiles(k, seed + j) for j in range(p)]
+        self.modalites = {c: pd.Series(dtype=float) for c in self.colonnes_cat}
+        self.lignes = 0
+
+    def mettre_a_jour(self, df):
+        """Ajoute un lot (DataFrame contenant au moins les colonnes suivies)."""
+        if len(df) == 0:
+            return self
+        X = np.column_stack([pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=float)
+                             for c in self.colonnes_num]) if self.colonnes_num else np.empty((len(df), 0))
+        presents = ~np.isnan(X)
+        n_lot = presents.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            moyenne_lot = np.where(n_lot > 0, np.nansum(X, axis=0) / np.maximum(n_lot, 1), 0.0)
+            m2_lot = np.nansum((X - moyenne_lot) ** 2, axis=0)
+            self.minimum = np.fmin(self.minimum, np.where(presents, X, np.inf).min(axis=0))
+            self.maximum = np.fmax(self.maximum, np.where(presents, X, -np.inf).max(axis=0))
+        self._fusionner_moments(n_lot, moyenne_lot, m2_lot)
+        self.manquants += len(df) - n_lot
+        for j, esquisse in enumerate(self.esquisses):
+            esquisse.ajouter(X[presents[:, j], j])
+        for c in self.colonnes_cat:
+            effectifs = df[c].dropna().astype(str).value_counts()
+            self.modalites[c] = self.modalites[c].add(effectifs, fill_value=0)
+        self.lignes += len(df)
+        return self
+
+    def _fusionner_moments(self, n_b, moyenne_b, m2_b):
+        n = self.n + n_b
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = moyenne_b - self.moyenne
+            self.moyenne = np.where(n > 0, self.moyenne + delta * n_b / np.maximum(n, 1), 0.0)
+            self.m2 = self.m2 + m2_b + np.where(n > 0, delta ** 2 * self.n * n_b / np.maximum(n, 1), 0.0)
+        self.n = n
+
+    def fusionner(self, autre):
+        """Cumule les statistiques d'un autre objet (mêmes colonnes), ex. calculées dans un autre processus."""
+        self._fusionner_moments(autre.n, autre.moyenne, autre.m2)
+        self.manquants += autre.manquants
+        self.minimum = np.fmin(self.minimum, autre.minimum)
+        self.maximum = np.fmax(self.maximum, autre.maximum)
+        for esquisse, autre_esquisse in zip(self.esquisses, autre.esquisses):
+            esquisse.fusionner(autre_esquisse)
+        for c in self.colonnes_cat:
+            self.modalites[c] = self.modalites[c].add(autre.modalites[c], fill_value=0)
+        self.lignes += autre.lignes
+        return self
+
+    # ---- Statistiques par colonne ----
+    def _indice(self, colonne):
+        return self.colonnes_num.index(colonne)
+
+    def moyennes(self):
+        """{colonne: moyenne} (NaN si aucune valeur), comme df[col].mean(skipna=True)."""
+        return dict(zip(self.colonnes_num, np.where(self.n > 0, self.moyenne, np.nan)))
+
+    def variances(self):
+        """{colonne: variance de population} (ddof=0, comme StandardScaler)."""
+        return dict(zip(self.colonnes_num, np.where(self.n > 0, self.m2 / np.maximum(self.n, 1), np.nan)))
+
+    def quantile(self, colonne, q, imputation=None):
+        """Quantile(s) d'une colonne ; avec `imputation`, les manquants comptent comme cette valeur."""
+        j = self._indice(colonne)
+        supplement = None if imputation is None else (imputation, self.manquants[j])
+        return self.esquisses[j].quantiles(q, supplement)
+
+    def medianes(self):
+        return {c: float(self.quantile(c, 0.5)) for c in self.colonnes_num}
+
+    def plus_frequentes(self):
+        """{colonne: modalité la plus fréquente} ; à égalité, la plus petite (comme SimpleImputer)."""
+        return {c: min(effectifs.index[effectifs == effectifs.max()]) if len(effectifs) else None
+                for c, effectifs in self.modalites.items()}
+
+    def resume(self):
+        medianes = self.medianes()
+        return {
+            "lignes": self.lignes,
+            "numeriques": {
+                c: {"n": int(self.n[j]), "manquants": int(self.manquants[j]), "moyenne": float(self.moyenne[j]),
+                    "ecart_type": float(np.sqrt(self.m2[j] / max(self.n[j], 1))),
+                    "min": float(self.minimum[j]), "max": float(self.maximum[j]), "mediane": medianes[c]}
+                for j, c in enumerate(self.colonnes_num)
+            },
+            "categorielles": {c: {str(k): int(v) for k, v in effectifs.sort_index().items()}
+                              for c, effectifs in self.modalites.items()},
+        }
+
+    # ---- Estimateurs sklearn appris ----
+    def _ajuster_pipeline(self, pipeline, colonnes):
+        """Renseigne les attributs appris des étapes d'un Pipeline imputer -> scaler/encodeur."""
+        imputation = {}
+        for _, etape in pipeline.steps:
+            if isinstance(etape, SimpleImputer):
+                if etape.strategy == "median":
+                    imputation = self.medianes()
+                elif etape.strategy == "mean":
+                    imputation = self.moyennes()
+                elif etape.strategy == "most_frequent":
+                    imputation = self.plus_frequentes()
+                else:
+                    raise ValueError(f"Stratégie d'imputation non gérée en flux : {etape.strategy!r}")
+                etape.statistics_ = np.array([imputation[c] for c in colonnes],
+                                             dtype=object if colonnes[0] in self.colonnes_cat else float)
+            elif isinstance(etape, RobustScaler):
+                bas, haut = (q / 100 for q in etape.quantile_range)
+                valeurs = np.array([self.quantile(c, [bas, 0.5, haut], imputation.get(c)) for c in colonnes])
+                if etape.with_centering:
+                    etape.center_ = valeurs[:, 1]
+                if etape.with_scaling:
+                    ecart = valeurs[:, 2] - valeurs[:, 0]
+                    etape.scale_ = np.where(ecart == 0, 1.0, ecart)
+            elif isinstance(etape, MinMaxScaler):
+                j = [self._indice(c) for c in colonnes]
+                # L'imputation par une valeur intérieure ne change ni le min ni le max
+                mini, maxi = self.minimum[j], self.maximum[j]
+                etendue = maxi - mini
+                etape.data_min_, etape.data_max_, etape.data_range_ = mini, maxi, etendue
+                etape.scale_ = (etape.feature_range[1] - etape.feature_range[0]) / np.where(etendue == 0, 1.0, etendue)
+                etape.min_ = etape.feature_range[0] - mini * etape.scale_
+            elif isinstance(etape, StandardScaler):
+                j = [self._indice(c) for c in colonnes]
+                moyennes = np.array([self.moyenne[i] for i in j])
+                variances = np.array([self.m2[i] / max(self.n[i], 1) for i in j])
+                manquants = self.manquants[j]
+                # Les manquants imputés par m déplacent la moyenne et la variance
+                if imputation:
+                    m = np.array([imputation[c] for c in colonnes])
+                    total = self.n[j] + manquants
+                    delta = m - moyennes
+                    nouvelles = moyennes + delta * manquants / total
+                    variances = (self.m2[j] + delta ** 2 * self.n[j] * manquants / total) / total
+                    moyennes = nouvelles
+                etape.mean_ = moyennes if etape.with_mean else None
+                etape.var_ = variances if etape.with_std else None
+                etape.scale_ = np.where(variances == 0, 1.0, np.sqrt(variances)) if etape.with_std else None
+                etape.n_samples_seen_ = int(self.lignes)
+            elif not isinstance(etape, OneHotEncoder):
+                raise TypeError(f"Étape non gérée en flux : {type(etape).__name__}")
+
+    def _resume_ajustement(self, colonnes):
+        """Petit DataFrame qui contient tous les min/max et toutes les modalités vues.
+
+        Ajuster un estimateur dessus fixe sa structure (colonnes, catégories
+        de l'encodeur) ; les statistiques sont ensuite remplacées.
+        """
+        lignes = max([2] + [len(self.modalites[c]) for c in colonnes if c in self.modalites])
+        donnees = {}
+        for c in colonnes:
+            if c in self.modalites:
+                modalites = sorted(self.modalites[c].index)
+                donnees[c] = [modalites[i % len(modalites)] for i in range(lignes)] if modalites else [None] * lignes
+            else:
+                j = self._indice(c)
+                bornes = [self.minimum[j], self.maximum[j]] if self.n[j] else [np.nan, np.nan]
+                donnees[c] = [bornes[i % 2] for i in range(lignes)]
+        return pd.DataFrame(donnees)
+
+    def preprocess(self, sexe):
+        """ColumnTransformer de train_tpot.creer_preprocess(sexe), appris sur les statistiques du flux."""
+        from train_tpot import creer_preprocess
+
+        preprocess = creer_preprocess(sexe)
+        colonnes = colonnes_entree(sexe)
+        preprocess.fit(self._resume_ajustement(colonnes)[colonnes])
+        for _, transformer, colonnes_bloc in preprocess.transformers_:
+            if isinstance(transformer, Pipeline):
+                self._ajuster_pipeline(transformer, list(colonnes_bloc))
+        return preprocess
+
+
+# =======================
+# Lecture par lots
+# =======================
+def lots_store(nom, colonnes=None, taille_lot=100_000):
+    """Lots d'une source de dataset_store (mmap, sans lire le fichier entier)."""
+    from dataset_store import charger_table
+
+    for lot in charger_table(nom, colonnes).to_batches(max_chunksize=taille_lot):
+        yield lot.to_pandas()
+
+
+def lots_arrow(chemin, colonnes=None, taille_lot=None):
+    """Lots d'un fichier Arrow IPC (ex. sortie de harmonisation.combiner)."""
+    with pa.memory_map(chemin, "r") as source:
+        lecteur = pa.ipc.open_file(source)
+        for i in range(lecteur.num_record_batches):
+            lot = lecteur.get_batch(i)
+            if colonnes is not None:
+                lot = lot.select([c for c in colonnes if c in lot.schema.names])
+            if taille_lot is None:
+                yield lot.to_pandas()
+            else:
+                for morceau in pa.Table.from_batches([lot]).to_batches(max_chunksize=taille_lot):
+                    yield morceau.to_pandas()
+
+
+def lots_csv(chemin, colonnes=None, taille_lot=100_000, sep=";"):
+    """Lots d'un CSV lu en chunks (séparateur ";" comme les fichiers de data/)."""
+    yield from pd.read_csv(chemin, sep=sep, usecols=colonnes, chunksize=taille_lot, encoding="utf-8-sig")
+
+
+def entrees_formulaire(lots, sexe):
+    """Filtre le sexe et dérive les entrées du formulaire de chaque lot, comme distill.donnees_reelles."""
+    from morphologie import CODES_SEXE, classer
+    from soutien_gorge import deriver
+
+    for df in lots:
+        if "sex" in df:
+            df = df[df["sex"] == CODES_SEXE[sexe]]
+        categories = classer(df, sexe)
+        df = df.assign(**{c: categories[c].to_numpy() for c in categories.columns})
+        if sexe == "femme":
+            df = deriver(df)
+        yield df
+
+
+def statistiques(lots, sexe, k=2048, seed=0):
+    """Parcourt les lots une fois et renvoie les StatistiquesFlux des entrées du sexe."""
+    schema = SCHEMAS[sexe]
+    stats = StatistiquesFlux(schema["colonnes_num"], schema["colonnes_cat"], k=k, seed=seed)
+    for df in lots:
+        stats.mettre_a_jour(df)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Préprocesseur appris en une passe, par lots")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--store", help="Source de dataset_store (ex. caesar_all_fr)")
+    source.add_argument("--arrow", help="Fichier Arrow IPC")
+    source.add_argument("--csv", help="Fichier CSV (séparateur ;)")
+    parser.add_argument("--sexe", choices=["homme", "femme"], required=True)
+    parser.add_argument("--deriver", action="store_true",
+                        help="Filtre le sexe et calcule catégories et tailles de soutien-gorge à la volée")
+    parser.add_argument("--taille-lot", type=int, default=100_000)
+    parser.add_argument("--k", type=int, default=2048, help="Taille des compacteurs de l'esquisse de quantiles")
+    parser.add_argument("--sortie", help="Fichier .pkl du ColumnTransformer appris")
+    parser.add_argument("--verifier", action="store_true",
+                        help="Compare au préprocesseur appris en mémoire (données qui tiennent en RAM)")
+    args = parser.parse_args()
+
+    def lots():
+        if args.store:
+            flux = lots_store(args.store, taille_lot=args.taille_lot)
+        elif args.arrow:
+            flux = lots_arrow(args.arrow, taille_lot=args.taille_lot)
+        else:
+            flux = lots_csv(args.csv, taille_lot=args.taille_lot)
+        return entrees_formulaire(flux, args.sexe) if args.deriver else flux
+
+    debut = time.perf_counter()
+    stats = statistiques(lots(), args.sexe, k=args.k)
+    preprocess = stats.preprocess(args.sexe)
+    print(f"✔ {stats.lignes} lignes en {time.perf_counter() - debut:.1f} s")
+    print(json.dumps(stats.resume()["numeriques"], indent=2, ensure_ascii=False))
+
+    if args.sortie:
+        joblib.dump(preprocess, args.sortie + ".tmp")
+        os.replace(args.sortie + ".tmp", args.sortie)
+        print(f"✔ Préprocesseur écrit dans {args.sortie}")
+
+    if args.verifier:
+        from train_tpot import creer_preprocess
+
+        colonnes = colonnes_entree(args.sexe)
+        df = pd.concat(list(lots()), ignore_index=True)[colonnes]
+        reference = creer_preprocess(args.sexe).fit(df)
+
+        def dense(X):
+            return np.asarray(X.toarray() if hasattr(X, "toarray") else X, dtype=float)
+
+        ecart = np.abs(dense(preprocess.transform(df)) - dense(reference.transform(df)))
+        print(f"  Écart au préprocesseur en mémoire : max {ecart.max():.4g}, moyen {ecart.mean():.4g}")
+
+
+if __name__ == "__main__":
+    main()
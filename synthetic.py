@@ -0,0 +1,234 @@
+# =======================
+# Générateur de corps synthétiques (copule gaussienne) par sexe
+# =======================
+# Remplace les fichiers fixes data/male_body_syn.csv et data/women body syn.csv
+# (20 000 lignes) par un modèle appris sur les mesures réelles :
+#   - lignes CAESAR du sexe et ANSUR II, harmonisées (harmonisation.vue :
+#     caesar_<sexe>, ansur_ii_<sexe>) sous les noms canoniques, en cm et kg ;
+#   - chaque mesure garde sa loi marginale empirique (grille de quantiles) ;
+#   - la dépendance entre mesures est une copule gaussienne : corrélation
+#     des scores normaux, calculée paire par paire sur les lignes où les
+#     deux mesures existent (ANSUR ne couvre qu'une partie des colonnes).
+#
+# L'échantillonnage est vectorisé (tirage normal multivarié puis
+# interpolation dans les grilles de quantiles) et se fait par lots : le lot
+# i utilise la graine (seed, i), donc un lot se régénère seul, sans tirer
+# les précédents (à taille de lot égale). Les lots sont écrits au fil de
+# l'eau dans data/store/synthetique_<sexe>.arrow, source déclarée du store
+# (dataset_store.charger("synthetique_femme")) et lisible par lots avec
+# streaming_stats.lots_arrow ; --entrees y ajoute les entrées du formulaire
+# (catégories, taille de soutien-gorge, bonnet). Un lot en erreur ne laisse
+# ni fichier .tmp ni fichier de sortie partiel.
+#
+# Usage :
+#   python synthetic.py ajuster --sexe femme
+#   python synthetic.py generer --sexe femme --lignes 10000000 --seed 1 --entrees
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from scipy.special import ndtr, ndtri
+
+from dataset_store import RACINE, chemin_store
+from harmonisation import vue
+from morphologie import CODES_SEXE, classer
+from soutien_gorge import deriver
+
+SOURCES = {
+    "homme": {"caesar": "caesar_homme", "ansur": "ansur_ii_homme"},
+    "femme": {"caesar": "caesar_femme", "ansur": "ansur_ii_femme"},
+}
+N_QUANTILES = 1001
+# Nombre minimal de lignes communes pour estimer la corrélation d'une paire
+MIN_PAIRES = 30
+
+
+def chemin_modele(sexe):
+    return os.path.join(RACINE, f"synthetique_{sexe}.json")
+
+
+def chemin_sortie(sexe):
+    """Fichier de la source synthetique_<sexe> du store (dataset_store.SOURCES)."""
+    return chemin_store(f"synthetique_{sexe}")
+
+
+def mesures_reelles(sexe, avec_ansur=True):
+    """Lignes réelles du sexe sous les colonnes canoniques de CAESAR (mesures absentes -> NaN)."""
+    source = SOURCES[sexe]
+    caesar = vue(source["caesar"])
+    # Le sexe est fixé par la source : constant, il n'entre pas dans la copule
+    colonnes = [c for c in caesar.colonnes if c != "sex"]
+    morceaux = [caesar.to_pandas(colonnes)]
+    if avec_ansur:
+        ansur = vue(source["ansur"])
+        morceaux.append(ansur.to_pandas([c for c in colonnes if c in ansur.correspondances]))
+    return pd.concat(morceaux, ignore_index=True).astype(float)
+
+
+def _psd(correlation, plancher=1e-6):
+    """Matrice de corrélation définie positive la plus proche (valeurs propres tronquées)."""
+    valeurs, vecteurs = np.linalg.eigh(correlation)
+    matrice = (vecteurs * np.maximum(valeurs, plancher)) @ vecteurs.T
+    d = np.sqrt(np.diag(matrice))
+    return matrice / np.outer(d, d)
+
+
+class CopuleGaussienne:
+    """Marges empiriques + copule gaussienne, sérialisable en JSON."""
+
+    def __init__(self, colonnes, probabilites, marges, correlation, meta=None):
+        self.colonnes = list(colonnes)
+        self.probabilites = np.asarray(probabilites, dtype=float)
+        self.marges = np.asarray(marges, dtype=float)  # (colonnes, quantiles)
+        self.correlation = np.asarray(correlation, dtype=float)
+        self.cholesky = np.linalg.cholesky(self.correlation)
+        self.meta = meta or {}
+
+    @classmethod
+    def ajuster(cls, df, n_quantiles=N_QUANTILES, meta=None):
+        """Apprend le modèle sur un DataFrame de mesures (NaN autorisés)."""
+        df = df.loc[:, df.notna().sum() >= MIN_PAIRES]
+        probabilites = np.linspace(0.0, 1.0, n_quantiles)
+        marges = np.nanquantile(df.to_numpy(dtype=float), probabilites, axis=0).T
+        # Scores normaux : rang moyen ramené dans ]0, 1[, puis quantile normal
+        rangs = df.rank(method="average")
+        scores = ndtri((rangs - 0.5) / df.notna().sum())
+        correlation = scores.corr(min_periods=MIN_PAIRES).fillna(0.0).to_numpy()
+        np.fill_diagonal(correlation, 1.0)
+        meta = {**(meta or {}), "lignes": int(len(df))}
+        return cls(df.columns, probabilites, marges, _psd(correlation), meta)
+
+    def echantillonner(self, n, rng):
+        """DataFrame de n corps tirés du modèle."""
+        z = rng.standard_normal((n, len(self.colonnes))) @ self.cholesky.T
+        u = ndtr(z)
+        return pd.DataFrame({
+            colonne: np.interp(u[:, j], self.probabilites, self.marges[j])
+            for j, colonne in enumerate(self.colonnes)
+        })
+
+    def to_dict(self):
+        return {
+            **self.meta,
+            "colonnes": self.colonnes,
+            "probabilites": self.probabilites.round(6).tolist(),
+            "marges": self.marges.round(4).tolist(),
+            "correlation": self.correlation.round(6).tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        meta = {k: v for k, v in d.items() if k not in ("colonnes", "probabilites", "marges", "correlation")}
+        return cls(d["colonnes"], d["probabilites"], d["marges"], _psd(np.asarray(d["correlation"])), meta)
+
+
+def ajuster(sexe, avec_ansur=True):
+    df = mesures_reelles(sexe, avec_ansur)
+    sources = [SOURCES[sexe]["caesar"]] + ([SOURCES[sexe]["ansur"]] if avec_ansur else [])
+    return CopuleGaussienne.ajuster(df, meta={"sexe": sexe, "sources": sources})
+
+
+def enregistrer(modele, chemin):
+    with open(chemin + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(modele.to_dict(), f, ensure_ascii=False)
+    os.replace(chemin + ".tmp", chemin)
+
+
+def charger_modele(chemin):
+    with open(chemin, encoding="utf-8") as f:
+        return CopuleGaussienne.from_dict(json.load(f))
+
+
+def entrees_formulaire(df, sexe):
+    """Ajoute age entier, sex et les entrées dérivées (catégories, soutien-gorge) à un lot."""
+    if "age" in df:
+        df["age"] = np.round(df["age"])
+    df["sex"] = float(CODES_SEXE[sexe])
+    categories = classer(df, sexe)
+    for colonne in categories.columns:
+        df[colonne] = categories[colonne].to_numpy()
+    if sexe == "femme":
+        df = deriver(df)
+    return df
+
+
+def lots(modele, lignes, taille_lot=500_000, seed=0, entrees=False):
+    """Itère sur les lots générés ; le lot i est tiré avec la graine (seed, i)."""
+    sexe = modele.meta.get("sexe")
+    for i, debut in enumerate(range(0, lignes, taille_lot)):
+        df = modele.echantillonner(min(taille_lot, lignes - debut), np.random.default_rng([seed, i]))
+        yield entrees_formulaire(df, sexe) if entrees else df
+
+
+def generer(modele, destination, lignes, taille_lot=500_000, seed=0, entrees=False):
+    """Écrit `lignes` corps dans un fichier Arrow IPC, lot par lot.
+
+    Returns:
+        int: nombre de lignes écrites.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+    tmp = destination + ".tmp"
+    ecrites = 0
+    writer = None
+    try:
+        with pa.OSFile(tmp, "wb") as sortie:
+            try:
+                for df in lots(modele, lignes, taille_lot, seed, entrees):
+                    if writer is None:
+                        # Le schéma du premier lot fixe les types (colonnes texte comprises)
+                        schema = pa.Schema.from_pandas(df, preserve_index=False).remove_metadata().with_metadata({
+                            "seed": str(seed), "sexe": str(modele.meta.get("sexe")),
+                            "sources": ",".join(modele.meta.get("sources", [])),
+                        })
+                        writer = pa.ipc.new_file(sortie, schema)
+                    writer.write_batch(pa.RecordBatch.from_pandas(df, schema=schema, preserve_index=False))
+                    ecrites += len(df)
+            finally:
+                if writer is not None:
+                    writer.close()
+        os.replace(tmp, destination)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return ecrites
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Corps synthétiques par copule gaussienne")
+    sous = parser.add_subparsers(dest="action", required=True)
+    p = sous.add_parser("ajuster", help="Apprend le modèle sur CAESAR et ANSUR II")
+    p.add_argument("--sexe", choices=["homme", "femme"], required=True)
+    p.add_argument("--sans-ansur", action="store_true", help="CAESAR seulement")
+    p.add_argument("--modele", help="Fichier JSON (défaut : synthetique_<sexe>.json)")
+    p = sous.add_parser("generer", help="Écrit des corps générés dans data/store/")
+    p.add_argument("--sexe", choices=["homme", "femme"], required=True)
+    p.add_argument("--modele", help="Fichier JSON (défaut : synthetique_<sexe>.json)")
+    p.add_argument("--lignes", type=int, default=1_000_000)
+    p.add_argument("--taille-lot", type=int, default=500_000)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--entrees", action="store_true", help="Ajoute les entrées du formulaire")
+    p.add_argument("--destination", help="Fichier .arrow (défaut : data/store/synthetique_<sexe>.arrow)")
+    args = parser.parse_args()
+    chemin = args.modele or chemin_modele(args.sexe)
+
+    debut = time.perf_counter()
+    if args.action == "ajuster":
+        modele = ajuster(args.sexe, avec_ansur=not args.sans_ansur)
+        enregistrer(modele, chemin)
+        print(f"✔ {len(modele.colonnes)} mesures, {modele.meta['lignes']} lignes réelles "
+              f"({', '.join(modele.meta['sources'])}) -> {chemin}")
+        return
+
+    destination = args.destination or chemin_sortie(args.sexe)
+    lignes = generer(charger_modele(chemin), destination, args.lignes, args.taille_lot, args.seed, args.entrees)
+    duree = time.perf_counter() - debut
+    print(f"✔ {lignes} corps écrits dans {destination} en {duree:.1f} s ({lignes / max(duree, 1e-9):,.0f} lignes/s)")
+
+
+if __name__ == "__main__":
+    main()
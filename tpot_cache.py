@@ -0,0 +1,279 @@
+# =======================
+# Cache des évaluations et points de reprise des recherches TPOT
+# =======================
+# TPOT 1.x sait déjà reprendre une recherche : avec
+# periodic_checkpoint_folder, la population (individus évalués + scores) est
+# écrite dans population.pkl à chaque génération et relue au démarrage.
+# Ce module organise ces dossiers et ajoute ce qui manque :
+#   - un dossier de reprise par (cible, empreinte des données) : relancer le
+#     même entraînement reprend à la dernière génération sans réévaluer ;
+#   - un cache SQLite des scores, indexé par (empreinte des données, cible,
+#     objectif, structure du pipeline), alimenté à chaque point de reprise écrit par
+#     TPOT (EnregistreurReprises) puis à la fin de la recherche ;
+#   - avant une reprise, les scores manquants de population.pkl sont
+#     complétés depuis le cache (completer_reprise) ;
+#   - l'amorçage d'une recherche à partir de la population d'une autre
+#     (cible voisine, autre sexe) : les individus sont repris, les scores
+#     sont effacés sauf ceux déjà connus du cache pour la nouvelle cible.
+#
+# TPOT 1.x évalue les individus dans son évolueur sans point d'extension
+# par évaluation : le cache est consulté aux frontières de génération
+# (reprise, amorçage), pas individu par individu pendant une génération.
+#
+# Les scores sont lus dans la colonne de l'objectif de la recherche :
+# tpot.objective_names[0] après fit, nom_objectif(scorer) avant (même
+# règle que TPOT). Deux scorers ne partagent donc ni scores ni reprises.
+import glob
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+
+import numpy as np
+from joblib import hash as joblib_hash
+from sklearn.metrics import get_scorer
+
+POPULATION = "population.pkl"
+# Objectif des caches écrits avant que l'objectif n'entre dans la clé
+OBJECTIF_V1 = "mean_squared_error"
+
+
+def nom_objectif(scorer):
+    """Colonne de score que TPOT 1.x donne à un scorer (ex. neg_mean_squared_error -> mean_squared_error)."""
+    f = get_scorer(scorer)
+    return f._score_func.__name__ if hasattr(f, "_score_func") else f.__name__
+
+
+def empreinte_donnees(X, y):
+    """Empreinte du couple (X, y) d'une recherche."""
+    return joblib_hash((np.ascontiguousarray(X), np.ascontiguousarray(y)))
+
+
+def dossier_reprise(racine, sexe, cible, empreinte):
+    return os.path.join(racine, sexe, f"{cible}-{empreinte[:12]}")
+
+
+def structure(pipeline):
+    """Clé d'un pipeline non appris : hachage de ses classes et paramètres."""
+    return joblib_hash(pipeline)
+
+
+def verifier_reprise(dossier):
+    """Valide population.pkl avant de le confier à TPOT.
+
+    TPOT réécrit ce fichier sur place ; s'il a été tronqué par un arrêt
+    brutal, on revient à la copie de la reprise précédente.
+
+    Returns:
+        bool: True si une population exploitable est présente.
+    """
+    chemin = os.path.join(dossier, POPULATION)
+    copie = chemin + ".prec"
+    if not os.path.exists(chemin):
+        return False
+    try:
+        with open(chemin, "rb") as f:
+            pickle.load(f)
+    except Exception:
+        if os.path.exists(copie):
+            print(f"⚠️ {chemin} illisible, retour à la reprise précédente")
+            shutil.copyfile(copie, chemin)
+            return True
+        print(f"⚠️ {chemin} illisible, la recherche repart de zéro")
+        os.remove(chemin)
+        return False
+    shutil.copyfile(chemin, copie + ".tmp")
+    os.replace(copie + ".tmp", copie)
+    return True
+
+
+def trouver_reprise(source, racine, sexe):
+    """Dossier de reprise désigné par un chemin ou par un nom de cible (le plus récent)."""
+    if os.path.isfile(os.path.join(source, POPULATION)):
+        return source
+    candidats = [d for d in glob.glob(os.path.join(racine, sexe, f"{source}-*"))
+                 if os.path.isfile(os.path.join(d, POPULATION))]
+    if not candidats:
+        raise FileNotFoundError(f"Aucune population pour {source!r} sous {os.path.join(racine, sexe)}")
+    return max(candidats, key=lambda d: os.path.getmtime(os.path.join(d, POPULATION)))
+
+
+class CacheEvaluations:
+    """Scores de validation croisée déjà calculés, dans une base SQLite."""
+
+    def __init__(self, chemin):
+        os.makedirs(os.path.dirname(os.path.abspath(chemin)), exist_ok=True)
+        self.connexion = sqlite3.connect(chemin, timeout=60)
+        self.connexion.execute("PRAGMA journal_mode=WAL")
+        with self.connexion:
+            colonnes = [c[1] for c in self.connexion.execute("PRAGMA table_info(evaluations)")]
+            if colonnes and "objectif" not in colonnes:
+                self.connexion.execute("ALTER TABLE evaluations RENAME TO evaluations_v1")
+            self.connexion.execute(
+                "CREATE TABLE IF NOT EXISTS evaluations ("
+                " empreinte TEXT, cible TEXT, objectif TEXT, structure TEXT, score REAL, pipeline TEXT,"
+                " PRIMARY KEY (empreinte, cible, objectif, structure))"
+            )
+            if colonnes and "objectif" not in colonnes:
+                # Les anciens scores ont tous été calculés avec neg_mean_squared_error
+                self.connexion.execute(
+                    "INSERT OR IGNORE INTO evaluations SELECT empreinte, cible, ?, structure, score, pipeline"
+                    " FROM evaluations_v1", (OBJECTIF_V1,))
+                self.connexion.execute("DROP TABLE evaluations_v1")
+
+    def enregistrer(self, empreinte, cible, objectif, evalues):
+        """Ajoute les individus évalués d'une recherche, scores lus dans la colonne `objectif`.
+
+        `evalues` : tpot.evaluated_individuals, ou celui d'un population.pkl
+        (sans colonne "Instance" : le pipeline est exporté de l'individu).
+        """
+        lignes = []
+        for _, individu in evalues.iterrows():
+            if not _score_valide(individu.get(objectif)):
+                continue
+            pipeline = individu["Instance"] if "Instance" in individu else individu["Individual"].export_pipeline()
+            lignes.append((empreinte, cible, objectif, structure(pipeline), float(individu[objectif]), str(pipeline)))
+        with self.connexion:
+            self.connexion.executemany("INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?, ?, ?, ?)", lignes)
+        return len(lignes)
+
+    def score(self, empreinte, cible, objectif, cle):
+        ligne = self.connexion.execute(
+            "SELECT score FROM evaluations WHERE empreinte = ? AND cible = ? AND objectif = ? AND structure = ?",
+            (empreinte, cible, objectif, cle),
+        ).fetchone()
+        return None if ligne is None else ligne[0]
+
+    def close(self):
+        self.connexion.close()
+
+
+def _score_valide(score):
+    return isinstance(score, (int, float)) and np.isfinite(score)
+
+
+def completer_scores(evalues, cache, empreinte, cible, objectif):
+    """Remplit depuis le cache les scores manquants de `evalues` (en place).
+
+    Raises:
+        ValueError: si `evalues` n'a pas de colonne `objectif` (population
+            d'une recherche faite avec un autre scorer).
+
+    Returns:
+        int: nombre de scores retrouvés.
+    """
+    if objectif not in evalues.columns:
+        raise ValueError(f"Population sans colonne {objectif!r} (objectifs : "
+                         f"{[c for c in evalues.columns if c not in ('Individual', 'Instance', 'Generation')]})")
+    retrouves = 0
+    for index, individu in evalues["Individual"].items():
+        if _score_valide(evalues.at[index, objectif]):
+            continue
+        score = cache.score(empreinte, cible, objectif, structure(individu.export_pipeline()))
+        if score is not None:
+            evalues.at[index, objectif] = score
+            retrouves += 1
+    return retrouves
+
+
+def _ecrire_population(population, dossier):
+    os.makedirs(dossier, exist_ok=True)
+    chemin = os.path.join(dossier, POPULATION)
+    with open(chemin + ".tmp", "wb") as f:
+        pickle.dump(population, f)
+    os.replace(chemin + ".tmp", chemin)
+
+
+def completer_reprise(dossier, cache, empreinte, cible, objectif):
+    """Complète depuis le cache les scores manquants d'une population avant sa reprise.
+
+    Returns:
+        int: nombre de scores retrouvés.
+    """
+    with open(os.path.join(dossier, POPULATION), "rb") as f:
+        population = pickle.load(f)
+    retrouves = completer_scores(population.evaluated_individuals, cache, empreinte, cible, objectif)
+    if retrouves:
+        _ecrire_population(population, dossier)
+    return retrouves
+
+
+class EnregistreurReprises(threading.Thread):
+    """Ajoute au cache les évaluations de chaque population.pkl écrit par TPOT.
+
+    Le thread a sa propre connexion SQLite ; un fichier en cours
+    d'écriture (illisible) est relu au tour suivant.
+    """
+
+    def __init__(self, dossier, chemin_cache, empreinte, cible, objectif, intervalle=10.0):
+        super().__init__(name=f"cache-{cible}", daemon=True)
+        self.dossier = dossier
+        self.chemin_cache = chemin_cache
+        self.empreinte = empreinte
+        self.cible = cible
+        self.objectif = objectif
+        self.intervalle = intervalle
+        self.enregistrees = 0
+        self._date_vue = None
+        self._deja = set()
+        self._stop = threading.Event()
+
+    def run(self):
+        cache = CacheEvaluations(self.chemin_cache)
+        try:
+            while not self._stop.wait(self.intervalle):
+                self._relever(cache)
+            self._relever(cache)
+        finally:
+            cache.close()
+
+    def _relever(self, cache):
+        chemin = os.path.join(self.dossier, POPULATION)
+        try:
+            date = os.stat(chemin).st_mtime_ns
+        except OSError:
+            return
+        if date == self._date_vue:
+            return
+        try:
+            with open(chemin, "rb") as f:
+                population = pickle.load(f)
+        except Exception:
+            return
+        self._date_vue = date
+        evalues = population.evaluated_individuals
+        nouveaux = evalues[~evalues.index.isin(self._deja)]
+        self.enregistrees += cache.enregistrer(self.empreinte, self.cible, self.objectif, nouveaux)
+        if self.objectif in nouveaux:
+            self._deja.update(nouveaux.index[nouveaux[self.objectif].map(_score_valide)])
+
+    def arreter(self):
+        self._stop.set()
+        self.join()
+
+
+def amorcer(source, destination, objectif, cache=None, empreinte=None, cible=None):
+    """Copie la population vivante de `source` dans le dossier de reprise `destination`.
+
+    Les scores sont effacés (TPOT réévalue ces individus pour la nouvelle
+    cible), sauf ceux que le cache connaît déjà pour (empreinte, cible,
+    objectif). La colonne `objectif` est créée si la source a été
+    cherchée avec un autre scorer.
+    La recherche amorcée repart à la génération 1.
+
+    Returns:
+        tuple: (individus repris, scores retrouvés dans le cache)
+    """
+    with open(os.path.join(source, POPULATION), "rb") as f:
+        population = pickle.load(f)
+    evalues = population.evaluated_individuals
+    vivants = {id(individu) for individu in population.population}
+    evalues = evalues[evalues["Individual"].map(lambda individu: id(individu) in vivants)].copy()
+    evalues[objectif] = np.nan
+    evalues["Generation"] = 0
+
+    retrouves = 0 if cache is None else completer_scores(evalues, cache, empreinte, cible, objectif)
+    population.evaluated_individuals = evalues
+    _ecrire_population(population, destination)
+    return len(evalues), retrouves
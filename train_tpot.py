@@ -0,0 +1,432 @@
+# =======================
+# Entraînement TPOT parallèle, une recherche par cible
+# =======================
+# Reprend entrainer_tpot_regressions_complet (ML_caesar_new_workflow_complet)
+# et l'assemblage des pipelines complets (predict_4, Predict_caesar_female) :
+#   - le ColumnTransformer "preprocess" est appris une fois sur les entrées ;
+#   - une recherche TPOTRegressor par cible, sur la matrice prétraitée ;
+#   - chaque Pipeline([("preprocess", ...), ("model", fitted_pipeline_)])
+#     est écrit sous pipeline_tpot_<cible>.pkl, comme dans les dossiers
+#     déployés.
+#
+# Les recherches tournent dans un pool de processus. Chaque worker reçoit
+# un budget de CPU (threads BLAS/OpenMP et n_jobs de TPOT) et lit X et Y
+# dans un segment de mémoire partagée au lieu d'en recevoir une copie.
+# Chaque fichier est écrit de façon atomique dès que sa recherche se
+# termine ; relancer la commande saute les cibles déjà présentes.
+#
+# Avec --budget-latence-ms, tous les individus évalués par TPOT dont le
+# score est proche du meilleur (--tolerance-score) sont réappris, leur
+# temps d'inférence (1 ligne, lot de 1000) et leur pic mémoire sont
+# mesurés, et le pipeline exporté est le plus précis de ceux
+# qui tiennent dans le budget. Le front de Pareto précision / latence de
+# chaque cible est conservé dans _entrainement.json.
+#
+# Avec --checkpoints, chaque recherche a un dossier de reprise par cible et
+# empreinte des données (voir tpot_cache.py) : une recherche interrompue
+# reprend à sa dernière génération, et --amorcer-depuis démarre une
+# recherche à partir de la population d'une autre cible ou d'un autre sexe.
+# Les scores sont ajoutés au cache d'évaluations à chaque génération.
+#
+# Avec --cache-features, X, Y et le préprocesseur appris sont relus depuis
+# le cache adressé par contenu de feature_cache.py quand ni les données, ni
+# le prétraitement, ni le code qui dérive les entrées n'ont changé.
+#
+# Usage :
+#   python train_tpot.py --sexe homme --sortie pipelines_homme_v2 --cpus-par-worker 2
+#   python train_tpot.py --sexe femme --sortie pipelines_femme_v2 --cibles tour_de_poitrine tour_du_cou
+#   python train_tpot.py --sexe homme --sortie pipelines_homme_rapides --budget-latence-ms 2
+#   python train_tpot.py --sexe homme --sortie pipelines_homme_v2 --cache-features
+#   python train_tpot.py --sexe femme --sortie pipelines_femme_v2 --checkpoints reprises_tpot \
+#       --amorcer-depuis reprises_tpot/homme/tour_de_poitrine-0123456789ab
+import argparse
+import inspect
+import json
+import os
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.compose import ColumnTransformer
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import MinMaxScaler, OneHotEncoder, RobustScaler
+from threadpoolctl import threadpool_limits
+
+import dataset_store
+import feature_cache
+import morphologie
+import schemas
+import soutien_gorge
+from dataset_store import SOURCES as SOURCES_STORE
+from distill import SOURCES as SOURCES_DISTILL
+from distill import donnees_reelles
+from morphologie import charger_config
+from schemas import SCHEMAS, colonnes_entree
+from tpot_cache import (CacheEvaluations, EnregistreurReprises, amorcer, completer_reprise, dossier_reprise,
+                        empreinte_donnees, nom_objectif, trouver_reprise, verifier_reprise)
+
+RAPPORT = "_entrainement.json"
+CACHE = "evaluations.sqlite"
+SCORER = "neg_mean_squared_error"
+
+# Matrices partagées et réglages, attachés une fois par worker
+_WORKER = {}
+
+
+def creer_preprocess(sexe):
+    """ColumnTransformer des notebooks (non appris) pour un sexe."""
+    schema = SCHEMAS[sexe]
+    numeriques = [c for c in schema["colonnes_num"] if c != "bonnet_rang"]
+    transformers = [
+        ("num", Pipeline([("imputer", SimpleImputer(strategy="median")), ("scaler", RobustScaler())]), numeriques),
+    ]
+    if "bonnet_rang" in schema["colonnes_num"]:
+        transformers.append(
+            ("bon", Pipeline([("imputer", SimpleImputer(strategy="median")), ("scaler", MinMaxScaler())]),
+             ["bonnet_rang"])
+        )
+    transformers.append(
+        ("cat", Pipeline([("imputer", SimpleImputer(strategy="most_frequent")),
+                          ("onehot", OneHotEncoder(handle_unknown="ignore"))]), list(schema["colonnes_cat"]))
+    )
+    return ColumnTransformer(transformers)
+
+
+def cibles_du_dossier(dossier):
+    """Noms des cibles d'un dossier de pipelines, sans le charger."""
+    return sorted(f[:-len(".pkl")].removeprefix("pipeline_").removeprefix("tpot_")
+                  for f in os.listdir(dossier) if f.endswith(".pkl"))
+
+
+def nom_fichier(cible):
+    return f"pipeline_tpot_{cible}.pkl"
+
+
+class MatricePartagee:
+    """Tableau numpy dans un segment multiprocessing.shared_memory."""
+
+    def __init__(self, tableau):
+        tableau = np.ascontiguousarray(tableau)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(tableau.nbytes, 1))
+        self.description = (self.shm.name, tableau.shape, tableau.dtype.str)
+        np.ndarray(tableau.shape, tableau.dtype, buffer=self.shm.buf)[...] = tableau
+
+    @staticmethod
+    def attacher(description):
+        nom, forme, dtype = description
+        shm = shared_memory.SharedMemory(name=nom)
+        return shm, np.ndarray(forme, np.dtype(dtype), buffer=shm.buf)
+
+    def liberer(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _init_worker(desc_X, desc_Y, cibles, preprocess, cpus, options):
+    threadpool_limits(limits=cpus)
+    # Les segments restent attachés pendant toute la vie du worker
+    _WORKER["shm_X"], _WORKER["X"] = MatricePartagee.attacher(desc_X)
+    _WORKER["shm_Y"], _WORKER["Y"] = MatricePartagee.attacher(desc_Y)
+    _WORKER.update(cibles=cibles, preprocess=preprocess, cpus=cpus, options=options)
+
+
+def ecrire_atomique(objet, chemin):
+    tmp = chemin + ".tmp"
+    joblib.dump(objet, tmp)
+    os.replace(tmp, chemin)
+
+
+# =======================
+# Sélection sous contrainte de latence
+# =======================
+def mesurer_inference(modele, X, repetitions=20):
+    """Latence médiane sur 1 ligne, durée d'un lot de 1000 lignes et pic mémoire du lot.
+
+    Les durées sont mesurées sans tracemalloc (qui ralentit les allocations) ;
+    le pic mémoire vient d'un second predict du lot.
+    """
+    ligne = X[:1]
+    modele.predict(ligne)
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        modele.predict(ligne)
+        durees.append(time.perf_counter() - debut)
+    lot = np.resize(X, (1000, X.shape[1]))
+    debut = time.perf_counter()
+    modele.predict(lot)
+    duree_lot = time.perf_counter() - debut
+    tracemalloc.start()
+    modele.predict(lot)
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "latence_1_ms": float(np.median(durees) * 1000),
+        "latence_1000_ms": duree_lot * 1000,
+        "memoire_pic_mo": pic / 1e6,
+    }
+
+
+def front_de_pareto(candidats):
+    """Indices des candidats non dominés (score maximal, latence 1 ligne minimale)."""
+    front = []
+    for i, a in enumerate(candidats):
+        domine = any(
+            b["score"] >= a["score"] and b["latence_1_ms"] <= a["latence_1_ms"]
+            and (b["score"] > a["score"] or b["latence_1_ms"] < a["latence_1_ms"])
+            for b in candidats
+        )
+        if not domine:
+            front.append(i)
+    return front
+
+
+def _resume(pipeline):
+    etapes = getattr(pipeline, "steps", [(None, pipeline)])
+    return " → ".join(type(etape).__name__ if not isinstance(etape, str) else etape for _, etape in etapes)
+
+
+def selectionner_sous_budget(tpot, X, y, budget_ms, n_candidats=50, tolerance_score=0.1):
+    """Choisit parmi les individus évalués le plus précis sous le budget de latence.
+
+    Le score est celui de la validation croisée de TPOT (plus grand = meilleur).
+    Tous les individus distincts dont le score est à moins de
+    `tolerance_score` (relatif) du meilleur sont réappris et mesurés, au
+    plus `n_candidats` : les pipelines rapides un peu moins précis entrent
+    ainsi dans le front de Pareto. Si aucun candidat ne tient dans le
+    budget, le plus rapide est retenu.
+
+    Returns:
+        tuple: (pipeline appris retenu, liste des candidats mesurés)
+    """
+    evalues = tpot.evaluated_individuals
+    objectif = tpot.objective_names[0]
+    scores = pd.to_numeric(evalues[objectif], errors="coerce")
+    meilleurs = evalues.assign(_score=scores).dropna(subset=["_score"]).sort_values("_score", ascending=False)
+    if not meilleurs.empty:
+        meilleur = meilleurs["_score"].iloc[0]
+        meilleurs = meilleurs[meilleurs["_score"] >= meilleur - tolerance_score * abs(meilleur)]
+
+    candidats, modeles, vus = [], [], set()
+    for _, individu in meilleurs.iterrows():
+        if len(candidats) >= n_candidats:
+            break
+        description = str(individu["Instance"])
+        if description in vus:
+            continue
+        vus.add(description)
+        try:
+            modele = tpot.fitted_pipeline_ if not candidats else clone(individu["Instance"]).fit(X, y)
+        except Exception as e:  # certains individus échouent hors de la validation croisée
+            print(f"  ⚠️ candidat ignoré ({type(e).__name__}: {e})")
+            continue
+        candidats.append({"score": float(individu["_score"]), "pipeline": _resume(modele),
+                          **mesurer_inference(modele, X)})
+        modeles.append(modele)
+
+    for i in front_de_pareto(candidats):
+        candidats[i]["front"] = True
+    dans_budget = [i for i, c in enumerate(candidats) if c["latence_1_ms"] <= budget_ms]
+    if dans_budget:
+        choix = max(dans_budget, key=lambda i: candidats[i]["score"])
+    else:
+        choix = min(range(len(candidats)), key=lambda i: candidats[i]["latence_1_ms"])
+    candidats[choix]["choisi"] = True
+    return modeles[choix], candidats
+
+
+def _entrainer_cible(cible, sortie):
+    from tpot import TPOTRegressor
+
+    options = _WORKER["options"]
+    j = _WORKER["cibles"].index(cible)
+    print(f"\n⚙️ Entraînement final complet pour : {cible}")
+    debut = time.perf_counter()
+    X, y = _WORKER["X"], _WORKER["Y"][:, j]
+    empreinte = empreinte_donnees(X, y)
+    # tpot.objective_names n'existe qu'après fit : même nom, calculé depuis le scorer
+    objectif = nom_objectif(SCORER)
+    reprise, cache, enregistreur = None, None, None
+    if options.get("checkpoints"):
+        racine = options["checkpoints"]
+        reprise = dossier_reprise(racine, options["sexe"], cible, empreinte)
+        cache = CacheEvaluations(os.path.join(racine, CACHE))
+        if verifier_reprise(reprise):
+            retrouves = completer_reprise(reprise, cache, empreinte, cible, objectif)
+            print(f"↻ Reprise de {cible} depuis {reprise} ({retrouves} score(s) complété(s) par le cache)")
+        elif options.get("amorcer_depuis"):
+            source = trouver_reprise(options["amorcer_depuis"], racine, options["sexe"])
+            n, retrouves = amorcer(source, reprise, objectif, cache, empreinte, cible)
+            print(f"↻ {cible} amorcée depuis {source} : {n} individus, {retrouves} score(s) en cache")
+    tpot = TPOTRegressor(
+        generations=options["generations"],
+        population_size=options["population_size"],
+        max_time_mins=options["max_minutes"],
+        verbose=options["verbose"],
+        random_state=options["random_state"],
+        n_jobs=_WORKER["cpus"],
+        cv=3,
+        scorers=[SCORER],
+        periodic_checkpoint_folder=reprise,
+    )
+    if reprise is not None:
+        # Chaque génération écrite par TPOT alimente le cache, même si la recherche est interrompue
+        enregistreur = EnregistreurReprises(reprise, os.path.join(options["checkpoints"], CACHE), empreinte, cible,
+                                            objectif)
+        enregistreur.start()
+    try:
+        tpot.fit(X, y)
+    finally:
+        if enregistreur is not None:
+            enregistreur.arreter()
+    resultat = {}
+    if cache is not None:
+        resultat["evaluations_en_cache"] = cache.enregistrer(empreinte, cible, tpot.objective_names[0],
+                                                             tpot.evaluated_individuals)
+        cache.close()
+    modele = tpot.fitted_pipeline_
+    if options.get("budget_latence_ms") is not None:
+        modele, resultat["candidats"] = selectionner_sous_budget(
+            tpot, X, y, options["budget_latence_ms"], options.get("n_candidats", 50),
+            options.get("tolerance_score", 0.1))
+    pipeline = Pipeline([("preprocess", _WORKER["preprocess"]), ("model", modele)])
+    chemin = os.path.join(sortie, nom_fichier(cible))
+    ecrire_atomique(pipeline, chemin)
+    return cible, {"fichier": chemin, "duree_s": round(time.perf_counter() - debut, 1), **resultat}
+
+
+def preparer_donnees(sexe, cibles):
+    """X prétraité (float64 dense), Y imputé à la médiane et le preprocess appris."""
+    df = donnees_reelles(sexe)
+    absentes = [c for c in cibles if c not in df]
+    if absentes:
+        raise ValueError(f"Cibles absentes des données : {absentes}")
+    preprocess = creer_preprocess(sexe)
+    X = preprocess.fit_transform(df[colonnes_entree(sexe)])
+    X = np.asarray(X.toarray() if hasattr(X, "toarray") else X, dtype=np.float64)
+    # Comme dans le notebook : imputation médiane des cibles
+    Y = SimpleImputer(strategy="median").fit_transform(df[cibles]).astype(np.float64)
+    return X, Y, preprocess
+
+
+def preparer_donnees_en_cache(sexe, cibles, dossier=feature_cache.DOSSIER):
+    """Comme preparer_donnees, via le cache de features (X et Y en mmap)."""
+    source = os.path.join(feature_cache.RACINE, SOURCES_STORE[SOURCES_DISTILL[sexe]["reel"]]["fichier"])
+    config = {
+        "sexe": sexe,
+        "cibles": list(cibles),
+        "colonnes": colonnes_entree(sexe),
+        "preprocess": creer_preprocess(sexe),
+        "morphologie": charger_config(),
+        # Tout le code qui produit X et Y : les fonctions d'ici et de distill, et les
+        # modules entiers qu'elles appellent (lecture du store, catégories, soutien-gorge, colonnes)
+        "code": [inspect.getsource(f) for f in (donnees_reelles, preparer_donnees)]
+                + [inspect.getsource(m) for m in (dataset_store, morphologie, soutien_gorge, schemas)],
+    }
+
+    def calculer():
+        X, Y, preprocess = preparer_donnees(sexe, cibles)
+        return {"X": X, "Y": Y}, {"preprocess": preprocess}
+
+    entree = feature_cache.obtenir(feature_cache.cle([source], config), calculer, dossier,
+                                   meta={"description": f"train_tpot {sexe}", "cibles": list(cibles)})
+    print(f"{'↻' if entree.trouvee else '✔'} Features {'relues depuis' if entree.trouvee else 'écrites dans'} "
+          f"{entree.dossier}")
+    return entree.matrices["X"], entree.matrices["Y"], entree.objets["preprocess"]
+
+
+def entrainer(sexe, sortie, cibles=None, cpus_par_worker=1, workers=None, options=None, forcer=False):
+    """Lance les recherches manquantes et renvoie {cible: {"fichier", "duree_s"}}."""
+    options = {"generations": 4, "population_size": 20, "max_minutes": 60, "verbose": 2, "random_state": 42,
+               "budget_latence_ms": None, "n_candidats": 50, "tolerance_score": 0.1, "checkpoints": None, "amorcer_depuis": None,
+               "cache_features": None, **(options or {}), "sexe": sexe}
+    cibles = cibles or cibles_du_dossier(SCHEMAS[sexe]["dossier"])
+    os.makedirs(sortie, exist_ok=True)
+    a_faire = [c for c in cibles if forcer or not os.path.exists(os.path.join(sortie, nom_fichier(c)))]
+    if not a_faire:
+        print(f"✔ Toutes les cibles sont déjà entraînées dans {sortie}")
+        return {}
+
+    if options["cache_features"]:
+        X, Y, preprocess = preparer_donnees_en_cache(sexe, cibles, options["cache_features"])
+    else:
+        X, Y, preprocess = preparer_donnees(sexe, cibles)
+    workers = workers or max(1, (os.cpu_count() or 1) // cpus_par_worker)
+    workers = min(workers, len(a_faire))
+    print(f"⚙️ {len(a_faire)} cible(s), {workers} worker(s) × {cpus_par_worker} CPU, X {X.shape}")
+
+    resultats = {}
+    partage_X, partage_Y = MatricePartagee(X), MatricePartagee(Y)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(partage_X.description, partage_Y.description, cibles, preprocess, cpus_par_worker, options),
+        ) as pool:
+            futures = [pool.submit(_entrainer_cible, cible, sortie) for cible in a_faire]
+            for future in as_completed(futures):
+                cible, resultat = future.result()
+                resultats[cible] = resultat
+                print(f"✔ Pipeline sauvegardé : {resultat['fichier']} ({resultat['duree_s']} s)")
+                for candidat in resultat.get("candidats", []):
+                    if candidat.get("choisi"):
+                        print(f"  score {candidat['score']:.4g}, {candidat['latence_1_ms']:.2f} ms/ligne : "
+                              f"{candidat['pipeline']}")
+    finally:
+        partage_X.liberer()
+        partage_Y.liberer()
+
+    chemin_rapport = os.path.join(sortie, RAPPORT)
+    rapport = {}
+    if os.path.exists(chemin_rapport):
+        with open(chemin_rapport, encoding="utf-8") as f:
+            rapport = json.load(f)
+    rapport.setdefault("cibles", {}).update(resultats)
+    rapport.update(sexe=sexe, options=options, lignes=int(X.shape[0]))
+    with open(chemin_rapport, "w", encoding="utf-8") as f:
+        json.dump(rapport, f, indent=2, ensure_ascii=False)
+    return resultats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entraînement TPOT parallèle par cible")
+    parser.add_argument("--sexe", choices=sorted(SCHEMAS), required=True)
+    parser.add_argument("--sortie", required=True, help="Dossier des pipelines entraînés")
+    parser.add_argument("--cibles", nargs="*", help="Cibles à entraîner (défaut : celles du dossier déployé)")
+    parser.add_argument("--cpus-par-worker", type=int, default=1, help="Threads BLAS et n_jobs TPOT par recherche")
+    parser.add_argument("--workers", type=int, help="Recherches simultanées (défaut : CPU / cpus-par-worker)")
+    parser.add_argument("--generations", type=int, default=4)
+    parser.add_argument("--population", type=int, default=20)
+    parser.add_argument("--max-minutes", type=float, default=60, help="Durée maximale d'une recherche")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--budget-latence-ms", type=float,
+                        help="Latence maximale sur 1 ligne du modèle exporté (défaut : meilleur score TPOT)")
+    parser.add_argument("--candidats", type=int, default=50, help="Individus mesurés au plus par cible")
+    parser.add_argument("--tolerance-score", type=float, default=0.1,
+                        help="Écart relatif au meilleur score CV des individus mesurés")
+    parser.add_argument("--checkpoints", help="Racine des dossiers de reprise et du cache d'évaluations")
+    parser.add_argument("--amorcer-depuis", help="Cible (même sexe) ou dossier de reprise dont la population "
+                                                "amorce les nouvelles recherches ; nécessite --checkpoints")
+    parser.add_argument("--cache-features", nargs="?", const=feature_cache.DOSSIER,
+                        help="Réutilise X/Y prétraités depuis ce cache (défaut : cache_features/)")
+    parser.add_argument("--forcer", action="store_true", help="Réentraîner les cibles déjà présentes")
+    args = parser.parse_args()
+
+    options = {"generations": args.generations, "population_size": args.population,
+               "max_minutes": args.max_minutes, "random_state": args.seed,
+               "budget_latence_ms": args.budget_latence_ms, "n_candidats": args.candidats,
+               "tolerance_score": args.tolerance_score,
+               "checkpoints": args.checkpoints, "amorcer_depuis": args.amorcer_depuis,
+               "cache_features": args.cache_features}
+    resultats = entrainer(args.sexe, args.sortie, args.cibles, args.cpus_par_worker, args.workers, options,
+                          args.forcer)
+    print(f"✅ {len(resultats)} pipeline(s) entraînés dans {args.sortie}")
+
+
+if __name__ == "__main__":
+    main()
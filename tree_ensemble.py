@@ -0,0 +1,414 @@
+# =======================
+# Évaluateur numpy des ensembles d'arbres
+# =======================
+# Beaucoup de pipelines TPOT se terminent par un ensemble d'arbres
+# (ExtraTrees, RandomForest, HistGradientBoosting, LightGBM, XGBoost...).
+# Pour 1 à 100 lignes, le coût de predict est surtout celui de la
+# construction des matrices internes et du dispatch des bibliothèques.
+#
+# export_forest() convertit les arbres appris de chaque pipeline en
+# tableaux plats (feature, seuil, gauche, droite, valeur) ; ForestArrays
+# parcourt ensuite tous les arbres de toutes les cibles en même temps, de
+# façon vectorisée sur le lot. Les étapes qui précèdent l'ensemble d'arbres
+# dans le pipeline TPOT (scalers, sélection de variables...) sont appliquées
+# telles quelles avec sklearn.
+#
+# Usage :
+#   python tree_ensemble.py pipelines_all_dataset forets/homme.joblib --sexe homme
+#   forest = ForestArrays.load("forets/homme.joblib")
+import argparse
+import json
+
+import joblib
+import numpy as np
+from joblib import hash as joblib_hash
+from sklearn.pipeline import Pipeline
+
+from wrapper import split_preprocess
+
+# Objectifs dont la fonction de lien est l'identité
+OBJECTIFS_XGB = {"reg:squarederror", "reg:absoluteerror", "reg:pseudohubererror"}
+OBJECTIFS_LGBM = {"regression", "regression_l1", "huber", "fair", "quantile", "mape"}
+
+
+class NonSupporte(Exception):
+    """Estimateur final qui ne peut pas être converti en tableaux."""
+
+
+class Arbre:
+    """Un arbre aplati. Les feuilles ont gauche = -1.
+
+    Règle de décision : gauche si x <= seuil, ou si x est NaN et
+    manquant_gauche. `float32` indique que la bibliothèque compare les
+    entrées arrondies en float32 (arbres sklearn, XGBoost).
+    """
+
+    def __init__(self, feature, seuil, gauche, droite, valeur, manquant_gauche, float32):
+        feuille = np.asarray(gauche) < 0
+        self.feature = np.where(feuille, 0, feature).astype(np.int32)
+        self.seuil = np.where(feuille, 0.0, seuil).astype(np.float64)
+        self.gauche = np.asarray(gauche, dtype=np.int32)
+        self.droite = np.asarray(droite, dtype=np.int32)
+        self.valeur = np.asarray(valeur, dtype=np.float64)
+        self.manquant_gauche = np.asarray(manquant_gauche, dtype=bool)
+        self.float32 = float32
+
+
+# =======================
+# Conversion par bibliothèque
+# =======================
+def _arbre_sklearn(estimateur, poids=1.0):
+    t = estimateur.tree_
+    manquant = getattr(t, "missing_go_to_left", None)
+    return Arbre(
+        t.feature, t.threshold, t.children_left, t.children_right,
+        t.value[:, 0, 0] * poids,
+        np.zeros(t.node_count, bool) if manquant is None else manquant,
+        float32=True,
+    )
+
+
+def _depuis_noeuds(racine, enfants, lire):
+    """Aplatit un arbre décrit en dictionnaires imbriqués (dumps JSON).
+
+    `enfants(noeud)` renvoie (gauche, droite) ou None pour une feuille ;
+    `lire(noeud)` renvoie (feature, seuil, manquant_gauche, valeur).
+    """
+    noeuds, pile = [], [racine]
+    while pile:
+        noeud = pile.pop()
+        noeuds.append(noeud)
+        paire = enfants(noeud)
+        if paire is not None:
+            pile.extend(reversed(paire))
+    position = {id(n): i for i, n in enumerate(noeuds)}
+    n = len(noeuds)
+    feature, seuil = np.zeros(n, np.int64), np.zeros(n)
+    gauche, droite = np.full(n, -1), np.full(n, -1)
+    valeur, manquant = np.zeros(n), np.zeros(n, bool)
+    for i, noeud in enumerate(noeuds):
+        paire = enfants(noeud)
+        feature[i], seuil[i], manquant[i], valeur[i] = lire(noeud)
+        if paire is not None:
+            gauche[i], droite[i] = position[id(paire[0])], position[id(paire[1])]
+    return feature, seuil, gauche, droite, valeur, manquant
+
+
+def _arbres_xgboost(estimateur):
+    booster = estimateur.get_booster()
+    config = json.loads(booster.save_config())["learner"]
+    objectif = config["objective"]["name"]
+    if objectif not in OBJECTIFS_XGB:
+        raise NonSupporte(f"objectif XGBoost {objectif}")
+    if config["gradient_booster"]["name"] != "gbtree":
+        raise NonSupporte(f"booster XGBoost {config['gradient_booster']['name']}")
+    if getattr(estimateur, "early_stopping_rounds", None):
+        raise NonSupporte("XGBoost avec early stopping")
+    base = str(config["learner_model_param"]["base_score"]).strip("[]")
+    if "," in base:
+        raise NonSupporte("XGBoost multi-sorties")
+    noms = booster.feature_names
+
+    def colonne(split):
+        return noms.index(split) if noms else int(split[1:])
+
+    arbres = []
+    for dump in booster.get_dump(dump_format="json"):
+        racine = json.loads(dump)
+
+        def enfants(noeud):
+            if "leaf" in noeud:
+                return None
+            fils = {c["nodeid"]: c for c in noeud["children"]}
+            return fils[noeud["yes"]], fils[noeud["no"]]
+
+        def lire(noeud):
+            if "leaf" in noeud:
+                return 0, 0.0, False, noeud["leaf"]
+            # XGBoost : gauche si x < seuil (float32). Pour x float32, c'est
+            # équivalent à x <= le float32 qui précède le seuil.
+            seuil = np.nextafter(np.float32(noeud["split_condition"]), np.float32(-np.inf))
+            return colonne(noeud["split"]), float(seuil), noeud["missing"] == noeud["yes"], 0.0
+
+        arbres.append(Arbre(*_depuis_noeuds(racine, enfants, lire), float32=True))
+    return arbres, float(base)
+
+
+def _arbres_lightgbm(estimateur):
+    modele = estimateur.booster_.dump_model()
+    objectif = modele["objective"].split()[0]
+    if objectif not in OBJECTIFS_LGBM:
+        raise NonSupporte(f"objectif LightGBM {objectif}")
+
+    def enfants(noeud):
+        if "leaf_value" in noeud:
+            return None
+        return noeud["left_child"], noeud["right_child"]
+
+    def lire(noeud):
+        if "leaf_value" in noeud:
+            return 0, 0.0, False, noeud["leaf_value"]
+        if noeud["decision_type"] != "<=":
+            raise NonSupporte("split catégoriel LightGBM")
+        if noeud["missing_type"] == "NaN":
+            manquant_gauche = noeud["default_left"]
+        elif noeud["missing_type"] == "None":
+            # LightGBM remplace NaN par 0 avant la comparaison
+            manquant_gauche = 0.0 <= noeud["threshold"]
+        else:
+            raise NonSupporte(f"missing_type LightGBM {noeud['missing_type']}")
+        return noeud["split_feature"], noeud["threshold"], manquant_gauche, 0.0
+
+    arbres = [
+        Arbre(*_depuis_noeuds(info["tree_structure"], enfants, lire), float32=False)
+        for info in modele["tree_info"]
+    ]
+    return arbres, 0.0
+
+
+def _arbres_hist_gradient_boosting(estimateur):
+    if type(estimateur._loss.link).__name__ != "IdentityLink":
+        raise NonSupporte("HistGradientBoosting avec lien non identité")
+    if getattr(estimateur, "_preprocessor", None) is not None:
+        raise NonSupporte("HistGradientBoosting avec variables catégorielles")
+    arbres = []
+    for predicteurs in estimateur._predictors:
+        noeuds = predicteurs[0].nodes
+        if noeuds["is_categorical"].any():
+            raise NonSupporte("split catégoriel HistGradientBoosting")
+        feuille = noeuds["is_leaf"].astype(bool)
+        arbres.append(Arbre(
+            noeuds["feature_idx"], noeuds["num_threshold"],
+            np.where(feuille, -1, noeuds["left"].astype(np.int64)),
+            np.where(feuille, -1, noeuds["right"].astype(np.int64)),
+            noeuds["value"], noeuds["missing_go_to_left"].astype(bool),
+            float32=False,
+        ))
+    return arbres, float(np.ravel(estimateur._baseline_prediction)[0])
+
+
+def convertir_estimateur(estimateur):
+    """Renvoie (arbres, constante) tels que predict = constante + Σ feuilles."""
+    nom = type(estimateur).__name__
+    if nom in ("DecisionTreeRegressor", "ExtraTreeRegressor"):
+        return [_arbre_sklearn(estimateur)], 0.0
+    if nom in ("RandomForestRegressor", "ExtraTreesRegressor"):
+        poids = 1.0 / len(estimateur.estimators_)
+        return [_arbre_sklearn(e, poids) for e in estimateur.estimators_], 0.0
+    if nom == "GradientBoostingRegressor":
+        init = estimateur.init_
+        if init == "zero":
+            base = 0.0
+        elif type(init).__name__ == "DummyRegressor":
+            base = float(np.ravel(init.constant_)[0])
+        else:
+            raise NonSupporte(f"init GradientBoosting {type(init).__name__}")
+        arbres = [_arbre_sklearn(e, estimateur.learning_rate) for e in estimateur.estimators_[:, 0]]
+        return arbres, base
+    if nom == "HistGradientBoostingRegressor":
+        return _arbres_hist_gradient_boosting(estimateur)
+    if nom == "XGBRegressor":
+        return _arbres_xgboost(estimateur)
+    if nom == "LGBMRegressor":
+        return _arbres_lightgbm(estimateur)
+    raise NonSupporte(f"estimateur final {nom}")
+
+
+def _aplatir(estimateur):
+    """Étapes d'un pipeline (éventuellement imbriqué), sans les "passthrough"."""
+    if isinstance(estimateur, Pipeline):
+        etapes = []
+        for _, etape in estimateur.steps:
+            if etape is not None and not (isinstance(etape, str) and etape == "passthrough"):
+                etapes.extend(_aplatir(etape))
+        return etapes
+    return [estimateur]
+
+
+# =======================
+# Forêt plate multi-cibles
+# =======================
+class ForestArrays:
+    """Tous les arbres convertis, concaténés et triés par cible.
+
+    Attributs principaux : `targets` (indices des modèles couverts),
+    `non_supportes` ({indice: raison}) et les tableaux de noeuds.
+    """
+
+    def __init__(self, specs, non_supportes, n_models):
+        self.n_models = n_models
+        self.non_supportes = dict(non_supportes)
+        specs = [s for s in specs if s is not None]
+        self.targets = [s["index"] for s in specs]
+        self.base = np.array([s["base"] for s in specs])
+
+        # Groupes d'entrée : même préprocesseur et mêmes étapes avant l'ensemble
+        cles = list(dict.fromkeys(s["cle"] for s in specs))
+        self.prefixes = [next(s["prefixe"] for s in specs if s["cle"] == c) for c in cles]
+        self.source_groupe = [next(s["index"] for s in specs if s["cle"] == c) for c in cles]
+
+        feature, seuil, gauche, droite, valeur, manquant = [], [], [], [], [], []
+        racines, entree, debuts = [], [], []
+        decalage = 0
+        for s in specs:
+            debuts.append(len(racines))
+            groupe = cles.index(s["cle"])
+            for arbre in s["arbres"]:
+                n = len(arbre.gauche)
+                feature.append(arbre.feature)
+                seuil.append(arbre.seuil)
+                gauche.append(np.where(arbre.gauche < 0, -1, arbre.gauche + decalage))
+                droite.append(np.where(arbre.droite < 0, -1, arbre.droite + decalage))
+                valeur.append(arbre.valeur)
+                manquant.append(arbre.manquant_gauche)
+                racines.append(decalage)
+                # Deux copies de l'entrée par groupe : float64 et arrondie en float32
+                entree.append(2 * groupe + int(arbre.float32))
+                decalage += n
+        vide = [np.zeros(0)]
+        self.feature = np.concatenate(feature or vide).astype(np.int32)
+        self.seuil = np.concatenate(seuil or vide)
+        self.gauche = np.concatenate(gauche or vide).astype(np.int32)
+        self.droite = np.concatenate(droite or vide).astype(np.int32)
+        self.valeur = np.concatenate(valeur or vide)
+        self.manquant_gauche = np.concatenate(manquant or vide).astype(bool)
+        self.racines = np.array(racines, dtype=np.int64)
+        self.entree = np.array(entree, dtype=np.int64)
+        self.debuts = np.array(debuts, dtype=np.int64)
+
+    def _entrees(self, inputs):
+        matrices = []
+        for source, prefixe in zip(self.source_groupe, self.prefixes):
+            X = inputs[source]
+            for etape in prefixe:
+                X = etape.transform(X)
+            X = np.asarray(X, dtype=np.float64)
+            matrices += [X, X.astype(np.float32).astype(np.float64)]
+        largeur = max(m.shape[1] for m in matrices)
+        Xs = np.zeros((len(matrices), matrices[0].shape[0], largeur))
+        for k, m in enumerate(matrices):
+            Xs[k, :, :m.shape[1]] = m
+        return Xs
+
+    def predict(self, inputs, taille_lot=2048):
+        """Prédictions (n, len(targets)).
+
+        `inputs[i]` est la matrice reçue par le modèle final i (après
+        l'étape "preprocess"), comme dans MultiTPOTWrapper.
+        """
+        if not self.targets:
+            return np.empty((len(inputs[0]), 0))
+        Xs = self._entrees(inputs)
+        n = Xs.shape[1]
+        sortie = np.empty((n, len(self.targets)))
+        for lo in range(0, n, taille_lot):
+            hi = min(lo + taille_lot, n)
+            lignes = np.arange(lo, hi)[:, None]
+            noeud = np.broadcast_to(self.racines, (hi - lo, len(self.racines))).copy()
+            while True:
+                gauche = self.gauche[noeud]
+                actif = gauche >= 0
+                if not actif.any():
+                    break
+                x = Xs[self.entree[None, :], lignes, self.feature[noeud]]
+                va_gauche = np.where(np.isnan(x), self.manquant_gauche[noeud], x <= self.seuil[noeud])
+                noeud = np.where(actif, np.where(va_gauche, gauche, self.droite[noeud]), noeud)
+            sortie[lo:hi] = np.add.reduceat(self.valeur[noeud], self.debuts, axis=1) + self.base
+        return sortie
+
+    def save(self, chemin):
+        """Sauvegarde joblib non compressée (rechargeable avec mmap_mode="r").
+
+        Seul l'état est écrit (dict de tableaux et d'étapes sklearn), pas la
+        classe : le fichier ne dépend pas du module qui l'a produit
+        (__main__ quand tree_ensemble.py est lancé en script).
+        """
+        joblib.dump(dict(vars(self)), chemin)
+
+    @classmethod
+    def load(cls, chemin, mmap_mode="r"):
+        forest = cls.__new__(cls)
+        vars(forest).update(joblib.load(chemin, mmap_mode=mmap_mode))
+        return forest
+
+
+def _specification(index, model):
+    preprocess, final = split_preprocess(model)
+    etapes = _aplatir(final)
+    arbres, base = convertir_estimateur(etapes[-1])
+    if not arbres:
+        raise NonSupporte("ensemble sans arbre")
+    prefixe = etapes[:-1]
+    return {
+        "index": index,
+        "cle": joblib_hash((preprocess, prefixe)),
+        "prefixe": prefixe,
+        "arbres": arbres,
+        "base": base,
+    }
+
+
+def _inputs_finaux(models, X):
+    inputs = []
+    for model in models:
+        preprocess, _ = split_preprocess(model)
+        inputs.append(X if preprocess is None else preprocess.transform(X))
+    return inputs
+
+
+def ecarts(forest, models, X):
+    """Écart absolu maximal par modèle couvert entre la forêt et predict."""
+    sortie = forest.predict(_inputs_finaux(models, X))
+    return {
+        i: float(np.max(np.abs(sortie[:, j] - models[i].predict(X))))
+        for j, i in enumerate(forest.targets)
+    }
+
+
+def export_forest(models, X_check=None, tolerance=1e-4):
+    """Convertit les ensembles d'arbres d'une liste de pipelines complets.
+
+    Si `X_check` est fourni, chaque cible convertie est comparée aux modèles
+    d'origine ; celles dont l'écart dépasse `tolerance` sont écartées et
+    restent évaluées par leur modèle.
+    """
+    specs, non_supportes = [], {}
+    for i, model in enumerate(models):
+        try:
+            specs.append(_specification(i, model))
+        except NonSupporte as e:
+            non_supportes[i] = str(e)
+    forest = ForestArrays(specs, non_supportes, len(models))
+    if X_check is not None and forest.targets:
+        for i, ecart in ecarts(forest, models, X_check).items():
+            if ecart > tolerance:
+                non_supportes[i] = f"écart {ecart:.2e} > {tolerance:.0e}"
+        specs = [s for s in specs if s["index"] not in non_supportes]
+        forest = ForestArrays(specs, non_supportes, len(models))
+    return forest
+
+
+def main():
+    from response_surface import echantillon_formulaire
+    from schemas import SCHEMAS
+    from wrapper import load_models
+
+    parser = argparse.ArgumentParser(description="Export des ensembles d'arbres en tableaux numpy")
+    parser.add_argument("dossier", help="Dossier de pipelines ou bundle")
+    parser.add_argument("destination", help="Fichier .joblib de la forêt")
+    parser.add_argument("--sexe", choices=sorted(SCHEMAS), required=True)
+    parser.add_argument("--echantillons", type=int, default=2000, help="Lignes de vérification")
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    models, target_names = load_models(args.dossier)
+    X_check = echantillon_formulaire(args.sexe, args.echantillons)
+    forest = export_forest(models, X_check, args.tolerance)
+    forest.save(args.destination)
+    print(f"✔ {len(forest.targets)}/{len(models)} cibles converties ({len(forest.racines)} arbres)")
+    for i, raison in sorted(forest.non_supportes.items()):
+        print(f"  - {target_names[i]} : {raison}")
+
+
+if __name__ == "__main__":
+    main()
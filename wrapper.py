@@ -1,12 +1,432 @@
 # 1. Wrapper
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections.abc import Mapping
+
+import numpy as np
+from joblib import hash as joblib_hash
+from sklearn.pipeline import Pipeline
+from threadpoolctl import threadpool_limits
+
+
+def load_models(folder_path):
+    """Charge les pipelines .pkl d'un dossier, triés par nom de fichier.
+
+    `folder_path` peut aussi être un fichier bundle (voir bundle.py).
+
+    Returns:
+        tuple: (liste des modèles, noms des cibles dans le même ordre).
+    """
+    if os.path.isfile(folder_path):
+        from bundle import ModelBundle
+        bundle = ModelBundle(folder_path)
+        return bundle.modeles(), list(bundle.target_names)
+
+    import joblib
+    models, target_names = [], []
+    for file in sorted(os.listdir(folder_path)):
+        if file.endswith(".pkl"):
+            models.append(joblib.load(os.path.join(folder_path, file)))
+            target_names.append(file[:-len(".pkl")].removeprefix("pipeline_").removeprefix("tpot_"))
+    return models, target_names
+
+
+def split_preprocess(model):
+    """Sépare un pipeline complet en (preprocess, modèle final).
+
+    Renvoie (None, model) si le modèle n'a pas d'étape "preprocess".
+    """
+    if isinstance(model, Pipeline) and len(model.steps) > 1 and model.steps[0][0] == "preprocess":
+        return model.steps[0][1], model[1:]
+    return None, model
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _imputer_statistics(step):
+    """Valeurs de remplacement d'un SimpleImputer appris, s'il se réduit à un remplacement des NaN.
+
+    Lève NotImplementedError si sklearn ferait autre chose : colonnes
+    indicatrices, marqueur de valeur manquante autre que NaN/None, ou
+    colonnes entièrement vides supprimées de la sortie.
+    """
+    if step.add_indicator:
+        raise NotImplementedError("SimpleImputer avec add_indicator non supporté")
+    if not _is_missing(step.missing_values):
+        raise NotImplementedError(f"SimpleImputer avec missing_values={step.missing_values!r} non supporté")
+    statistics = list(step.statistics_)
+    if not getattr(step, "keep_empty_features", False) and any(_is_missing(v) for v in statistics):
+        raise NotImplementedError("SimpleImputer ayant supprimé des colonnes vides non supporté")
+    return statistics
+
+
+class CompiledPreprocess:
+    """Version numpy d'un ColumnTransformer appris, pour une ligne à la fois.
+
+    Reproduit les opérations de SimpleImputer, RobustScaler, StandardScaler,
+    MinMaxScaler, MaxAbsScaler et OneHotEncoder dans le même ordre que
+    sklearn, sans passer par pandas. Lève NotImplementedError pour toute
+    autre étape, et pour un SimpleImputer qui ne se réduit pas à remplacer
+    les NaN avant toute mise à l'échelle.
+    """
+
+    def __init__(self, column_transformer):
+        ct = column_transformer
+        if getattr(ct, "sparse_output_", False):
+            raise NotImplementedError("sortie creuse non supportée")
+        self.input_columns = list(ct.feature_names_in_)
+        self._numeric = []      # (colonnes, tranche de sortie, valeurs de remplacement, opérations)
+        self._categorical = []  # (colonne, remplacement, {catégorie: position}, handle_unknown)
+        position = 0
+        for name, transformer, columns in ct.transformers_:
+            if transformer == "drop" or len(columns) == 0:
+                continue
+            if transformer == "passthrough":
+                steps = []
+            elif isinstance(transformer, Pipeline):
+                steps = [step for _, step in transformer.steps]
+            else:
+                steps = [transformer]
+            columns = [self.input_columns[c] if isinstance(c, (int, np.integer)) else c for c in columns]
+            encoder = steps[-1] if steps and type(steps[-1]).__name__ == "OneHotEncoder" else None
+            if encoder is not None:
+                position = self._add_categorical(columns, steps[:-1], encoder, position)
+            else:
+                position = self._add_numeric(columns, steps, position)
+        self.n_features_out = position
+
+    def _add_numeric(self, columns, steps, position):
+        fill = np.full(len(columns), np.nan)
+        operations = []
+        for step in steps:
+            kind = type(step).__name__
+            if kind == "SimpleImputer":
+                if operations:
+                    # Les valeurs de remplacement seraient appliquées avant la mise à l'échelle
+                    raise NotImplementedError("SimpleImputer placé après une mise à l'échelle non supporté")
+                fill = np.asarray(_imputer_statistics(step), dtype=float)
+            elif kind == "RobustScaler":
+                if step.with_centering:
+                    operations.append((np.subtract, (step.center_,)))
+                if step.with_scaling:
+                    operations.append((np.divide, (step.scale_,)))
+            elif kind == "StandardScaler":
+                if step.with_mean:
+                    operations.append((np.subtract, (step.mean_,)))
+                if step.with_std:
+                    operations.append((np.divide, (step.scale_,)))
+            elif kind == "MinMaxScaler":
+                operations.append((np.multiply, (step.scale_,)))
+                operations.append((np.add, (step.min_,)))
+                if step.clip:
+                    operations.append((np.clip, tuple(step.feature_range)))
+            elif kind == "MaxAbsScaler":
+                operations.append((np.divide, (step.scale_,)))
+            else:
+                raise NotImplementedError(f"étape non supportée : {kind}")
+        out = slice(position, position + len(columns))
+        self._numeric.append((columns, out, fill, operations))
+        return out.stop
+
+    def _add_categorical(self, columns, steps, encoder, position):
+        fill = [None] * len(columns)
+        for step in steps:
+            if type(step).__name__ != "SimpleImputer":
+                raise NotImplementedError(f"étape non supportée : {type(step).__name__}")
+            fill = _imputer_statistics(step)
+        if encoder.drop_idx_ is not None or getattr(encoder, "_infrequent_enabled", False):
+            raise NotImplementedError("OneHotEncoder avec drop/infrequent non supporté")
+        for j, column in enumerate(columns):
+            categories = encoder.categories_[j]
+            table = {category: position + k for k, category in enumerate(categories)}
+            self._categorical.append((column, fill[j], table, encoder.handle_unknown))
+            position += len(categories)
+        return position
+
+    def check_schema(self, row):
+        """Vérifie que toutes les colonnes d'entrée attendues sont présentes."""
+        missing = [c for c in self.input_columns if c not in row]
+        if missing:
+            raise ValueError(f"Colonnes manquantes : {missing} (attendues : {self.input_columns})")
+
+    def transform_into(self, row, out):
+        """Écrit la ligne transformée dans `out` (tableau float de forme (1, n))."""
+        out.fill(0.0)
+        flat = out[0]
+        for columns, target, fill, operations in self._numeric:
+            values = np.array([np.nan if _is_missing(row[c]) else float(row[c]) for c in columns])
+            values = np.where(np.isnan(values), fill, values)
+            for operation, operands in operations:
+                values = operation(values, *operands)
+            flat[target] = values
+        for column, fill, table, handle_unknown in self._categorical:
+            value = row[column]
+            if _is_missing(value):
+                value = fill
+            position = table.get(value)
+            if position is not None:
+                flat[position] = 1.0
+            elif handle_unknown == "error":
+                raise ValueError(f"Catégorie inconnue pour {column} : {value!r}")
+        return out
+
+
+# Modèles tenus par chaque processus du pool (backend="processes").
+_WORKER_MODELS = {}
+
+
+def _init_worker(models, inner_threads):
+    # Limite les threads BLAS/OpenMP (XGBoost, LightGBM) de ce processus.
+    threadpool_limits(limits=inner_threads)
+    _WORKER_MODELS["models"] = models
+    _WORKER_MODELS["finals"] = [split_preprocess(m)[1] for m in models]
+
+
+def _init_thread(inner_threads):
+    # Les limites OpenMP (XGBoost, LightGBM) ne valent que pour le thread qui
+    # les pose : chaque thread du pool pose la sienne. La limite BLAS, elle,
+    # est globale au processus et n'est pas modifiée ici.
+    threadpool_limits(limits=inner_threads, user_api="openmp")
+
+
+def _worker_predict(kind, i, X):
+    return _WORKER_MODELS[kind][i].predict(X)
+
+
+class PredictionResult(Mapping):
+    """Résultat compact de predict_one : mesures indexées par nom de cible."""
+
+    __slots__ = ("_index", "values")
+
+    def __init__(self, index, values):
+        self._index = index
+        self.values = values
+
+    def __getitem__(self, name):
+        return float(self.values[self._index[name]])
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return f"PredictionResult({dict(self)})"
+
+
 class MultiTPOTWrapper:
-    def __init__(self, models):
+    # Valeurs par défaut au niveau de la classe : les wrappers déjà picklés
+    # (ex. full_pipeline_female.pkl) n'ont pas ces attributs.
+    shared_preprocess = False
+    target_names = None
+    n_jobs = 1
+    backend = "threads"
+    inner_threads = None
+    _groups = None
+    _finals = None
+    _compiled = None
+    _forest = None
+    _index = None
+    _local = None
+    _executor = None
+
+    def __init__(self, models, shared_preprocess=False, target_names=None,
+                 n_jobs=1, backend="threads", inner_threads=None):
+        """
+        Args:
+            models (list): Pipelines appris, un par cible.
+            shared_preprocess (bool): Exécuter une seule fois les étapes
+                "preprocess" identiques.
+            target_names (list): Noms des cibles, dans l'ordre de `models`.
+            n_jobs (int): Nombre de modèles évalués en parallèle (-1 = tous
+                les cœurs).
+            backend (str): "threads" ou "processes" (pour les estimateurs
+                qui gardent le GIL).
+            inner_threads (int): Threads BLAS/OpenMP autorisés par worker.
+                Par défaut, cœurs disponibles / n_jobs.
+        """
+        if backend not in ("threads", "processes"):
+            raise ValueError(f"backend inconnu : {backend!r}")
         self.models = models
+        self.shared_preprocess = shared_preprocess
+        self.target_names = target_names
+        self.n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        self.backend = backend
+        self.inner_threads = inner_threads
+        if shared_preprocess:
+            self._groups = self._group_by_preprocess()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("_local", "_compiled", "_executor"):
+            state.pop(key, None)
+        return state
+
+    def use_forest(self, forest):
+        """Évalue les cibles couvertes par `forest` (tree_ensemble.ForestArrays)
+        avec l'évaluateur numpy au lieu de leur modèle.
+
+        La forêt travaille sur la sortie de l'étape "preprocess" : le mode
+        préprocesseur partagé est donc activé.
+        """
+        if self._groups is None:
+            self.shared_preprocess = True
+            self._groups = self._group_by_preprocess()
+        self._forest = forest
+        return self
+
+    def compile_trees(self, X_check=None, tolerance=1e-4):
+        """Convertit les ensembles d'arbres en tableaux numpy et les active.
+
+        Avec `X_check`, seules les cibles dont les sorties correspondent aux
+        modèles d'origine (à `tolerance` près) sont converties.
+
+        Returns:
+            dict: {nom de cible: raison} pour les cibles non converties.
+        """
+        from tree_ensemble import export_forest
+        forest = export_forest(self.models, X_check, tolerance)
+        self.use_forest(forest)
+        names = self.target_names or list(range(len(self.models)))
+        return {names[i]: raison for i, raison in forest.non_supportes.items()}
+
+    def close(self):
+        """Arrête le pool de workers, s'il existe."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _group_by_preprocess(self):
+        """Regroupe les modèles dont l'étape "preprocess" est identique.
+
+        Deux préprocesseurs sont considérés identiques si leur empreinte
+        joblib (paramètres + état appris) est la même. Chaque groupe est un
+        couple (preprocess, [(indice, modèle final), ...]).
+        """
+        groups = {}
+        for i, model in enumerate(self.models):
+            preprocess, final = split_preprocess(model)
+            key = None if preprocess is None else joblib_hash(preprocess)
+            if key not in groups:
+                groups[key] = (preprocess, [])
+            groups[key][1].append((i, final))
+        return list(groups.values())
+
+    def _compile(self):
+        """Prépare le chemin rapide de predict_one.
+
+        Renvoie un CompiledPreprocess si tous les modèles partagent le même
+        préprocesseur et qu'il est compilable, sinon None.
+        """
+        groups = self._groups if self._groups is not None else self._group_by_preprocess()
+        if len(groups) != 1 or groups[0][0] is None:
+            return None
+        try:
+            return CompiledPreprocess(groups[0][0])
+        except (NotImplementedError, AttributeError):
+            return None
+
+    def _final_models(self):
+        if self._finals is None:
+            self._finals = [split_preprocess(m)[1] for m in self.models]
+        return self._finals
+
+    def _get_executor(self):
+        if self._executor is None:
+            inner = self.inner_threads or max(1, (os.cpu_count() or 1) // self.n_jobs)
+            if self.backend == "processes":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.n_jobs, initializer=_init_worker,
+                    initargs=(self.models, inner),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.n_jobs, initializer=_init_thread,
+                                                    initargs=(inner,))
+        return self._executor
+
+    def _predict_each(self, inputs, finals=False):
+        """Appelle predict du modèle i sur inputs[i], en parallèle si n_jobs > 1.
+
+        `finals` indique qu'on appelle les modèles finaux (sans preprocess).
+        """
+        estimators = self._final_models() if finals else self.models
+        predictions = [None] * len(estimators)
+        if finals and self._forest is not None:
+            # Toutes les cibles converties en un seul parcours vectorisé
+            forest_predictions = self._forest.predict(inputs)
+            for j, i in enumerate(self._forest.targets):
+                predictions[i] = forest_predictions[:, j]
+        todo = [i for i, p in enumerate(predictions) if p is None]
+        if self.n_jobs == 1:
+            for i in todo:
+                predictions[i] = estimators[i].predict(inputs[i])
+            return predictions
+        executor = self._get_executor()
+        if self.backend == "processes":
+            kind = "finals" if finals else "models"
+            futures = {i: executor.submit(_worker_predict, kind, i, inputs[i]) for i in todo}
+        else:
+            futures = {i: executor.submit(estimators[i].predict, inputs[i]) for i in todo}
+        for i, future in futures.items():
+            predictions[i] = future.result()
+        return predictions
+
+    def _row_buffer(self, n_features):
+        # Un tampon préalloué par thread : Streamlit sert chaque session
+        # dans son propre thread.
+        if self._local is None:
+            self._local = threading.local()
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            buffer = self._local.buffer = np.zeros((1, n_features))
+        return buffer
+
+    def _target_index(self):
+        if self._index is None:
+            names = self.target_names if self.target_names is not None else range(len(self.models))
+            self._index = {name: i for i, name in enumerate(names)}
+        return self._index
 
     def fit(self, X, y=None):
         return self
 
     def predict(self, X):
-        import numpy as np
-        predictions = [m.predict(X) for m in self.models]
-        return np.vstack(predictions).T
\ No newline at end of file
+        if self._groups is None:
+            predictions = self._predict_each([X] * len(self.models))
+        else:
+            # Un seul transform par préprocesseur distinct, puis la même
+            # matrice transformée est envoyée à chaque modèle final.
+            inputs = [None] * len(self.models)
+            for preprocess, members in self._groups:
+                Xt = X if preprocess is None else preprocess.transform(X)
+                for i, _ in members:
+                    inputs[i] = Xt
+            predictions = self._predict_each(inputs, finals=True)
+        return np.vstack(predictions).T
+
+    def predict_one(self, row):
+        """Prédit toutes les cibles pour une seule ligne donnée en dict.
+
+        Le schéma d'entrée est vérifié une fois, les catégories sont encodées
+        depuis une table précalculée et les modèles finaux reçoivent un
+        tableau float préalloué, sans construire de DataFrame. Si le
+        préprocesseur n'est pas compilable, on repasse par predict().
+        """
+        if self._compiled is None:
+            self._compiled = self._compile() or False
+        if not self._compiled:
+            import pandas as pd
+            values = self.predict(pd.DataFrame([row]))[0]
+            return PredictionResult(self._target_index(), values)
+
+        compiled = self._compiled
+        compiled.check_schema(row)
+        Xt = compiled.transform_into(row, self._row_buffer(compiled.n_features_out))
+        predictions = self._predict_each([Xt] * len(self.models), finals=True)
+        values = np.array([p[0] for p in predictions], dtype=float)
+        return PredictionResult(self._target_index(), values)